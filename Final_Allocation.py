@@ -1,373 +1,789 @@
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
-from langchain_anthropic import ChatAnthropic
-from langchain_openai import ChatOpenAI
 import streamlit as st
 import fitz  # PyMuPDF
-import pdfplumber
 import pandas as pd
-import logging
-logging.getLogger("pdfminer").setLevel(logging.ERROR)
+import io
+import os
+import altair as alt
+from allocation import (get_available_articles, count_available_articles, create_allocation,
+                        build_network_plan, build_fair_share_plan, select_top_articles,
+                        allocation_from_picks)
+from plan_export import EXPORT_FORMATS, export_plan_bytes, read_plan
+from plan_diff import diff_plans, diff_snapshots, diff_summary
+from plan_validation import PlanValidationError, check_plan
+from extraction import extract_stock_data
+from demand_scoring import compute_demand_scores, read_store_clusters
+from multi_godown import build_multi_godown_plan, combine_godown_stock, read_godown_preferences
+from snapshot import dataset_key, list_snapshots, snapshot_path
+from scenarios import Scenario, run_scenarios
+from network_overview import compute_network_overview
+from store_master import STORE_ALIASES_FILE, load_store_aliases, normalize_store_name
+from article_families import FamilyConstraints, read_family_rules
+from dataset_registry import get_registry, load_pdf_dataset, load_snapshot_dataset
+from jobs import extraction_job, get_job_queue, plan_job
+from cpu_profile import PROFILE_QUERY_PARAM, ProfilerBusy, RerunProfiler
+from llm_router import provider_stats, stream_hedged
+from insights import (INSIGHT_SHARING, INSIGHTS_OFFLINE, SHARED_INSIGHT_MAX_AGE_HOURS, SHARING_LEVELS,
+                      InsightCache, batch_providers, generate_batched_insights, insight_inputs,
+                      insight_providers)
 
 # Page configuration
 st.set_page_config(page_title="🧥 Article Allocation Planner", layout="wide")
 
-# Utility: Extract lines from a PDF
-
-
-def extract_stock_data(file):
-    stock_entries = []
-    with pdfplumber.open(file) as pdf:
-        for page in pdf.pages:
-            lines = page.extract_text().split('\n')
-            for line in lines:
-                parts = line.strip().split()
-                if len(parts) == 2 and parts[1].isdigit():
-                    stock_entries.append({
-                        "article_number": parts[0],
-                        "quantity_available": int(parts[1])
-                    })
-    return pd.DataFrame(stock_entries)
-
-
-def extract_supply_data(file):
-    supply_entries = []
-    with pdfplumber.open(file) as pdf:
-        for page in pdf.pages:
-            lines = page.extract_text().split('\n')
-            for line in lines:
-                parts = line.strip().rsplit(" ", 2)
-                if len(parts) == 3 and parts[2].isdigit():
-                    supply_entries.append({
-                        "store_location": parts[0],
-                        "article_number": parts[1],
-                        "quantity_supplied_2024": int(parts[2])
-                    })
-    return pd.DataFrame(supply_entries)
-
-
-def extract_max_data(file):
-    max_entries = []
-    with pdfplumber.open(file) as pdf:
-        for page in pdf.pages:
-            lines = page.extract_text().split('\n')
-            for line in lines:
-                parts = line.strip().rsplit(" ", 1)
-                if len(parts) == 2 and parts[1].isdigit():
-                    max_entries.append({
-                        "store_location": parts[0],
-                        "max_quantity": int(parts[1])
-                    })
-    return pd.DataFrame(max_entries)
-
-
-# Initialize session state for page navigation
-if 'show_allocation' not in st.session_state:
-    st.session_state.show_allocation = False
-
-# CODE 1 - Initial Interface
-if not st.session_state.show_allocation:
-    # Streamlit App UI
-    st.title("🧥 Article Allocation Planner")
-
-    jacket_stock_pdf = st.file_uploader(
-        "Upload Article Stock (Godown Stock) PDF", type="pdf")
-    jacket_supply_2024_pdf = st.file_uploader(
-        "Upload Article Supply 2024 PDF", type="pdf")
-    max_pcs_pdf = st.file_uploader("Upload Max Pcs PDF", type="pdf")
-
-    if st.button("Extract Data"):
-        if jacket_stock_pdf and jacket_supply_2024_pdf and max_pcs_pdf:
-            df_stock = extract_stock_data(jacket_stock_pdf)
-            df_supply = extract_supply_data(jacket_supply_2024_pdf)
-            df_max = extract_max_data(max_pcs_pdf)
-
-            st.success("✅ PDFs successfully parsed!")
-
-            st.subheader("✅ Jacket Stock Data")
-            st.dataframe(df_stock)
-
-            st.subheader("✅ Jacket Supply 2024 Data")
-            st.dataframe(df_supply)
-
-            st.subheader("✅ Max Quantity Per Store Data")
-            st.dataframe(df_max)
-
-            st.success("✅ Data extracted successfully!")
-
-            # Convert for logic
-            store_capacities = dict(
-                zip(df_max['store_location'], df_max['max_quantity']))
-            godown_stock = dict(
-                zip(df_stock['article_number'], df_stock['quantity_available']))
-            articles_sent_in_2024 = (
-                df_supply.groupby('store_location')['article_number']
-                .apply(lambda x: sorted(list(set(x)))).to_dict()
-            )
-
-            # Show logic dictionaries
-            st.subheader("📦 Godown Stock")
-            st.json(dict(list(godown_stock.items())[:5]))
-
-            st.subheader("📤 Articles Sent in 2024")
-            # Show only first 5 stores and limit each store's articles to top 5
-            short_articles_sent = {
-                store: articles[:5]  # take only first 5 articles
-                # only first 5 stores
-                for store, articles in list(articles_sent_in_2024.items())[:5]
-            }
-            st.json(short_articles_sent)
-
-            st.subheader("🏬 Store Capacities")
-            st.json(dict(list(store_capacities.items())[:5]))
-
-            # Save extracted data in session_state for use in Code 2
-            st.session_state.df_stock = df_stock
-            st.session_state.df_supply = df_supply
-            st.session_state.df_max = df_max
-
-            st.session_state.store_capacities = store_capacities
-            st.session_state.godown_stock = godown_stock
-            st.session_state.articles_sent_in_2024 = articles_sent_in_2024
-
-        else:
-            st.warning("⚠️ Please upload all 3 PDFs before extracting.")
-
-    all_pdfs_uploaded = max_pcs_pdf and jacket_stock_pdf and jacket_supply_2024_pdf
-
-    if st.button("Show Allocation Plan", type="primary", disabled=not all_pdfs_uploaded):
-        st.session_state.show_allocation = True
+# Derived data stays cached for about as many datasets as the registry keeps
+# warm, and a few plan settings (ranking, cluster table, family rules) of each
+CACHED_DATASETS = int(os.getenv("CACHED_DATASETS", "8"))
+CACHED_PLAN_SETTINGS = 4
+CACHED_STORE_ALLOCATIONS = 4096
+
+
+@st.cache_resource(show_spinner=False, max_entries=CACHED_DATASETS)
+def clustered_demand_scores(dataset_key, store_clusters_csv, _df_supply):
+    return compute_demand_scores(_df_supply, read_store_clusters(io.BytesIO(store_clusters_csv)))
+
+
+# Number of eligible articles per store; read-only and shared by all sessions on the dataset
+# (only the counts are kept: the lists would hold stores x articles entries)
+@st.cache_resource(show_spinner=False, max_entries=CACHED_DATASETS)
+def eligible_counts(dataset_key, _dataset):
+    return count_available_articles(
+        _dataset.store_capacities, _dataset.godown_stock, _dataset.articles_sent_in_2024)
+
+
+# Family rules compiled once per dataset and rule set
+@st.cache_resource(show_spinner=False, max_entries=CACHED_DATASETS * CACHED_PLAN_SETTINGS)
+def compiled_family_constraints(dataset_key, family_rules, _dataset):
+    return FamilyConstraints(_dataset.article_families, list(family_rules))
+
+
+# Every store's picks in one batched pass, shared by all sessions on the dataset
+# and ranking; used when no family rules apply
+@st.cache_resource(show_spinner=False, max_entries=CACHED_DATASETS * CACHED_PLAN_SETTINGS)
+def store_picks(dataset_key, settings_key, _dataset, _demand_scores):
+    return select_top_articles(_dataset.store_capacities, _dataset.godown_stock,
+                               _dataset.articles_sent_in_2024, _demand_scores)
+
+
+@st.cache_data(show_spinner=False, max_entries=CACHED_STORE_ALLOCATIONS)
+def cached_store_allocation(dataset_key, store, settings_key, _dataset, _demand_scores,
+                            _family_constraints):
+    if _family_constraints is None:
+        return allocation_from_picks(
+            store, _dataset.store_capacities, _dataset.godown_stock,
+            store_picks(dataset_key, settings_key, _dataset, _demand_scores)[store])
+    # With family rules, only this store's eligible articles are listed
+    available_articles = get_available_articles(
+        {store: _dataset.store_capacities[store]}, _dataset.godown_stock,
+        _dataset.articles_sent_in_2024)
+    return create_allocation(
+        store, _dataset.store_capacities, _dataset.godown_stock,
+        available_articles, _demand_scores, _family_constraints)
+
+
+# Network aggregates, computed once per plan version (dataset, ranking, network mode)
+@st.cache_data(show_spinner=False, max_entries=CACHED_DATASETS * CACHED_PLAN_SETTINGS)
+def cached_network_overview(dataset_key, settings_key, network_mode, _dataset, _demand_scores,
+                            _family_constraints):
+    build_plan = build_fair_share_plan if network_mode == "Fair share" else build_network_plan
+    plan = build_plan(_dataset.store_capacities, _dataset.godown_stock,
+                      _dataset.articles_sent_in_2024, demand_scores=_demand_scores,
+                      family_constraints=_family_constraints)
+    return compute_network_overview(plan, _dataset.store_capacities, _dataset.godown_stock)
+
+
+# The network plan for the current settings, built by _build_plan once per plan
+# version; godown_keys and preferences_key identify the other godowns' uploads
+@st.cache_data(show_spinner=False, max_entries=CACHED_DATASETS * CACHED_PLAN_SETTINGS)
+def cached_current_plan(dataset_key, settings_key, network_mode, godown_keys, preferences_key,
+                        _build_plan):
+    return _build_plan()[0]
+
+
+# Finished insight texts shared by every session; switching back to a store is free
+@st.cache_resource(show_spinner=False)
+def insight_cache():
+    return InsightCache()
+
+
+# Live progress of the background job whose id is in st.session_state[state_key];
+# on success on_done(result) attaches the result to the session. The job and its
+# files are discarded once attached or dismissed
+@st.fragment(run_every=1.0)
+def job_progress(state_key, on_done):
+    queue = get_job_queue()
+    job = queue.get(st.session_state[state_key])
+    if job is None or job.status == "done":
+        del st.session_state[state_key]
+        if job is not None:
+            on_done(job.result)
+            queue.discard(job.id)
         st.rerun()
+    elif job.finished:
+        st.error(f"❌ Background {job.kind} job {job.status}" + (f": {job.error}" if job.error else ""))
+        if st.button("Dismiss", key=f"dismiss_{job.id}"):
+            del st.session_state[state_key]
+            queue.discard(job.id)
+            st.rerun()
+    else:
+        label = f"{job.stage}: {job.done}/{job.total}" if job.total else job.status.capitalize() + "..."
+        st.progress(job.fraction, text=label)
+        if st.button("Cancel", key=f"cancel_{job.id}"):
+            queue.cancel(job.id)
+
+
+# Store names an operator should confirm: similarity matches, and names that matched nothing
+def store_match_review(matches, key):
+    if matches.fuzzy:
+        st.warning("⚠️ These store names were matched by similarity only. Confirm each match, "
+                   "or correct it, in the alias table below.")
+        fuzzy = pd.DataFrame([(name, store, score) for name, (store, score) in matches.fuzzy.items()],
+                             columns=["alias", "store_location", "similarity"])
+        st.dataframe(fuzzy, hide_index=True, use_container_width=True)
+        aliases = pd.concat([
+            pd.DataFrame(list(load_store_aliases().items()), columns=["alias", "store_location"]),
+            fuzzy[["alias", "store_location"]]], ignore_index=True)
+        st.download_button("Download alias table", aliases.to_csv(index=False),
+                           file_name=os.path.basename(STORE_ALIASES_FILE), mime="text/csv", key=f"aliases_{key}")
+        st.caption(f"Save it as {STORE_ALIASES_FILE} with the confirmed or corrected rows and extract "
+                   "again; aliases are exact matches, so confirmed names are no longer flagged.")
+    if matches.unresolved:
+        st.warning(f"⚠️ Store names with no match: {', '.join(matches.unresolved)}. "
+                   f"Add them to {STORE_ALIASES_FILE} if they are another spelling of a store.")
+
+
+def attach_extracted_dataset(result):
+    key = result["dataset_key"]
+    st.session_state.dataset_handle = get_registry().acquire(
+        key, lambda: load_snapshot_dataset(key))
+    st.session_state.show_allocation = True
+
+
+# Ends the profile of the rerun that started it, however the rerun ends
+def finish_rerun_profile():
+    profiler = st.session_state.pop("rerun_profiler", None)
+    if profiler is not None:
+        st.session_state.rerun_profile = profiler.finish()
+
+
+def rerun_profile_view():
+    profile = st.session_state.get("rerun_profile")
+    if profile is None:
+        st.caption("Switch on, then use the app; the next rerun's profile shows here.")
+        return
+    st.caption(f"Last profiled rerun: {profile.seconds:.2f}s of CPU in the script thread. "
+               "Click a column to sort; open the download in snakeviz for a flame view.")
+    st.dataframe(profile.to_frame(), hide_index=True, use_container_width=True)
+    st.download_button("Download profile (.prof)", profile.to_bytes(),
+                       file_name="rerun.prof", mime="application/octet-stream")
+
+
+# CPU profile of each rerun, off unless switched on here or opened with ?profile=1
+profile_box = st.sidebar.expander("⏱️ CPU profile")
+with profile_box:
+    profiling = st.toggle("Profile each rerun", key="profile_reruns",
+                          value=st.query_params.get(PROFILE_QUERY_PARAM) == "1")
+if profiling:
+    try:
+        st.session_state.rerun_profiler = RerunProfiler()
+    except ProfilerBusy:
+        profile_box.info("⏳ Profiler busy: another session's rerun is being profiled. "
+                         "This rerun is not profiled; try again shortly.")
+
+try:
+    # Initialize session state for page navigation
+    if 'show_allocation' not in st.session_state:
+        st.session_state.show_allocation = False
+
+    # CODE 1 - Initial Interface
+    if not st.session_state.show_allocation:
+        # Streamlit App UI
+        st.title("🧥 Article Allocation Planner")
+
+        jacket_stock_pdf = st.file_uploader(
+            "Upload Article Stock (Godown Stock) PDF", type="pdf")
+        jacket_supply_2024_pdf = st.file_uploader(
+            "Upload Article Supply 2024 PDF", type="pdf")
+        max_pcs_pdf = st.file_uploader("Upload Max Pcs PDF", type="pdf")
+
+        if st.button("Extract Data"):
+            if jacket_stock_pdf and jacket_supply_2024_pdf and max_pcs_pdf:
+                # Sessions uploading the same PDFs share one parsed dataset
+                key = dataset_key(jacket_stock_pdf, jacket_supply_2024_pdf, max_pcs_pdf)
+                try:
+                    handle = get_registry().acquire(key, lambda: load_pdf_dataset(
+                        key, jacket_stock_pdf, jacket_supply_2024_pdf, max_pcs_pdf))
+                except ValueError as e:
+                    st.error(f"❌ {e}")
+                    st.stop()
+                dataset = handle.dataset
+
+                st.success("✅ PDFs successfully parsed!")
+
+                st.subheader("✅ Jacket Stock Data")
+                st.dataframe(dataset.df_stock)
+
+                st.subheader("✅ Jacket Supply 2024 Data")
+                st.dataframe(dataset.df_supply)
+
+                st.subheader("✅ Max Quantity Per Store Data")
+                st.dataframe(dataset.df_max)
+
+                st.success("✅ Data extracted successfully!")
+                st.caption(f"💾 Dataset `{key}`")
+
+                # Supply-report store names resolved only approximately or not at all (see store_master.py)
+                store_match_review(dataset.store_matches, "extract")
+
+                # Show logic dictionaries
+                st.subheader("📦 Godown Stock")
+                st.json(dict(list(dataset.godown_stock.items())[:5]))
+
+                st.subheader("📤 Articles Sent in 2024")
+                # Show only first 5 stores and limit each store's articles to top 5
+                short_articles_sent = {
+                    store: sorted(articles)[:5]  # take only first 5 articles
+                    # only first 5 stores
+                    for store, articles in list(dataset.articles_sent_in_2024.items())[:5]
+                }
+                st.json(short_articles_sent)
+
+                st.subheader("🏬 Store Capacities")
+                st.json(dict(list(dataset.store_capacities.items())[:5]))
+
+                # The session keeps only a handle; the data lives in the shared registry
+                st.session_state.dataset_handle = handle
+
+            else:
+                st.warning("⚠️ Please upload all 3 PDFs before extracting.")
+
+        all_pdfs_uploaded = max_pcs_pdf and jacket_stock_pdf and jacket_supply_2024_pdf
+
+        if st.button("Show Allocation Plan", type="primary", disabled=not all_pdfs_uploaded):
+            st.session_state.show_allocation = True
+            st.rerun()
 
-    # Show helper text when button is disabled
-    if not all_pdfs_uploaded:
-        st.caption("📋 Upload all 3 PDFs to enable the allocation plan")
-
+        # Show helper text when button is disabled
+        if not all_pdfs_uploaded:
+            st.caption("📋 Upload all 3 PDFs to enable the allocation plan")
 
-# CODE 2 - Allocation Plan Interface
-else:
-    # API Key input in sidebar
-    with st.sidebar:
-        st.title("API Configuration")
-        api_key = st.text_input(
-            "Enter OpenAI API", type="password")
-        backup_api_key = st.text_input("Enter Anthropic API Key (Optional)", type="password")
+        # Large reports can be parsed by a background job that survives reruns and refreshes
         st.markdown("---")
-        st.markdown("### About This App")
-        st.info(
-            "This application helps allocate articles to different stores based on "
-            "current godown stock and previous allocation history. It uses OpenAI API or Anthropic API "
-            "to provide AI-powered insights about the allocation strategy."
-        )
+        st.subheader("⏳ Background Extraction")
+        if st.button("Extract in Background", disabled=not all_pdfs_uploaded):
+            key = dataset_key(jacket_stock_pdf, jacket_supply_2024_pdf, max_pcs_pdf)
+            st.session_state.extraction_job = get_job_queue().submit(
+                "extract", extraction_job, key, jacket_stock_pdf.getvalue(),
+                jacket_supply_2024_pdf.getvalue(), max_pcs_pdf.getvalue())
+        if st.session_state.get("extraction_job"):
+            job_progress("extraction_job", attach_extracted_dataset)
+        else:
+            # A refreshed page starts a new session; pick its job up again by id
+            resumable = [job for job in get_job_queue().jobs()
+                         if job.kind == "extract" and job.status in ("queued", "running", "done")][:5]
+            if resumable:
+                resume_id = st.selectbox(
+                    "Resume a background extraction", options=[job.id for job in resumable],
+                    format_func=lambda job_id: f"{job_id} ({get_job_queue().get(job_id).status})")
+                if st.button("Resume"):
+                    st.session_state.extraction_job = resume_id
+                    st.rerun()
+
+        # Reuse a previously parsed dataset instead of uploading the PDFs again
+        snapshots = list_snapshots()
+        if snapshots:
+            st.markdown("---")
+            st.subheader("💾 Saved Snapshots")
+            snapshot_key = st.selectbox(
+                "Load a previously extracted dataset",
+                options=[key for key, _ in snapshots],
+                format_func=lambda key: f"{key} ({dict(snapshots)[key]['created_at']})")
+            if st.button("Load Snapshot"):
+                st.session_state.dataset_handle = get_registry().acquire(
+                    snapshot_key, lambda: load_snapshot_dataset(snapshot_key))
+                st.session_state.show_allocation = True
+                st.rerun()
+
+
+    # CODE 2 - Allocation Plan Interface
+    else:
+        # API Key input in sidebar
+        with st.sidebar:
+            st.title("API Configuration")
+            api_key = st.text_input(
+                "Enter OpenAI API", type="password")
+            backup_api_key = st.text_input("Enter Anthropic API Key (Optional)", type="password")
+            use_offline_insights = st.toggle(
+                "Offline insights", value=INSIGHTS_OFFLINE,
+                help="Rule-based stand-in for the AI model; needs no API key")
+            insight_sharing = st.select_slider(
+                "Share insights across similar stores", options=["off", *SHARING_LEVELS],
+                value=INSIGHT_SHARING, format_func=str.capitalize,
+                help="Stores with similar capacity, fill rate and eligible articles reuse one answer, "
+                     "filled in with their own name and numbers. Coarse shares more answers and "
+                     "needs fewer model calls; fine keeps advice closer to each store.")
+            shared_insight_max_age = st.number_input(
+                "Shared insight max age (hours)", min_value=0.0, value=SHARED_INSIGHT_MAX_AGE_HOURS,
+                disabled=insight_sharing == "off",
+                help="Shared answers older than this are generated afresh") * 3600
+            st.markdown("---")
+            st.markdown("### About This App")
+            st.info(
+                "This application helps allocate articles to different stores based on "
+                "current godown stock and previous allocation history. It uses OpenAI API or Anthropic API "
+                "to provide AI-powered insights about the allocation strategy."
+            )
 
-        # Back button
-        if st.button("← Back to Data Upload"):
-            st.session_state.show_allocation = False
-            st.rerun()
+            st.markdown("---")
+            st.markdown("### Allocation Settings")
+            rank_by = st.radio(
+                "Rank articles by", options=["Godown stock", "2024 demand"],
+                help="2024 demand ranks each store's eligible articles by how much of them "
+                     "similar stores received in 2024.")
+            store_clusters_csv = st.file_uploader(
+                "Store clusters CSV (store_location, cluster)", type="csv",
+                disabled=rank_by != "2024 demand")
+            network_mode = st.radio(
+                "Network allocation", options=["Store order", "Fair share"],
+                help="Fair share splits scarce articles across stores in proportion to "
+                     "their maximum capacity instead of serving stores in list order.")
+            with st.expander("Article family rules"):
+                st.caption("Prefix selects articles (e.g. SDZ, Z23); leave empty for all. "
+                           "Max per store caps each matched family; exclude stores is a "
+                           "comma-separated list, or * for every store.")
+                family_rule_rows = st.data_editor(
+                    pd.DataFrame({
+                        "prefix": pd.Series(dtype="str"),
+                        "max_per_store": pd.Series(dtype="Int64"),
+                        "exclude_stores": pd.Series(dtype="str"),
+                    }),
+                    num_rows="dynamic", hide_index=True, key="family_rule_rows")
+
+            # Back button
+            if st.button("← Back to Data Upload"):
+                st.session_state.show_allocation = False
+                st.rerun()
+
+        # Main content
+        st.title("🧥 Article Allocation Planner")
+
+        dataset_handle = st.session_state.get("dataset_handle")
+
+        # Check for missing values
+        if dataset_handle is None:
+            st.error(
+                "Required data not found. Please upload the PDFs in the first interface before using this allocation page.")
+            st.stop()
+
+        dataset = dataset_handle.dataset
+        store_capacities = dataset.store_capacities
+        godown_stock = dataset.godown_stock
+        articles_sent_in_2024 = dataset.articles_sent_in_2024
+
+        matches = dataset.store_matches
+        if matches.fuzzy or matches.unresolved:
+            with st.expander(f"⚠️ Store names to review ({len(matches.fuzzy) + len(matches.unresolved)})"):
+                store_match_review(matches, "dataset")
+
+        # Demand scores are precomputed with the dataset; a cluster table rescores once per upload
+        demand_scores = None
+        if rank_by == "2024 demand":
+            demand_scores = dataset.demand_scores
+            if store_clusters_csv is not None:
+                demand_scores = clustered_demand_scores(
+                    dataset.cache_key, store_clusters_csv.getvalue(), dataset.df_supply)
+
+        family_rules = tuple(read_family_rules(family_rule_rows))
+        family_constraints = (compiled_family_constraints(dataset.cache_key, family_rules, dataset)
+                              if family_rules else None)
+
+        # Plan settings as a cache key; a cluster table is identified by its content
+        settings_key = (rank_by, dataset_key(store_clusters_csv)
+                        if demand_scores is not None and store_clusters_csv is not None else None,
+                        family_rules)
+
+        st.markdown(
+            """
+            <style>
+            /* closed dropdown */
+            div[data-baseweb="select"] > div {
+                background-color: #102D48;   /* navy  */
+                color: #ffffff;              /* white text */
+            }
+            /* open menu background */
+            div[data-baseweb="popover"] ul {
+                background-color: #102D48;
+            }
+            /* option hover colour */
+            div[data-baseweb="popover"] li:hover {
+                background-color: #0055aa !important;
+            }
+            </style>
+            """,
+            unsafe_allow_html=True
+        )
 
-    # Main content
-    st.title("🧥 Article Allocation Planner")
-
-    store_capacities = st.session_state.get("store_capacities")
-    godown_stock = st.session_state.get("godown_stock")
-    articles_sent_in_2024 = st.session_state.get("articles_sent_in_2024")
-
-    # Check for missing values
-    if store_capacities is None or godown_stock is None or articles_sent_in_2024 is None:
-        st.error(
-            "Required data not found. Please upload the PDFs in the first interface before using this allocation page.")
-        st.stop()
-
-    # Calculate available articles for each store
-    available_articles = {}
-    for store in store_capacities:
-        available_articles[store] = [article for article in godown_stock
-                                     if article not in articles_sent_in_2024[store] and godown_stock[article] > 0]
-
-    # Function to create optimal allocation based on stock availability
-    def create_allocation(store):
-        available = available_articles[store]
-        max_capacity = store_capacities[store]
-
-        # Sort by quantity available (highest first)
-        sorted_articles = sorted(
-            available, key=lambda x: godown_stock[x], reverse=True)
-
-        allocation = []
-        total_allocated = 0
-
-        # Allocate articles respecting capacity constraints
-        for article in sorted_articles:
-            if total_allocated < max_capacity and godown_stock[article] > 0:
-                # Allocate one piece of this article
-                allocation.append({
-                    "article": article,
-                    "quantity": 1,
-                    "available_in_godown": godown_stock[article]
-                })
-                total_allocated += 1
-
-                if total_allocated >= max_capacity:
-                    break
-
-        capacity_percentage = (total_allocated / max_capacity * 100)
-
-        return {
-            "allocation": allocation,
-            "total_allocated": total_allocated,
-            "capacity_percentage": round(capacity_percentage, 1)
-        }
-
-    # Create columns for store selection and info
-    col1, col2 = st.columns([1, 2])
-
-    st.markdown(
-        """
-        <style>
-        /* closed dropdown */
-        div[data-baseweb="select"] > div {
-            background-color: #102D48;   /* navy  */
-            color: #ffffff;              /* white text */
-        }
-        /* open menu background */
-        div[data-baseweb="popover"] ul {
-            background-color: #102D48;
-        }
-        /* option hover colour */
-        div[data-baseweb="popover"] li:hover {
-            background-color: #0055aa !important;
-        }
-        </style>
-        """,
-        unsafe_allow_html=True
-    )
-
-    with col1:
-        # Store selection
-        selected_store = st.selectbox(
-            "Select Store", options=list(store_capacities.keys()))
-
-        # Calculate allocation for selected store
-        store_allocation = create_allocation(selected_store)
-
-        # Display store information
-        st.subheader("Store Information")
-        st.metric("Maximum Capacity",
-                  f"{store_capacities[selected_store]} pcs")
-        st.metric(
-            "Allocated", f"{store_allocation['total_allocated']} pcs ({store_allocation['capacity_percentage']}%)")
-        st.metric("Available Articles",
-                  f"{len(available_articles[selected_store])} (not sent in 2024)")
-
-    with col2:
-        # LangChain integration for AI insights (if API key is provided)
-        if api_key:
-            try:
-                st.subheader("AI-Powered Allocation Insights")
-                with st.spinner("Generating insights..."):
-                    # Initialize LangChain with the OpenAI API
-                    llm = ChatOpenAI(
-                        model="gpt-4o-mini",
-                        temperature=0,
-                        openai_api_key=api_key
+        # The dashboard is split into fragments: an interaction reruns only the
+        # panel it belongs to, and each panel reads cached inputs
+
+        @st.fragment
+        def insights_panel(selected_store, store_allocation):
+            # LangChain integration for AI insights (if API key is provided)
+            if api_key or backup_api_key or use_offline_insights:
+                try:
+                    st.subheader("AI-Powered Allocation Insights")
+                    available_counts = eligible_counts(dataset.cache_key, dataset)
+                    inputs = insight_inputs(
+                        selected_store, store_capacities[selected_store],
+                        store_allocation["total_allocated"], store_allocation["capacity_percentage"],
+                        available_counts[selected_store])
+                    insights = insight_cache().lookup(
+                        inputs, use_offline_insights, insight_sharing, shared_insight_max_age)
+                    if insights is None:
+                        # Shown as it is generated; only the finished text is cached
+                        insights = st.write_stream(stream_hedged(
+                            insight_providers(api_key, backup_api_key, use_offline_insights), inputs))
+                        insight_cache().remember(inputs, insights, use_offline_insights)
+                    else:
+                        st.write(insights)
+
+                    # Every store in a few JSON prompts; switching stores then reads the cache
+                    if st.button("Generate insights for all stores"):
+                        store_inputs = []
+                        for store in store_capacities:
+                            allocation = cached_store_allocation(
+                                dataset.cache_key, store, settings_key, dataset, demand_scores,
+                                family_constraints)
+                            store_inputs.append(insight_inputs(
+                                store, store_capacities[store], allocation["total_allocated"],
+                                allocation["capacity_percentage"], available_counts[store]))
+                        bar = st.progress(0.0, text="Generating insights...")
+                        summary = generate_batched_insights(
+                            store_inputs,
+                            batch_providers(api_key, backup_api_key, use_offline_insights),
+                            insight_cache(), use_offline_insights,
+                            progress=lambda done, total: bar.progress(
+                                done / total,
+                                text=f"Insights for {done}/{total} stores"),
+                            sharing=insight_sharing, max_age=shared_insight_max_age)
+                        bar.empty()
+                        st.caption(
+                            f"{summary['answered']}/{summary['stores']} stores answered in "
+                            f"{summary['calls']} calls, ~{summary['prompt_tokens']:,} prompt tokens "
+                            f"(~{summary['single_prompt_tokens']:,} one store at a time); "
+                            f"{summary['shared']} more share a similar store's answer")
+                        if summary["failed"]:
+                            st.warning(f"No valid insights for: {', '.join(summary['failed'])}")
+
+                except Exception as e:
+                    st.error(f"Error connecting to the AI providers: {str(e)}")
+                cache_stats = insight_cache().stats()
+                if cache_stats["lookups"]:
+                    st.caption(
+                        f"Insight cache: {cache_stats['hit_rate']:.0%} of {cache_stats['lookups']} "
+                        f"lookups answered without a model call ({cache_stats['exact_hits']} exact, "
+                        f"{cache_stats['shared_hits']} shared)")
+                stats = provider_stats()
+                if stats:
+                    with st.expander("Provider latency"):
+                        st.dataframe(pd.DataFrame.from_dict(stats, orient="index"),
+                                     use_container_width=True)
+            else:
+                st.info(
+                    "Enter your OpenAI API/ Anthropic key in the sidebar to get AI-powered allocation insights.")
+
+        @st.fragment
+        def allocation_table_panel(selected_store, store_allocation):
+            # Display allocation table
+            st.subheader(f"Recommended Allocation for {selected_store}")
+
+            if store_allocation["allocation"]:
+                # Convert allocation to DataFrame for display
+                df = pd.DataFrame(store_allocation["allocation"])
+                st.dataframe(
+                    df,
+                    column_config={
+                        "article": "Article No",
+                        "quantity": "Allocated Quantity",
+                        "available_in_godown": "Available in Godown"
+                    },
+                    use_container_width=True
+                )
+
+                # Download button for allocation data, validated like the network export
+                try:
+                    check_plan(df.rename(columns={"article": "article_number"})
+                               .assign(store_location=selected_store),
+                               dataset.df_stock, dataset.df_supply, dataset.df_max)
+                except PlanValidationError as e:
+                    st.error(f"❌ {e}")
+                    st.dataframe(e.violations, use_container_width=True)
+                else:
+                    csv = df.to_csv(index=False)
+                    st.download_button(
+                        label="Download Allocation as CSV",
+                        data=csv,
+                        file_name=f"{selected_store}_allocation.csv",
+                        mime="text/csv"
                     )
+            else:
+                st.error("No articles available for allocation that weren't sent in 2024.")
+
+        @st.fragment
+        def allocation_charts_panel(selected_store, store_allocation):
+            # Data visualization
+            if not store_allocation["allocation"]:
+                return
+            st.subheader("Allocation Visualization")
+
+            # Create columns for charts
+            chart_col1, chart_col2 = st.columns(2)
+
+            with chart_col1:
+                # Capacity utilization chart
+                allocated = store_allocation["total_allocated"]
+                remaining = store_capacities[selected_store] - allocated
+                st.subheader("Capacity Utilization")
+                st.bar_chart(
+                    {"Pieces": [allocated, remaining]},
+                    y="Pieces",
+                )
+
+            with chart_col2:
+                # Top allocated articles
+                top_articles = store_allocation["allocation"][:10]
+                df_top = pd.DataFrame({
+                    "Article": [item["article"] for item in top_articles],
+                    "Available in Godown": [item["available_in_godown"] for item in top_articles]
+                })
 
-                    # Create prompt template
-                    prompt_template = PromptTemplate(
-                        input_variables=["store", "capacity",
-                                         "allocated", "percentage"],
-                        template="""
-                        You are a retail inventory management expert. Analyze the following allocation data for {store} store:
-                        - Maximum capacity: {capacity} pieces
-                        - Currently allocated: {allocated} pieces ({percentage}% of capacity)
-                        
-                        Provide 3 concise bullet points of insights or recommendations to optimize this jacket allocation.
-                        Focus on inventory turnover, store-specific strategy, and efficiency.
-                        """
+                st.subheader("Top Allocated Articles (Available Stock)")
+                st.bar_chart(
+                    df_top.set_index("Article")
+                )
+
+        # Switching stores reruns this panel (and the panels inside it) only
+        @st.fragment
+        def store_panel():
+            # Create columns for store selection and info
+            col1, col2 = st.columns([1, 2])
+
+            with col1:
+                # Store selection
+                selected_store = st.selectbox(
+                    "Select Store", options=list(store_capacities.keys()))
+
+                # Calculate allocation for selected store
+                store_allocation = cached_store_allocation(
+                    dataset.cache_key, selected_store, settings_key, dataset, demand_scores,
+                    family_constraints)
+                available_counts = eligible_counts(dataset.cache_key, dataset)
+
+                # Display store information
+                st.subheader("Store Information")
+                st.metric("Maximum Capacity",
+                          f"{store_capacities[selected_store]} pcs")
+                st.metric(
+                    "Allocated", f"{store_allocation['total_allocated']} pcs ({store_allocation['capacity_percentage']}%)")
+                st.metric("Available Articles",
+                          f"{available_counts[selected_store]} (not sent in 2024)")
+
+            with col2:
+                insights_panel(selected_store, store_allocation)
+
+                # Allocation summary
+                st.subheader("Allocation Summary")
+                st.markdown(f"""
+                This allocation plan includes articles that:
+                - Are currently available in the godown
+                - Were NOT sent to **{selected_store}** in 2024
+                - Prioritizes articles with {"highest 2024 demand in similar stores" if demand_scores else "highest stock quantities"}
+                """)
+
+            allocation_table_panel(selected_store, store_allocation)
+            allocation_charts_panel(selected_store, store_allocation)
+
+        @st.fragment
+        def overview_panel():
+            st.subheader("Network Overview")
+            overview = cached_network_overview(
+                dataset.cache_key, settings_key, network_mode, dataset, demand_scores, family_constraints)
+            totals = overview.totals()
+
+            metric_cols = st.columns(4)
+            metric_cols[0].metric("Network Fill Rate", f"{totals['fill_rate']}%")
+            metric_cols[1].metric("Unfilled Capacity", f"{totals['unfilled']} pcs")
+            metric_cols[2].metric("Stores at Capacity", f"{totals['full_stores']} / {len(overview.stores)}")
+            metric_cols[3].metric("Articles Fully Allocated",
+                                  f"{totals['depleted_articles']} / {len(overview.articles)}")
+
+            # Utilization heatmap: one cell per store, in store order
+            st.altair_chart(
+                alt.Chart(overview.heatmap()).mark_rect().encode(
+                    x=alt.X("column:O", axis=None),
+                    y=alt.Y("row:O", axis=None),
+                    color=alt.Color("utilization:Q", scale=alt.Scale(domain=[0, 1], scheme="blues"),
+                                    title="Utilization"),
+                    tooltip=["store", "allocated", "capacity",
+                             alt.Tooltip("utilization:Q", format=".0%")],
+                ),
+                use_container_width=True)
+
+            overview_col1, overview_col2 = st.columns(2)
+            with overview_col1:
+                st.markdown("**Stock depletion per article**")
+                st.bar_chart(overview.depletion_histogram(), y="articles")
+                st.dataframe(overview.top_depleted(), use_container_width=True)
+            with overview_col2:
+                st.markdown("**Stores with the most unfilled capacity**")
+                st.bar_chart(overview.top_unfilled(), y="unfilled", horizontal=True)
+
+        @st.fragment
+        def network_panel():
+            # Network-wide export: all stores against one shared stock ledger
+            st.subheader("Network-wide Allocation Export")
+            export_col1, export_col2 = st.columns([1, 2])
+            with export_col1:
+                export_format = st.selectbox(
+                    "Export format", options=list(EXPORT_FORMATS.keys()))
+                with st.expander("Multi-godown sourcing (optional)"):
+                    extra_godown_pdfs = st.file_uploader(
+                        "Stock PDFs of other godowns", type="pdf", accept_multiple_files=True)
+                    godown_preferences_csv = st.file_uploader(
+                        "Store → godown preferences CSV (store_location, godown, rank)", type="csv")
+                build_in_background = st.checkbox(
+                    "Build in background", help="Keeps the page responsive while large networks are solved")
+
+            # The network plan for the current settings, with the stock table it was built from
+            def build_current_plan(progress=None):
+                if extra_godown_pdfs:
+                    # The godown from the first screen is "MAIN"; others are named after their file
+                    godown_stocks = {"MAIN": dataset.df_stock}
+                    for pdf in extra_godown_pdfs:
+                        godown_stocks[pdf.name.rsplit(".", 1)[0]] = extract_stock_data(pdf)
+                    godown_preferences = (read_godown_preferences(godown_preferences_csv)
+                                          if godown_preferences_csv else None)
+                    plan = build_multi_godown_plan(
+                        store_capacities, godown_stocks, articles_sent_in_2024, godown_preferences,
+                        demand_scores, family_constraints, progress=progress)
+                    return plan, combine_godown_stock(godown_stocks)
+                build_plan = (build_fair_share_plan if network_mode == "Fair share"
+                              else build_network_plan)
+                plan = build_plan(
+                    store_capacities, godown_stock, articles_sent_in_2024,
+                    demand_scores=demand_scores, progress=progress,
+                    family_constraints=family_constraints)
+                return plan, dataset.df_stock
+
+            def offer_plan_download(network_plan, inputs):
+                try:
+                    # Validated against the source tables before anything is written
+                    export_data = export_plan_bytes(network_plan, export_format, inputs=inputs)
+                except PlanValidationError as e:
+                    st.error(f"❌ {e}")
+                    st.dataframe(e.violations, use_container_width=True)
+                else:
+                    st.download_button(
+                        label=f"Download Network Plan ({len(network_plan)} lines)",
+                        data=export_data,
+                        file_name=f"network_allocation.{export_format}",
+                        mime=EXPORT_FORMATS[export_format][1]
                     )
 
-                    # Create chain
-                    chain = LLMChain(llm=llm, prompt=prompt_template)
-
-                    # Run chain
-                    response = chain.invoke({
-                        "store": selected_store,
-                        "capacity": store_capacities[selected_store],
-                        "allocated": store_allocation["total_allocated"],
-                        "percentage": store_allocation["capacity_percentage"]
-                    })
-
-                    # Display insights
-                    st.write(response["text"])
-
-            except Exception as e:
-                st.error(f"Error connecting to OpenAI API: {str(e)}")
-        else:
-            st.info(
-                "Enter your OpenAI API/ Anthropic key in the sidebar to get AI-powered allocation insights.")
-
-        # Allocation summary
-        st.subheader("Allocation Summary")
-        st.markdown(f"""
-        This allocation plan includes articles that:
-        - Are currently available in the godown
-        - Were NOT sent to **{selected_store}** in 2024
-        - Prioritizes articles with highest stock quantities
-        """)
-
-    # Display allocation table
-    st.subheader(f"Recommended Allocation for {selected_store}")
-
-    if store_allocation["allocation"]:
-        # Convert allocation to DataFrame for display
-        df = pd.DataFrame(store_allocation["allocation"])
-        st.dataframe(
-            df,
-            column_config={
-                "article": "Article No",
-                "quantity": "Allocated Quantity",
-                "available_in_godown": "Available in Godown"
-            },
-            use_container_width=True
-        )
-
-        # Download button for allocation data
-        csv = df.to_csv(index=False)
-        st.download_button(
-            label="Download Allocation as CSV",
-            data=csv,
-            file_name=f"{selected_store}_allocation.csv",
-            mime="text/csv"
-        )
-    else:
-        st.error("No articles available for allocation that weren't sent in 2024.")
-
-    # Data visualization
-    if store_allocation["allocation"]:
-        st.subheader("Allocation Visualization")
-
-        # Create columns for charts
-        chart_col1, chart_col2 = st.columns(2)
-
-        with chart_col1:
-            # Capacity utilization chart
-            allocated = store_allocation["total_allocated"]
-            remaining = store_capacities[selected_store] - allocated
-            st.subheader("Capacity Utilization")
-            st.bar_chart(
-                {"Pieces": [allocated, remaining]},
-                y="Pieces",
-            )
-
-        with chart_col2:
-            # Top allocated articles
-            top_articles = store_allocation["allocation"][:10]
-            df_top = pd.DataFrame({
-                "Article": [item["article"] for item in top_articles],
-                "Available in Godown": [item["available_in_godown"] for item in top_articles]
-            })
-
-            st.subheader("Top Allocated Articles (Available Stock)")
-            st.bar_chart(
-                df_top.set_index("Article")
-            )
+            with export_col2:
+                if st.button("Prepare Network Export"):
+                    st.session_state.pop("plan_job_plan", None)
+                    if build_in_background:
+                        st.session_state.plan_job = get_job_queue().submit(
+                            "plan", plan_job, build_current_plan, dataset.df_supply, dataset.df_max)
+                    else:
+                        try:
+                            network_plan, stock_input = build_current_plan()
+                        except ValueError as e:
+                            # An upload under "Stock PDFs of other godowns" is not a stock report
+                            st.error(f"❌ {e}")
+                        else:
+                            offer_plan_download(network_plan, (stock_input, dataset.df_supply, dataset.df_max))
+                if st.session_state.get("plan_job"):
+                    # Read in before the job's plan file is deleted
+                    job_progress("plan_job", lambda result: st.session_state.update(
+                        plan_job_plan=read_plan(result["plan_file"], "arrow")))
+                elif st.session_state.get("plan_job_plan") is not None:
+                    # Already validated by the job
+                    offer_plan_download(st.session_state.plan_job_plan, inputs=None)
+
+            # What changed since an earlier plan or an earlier set of input PDFs
+            st.subheader("Changes Since a Previous Plan")
+            diff_col1, diff_col2 = st.columns(2)
+            with diff_col1:
+                previous_plan_file = st.file_uploader(
+                    "Previous network plan", type=list(EXPORT_FORMATS.keys()))
+                if previous_plan_file is not None:
+                    previous_plan = read_plan(
+                        previous_plan_file, previous_plan_file.name.rsplit(".", 1)[-1].lower(),
+                        stores=store_capacities)
+                    store_match_review(previous_plan.attrs["store_matches"], "previous_plan")
+                    try:
+                        current_plan = cached_current_plan(
+                            dataset.cache_key, settings_key, network_mode,
+                            tuple((pdf.name, dataset_key(pdf)) for pdf in extra_godown_pdfs or ()),
+                            dataset_key(godown_preferences_csv) if godown_preferences_csv else None,
+                            build_current_plan)
+                    except ValueError as e:
+                        st.error(f"❌ {e}")
+                    else:
+                        plan_changes = diff_plans(previous_plan, current_plan)
+                        st.dataframe(diff_summary(plan_changes), use_container_width=True, hide_index=True)
+                        st.dataframe(plan_changes, use_container_width=True, hide_index=True)
+            with diff_col2:
+                other_snapshots = [key for key, _ in list_snapshots() if key != dataset.key]
+                if other_snapshots:
+                    previous_key = st.selectbox("Compare inputs with snapshot", options=other_snapshots)
+                    input_changes = diff_snapshots(snapshot_path(previous_key), snapshot_path(dataset.key))
+                    for name, changes in input_changes.items():
+                        st.markdown(f"**{name}**: {len(changes)} changed lines")
+                        if len(changes):
+                            st.dataframe(changes, use_container_width=True, hide_index=True)
+
+        @st.fragment
+        def scenarios_panel():
+            # What-if scenarios: each row overrides the base dataset, all run in parallel
+            st.subheader("What-if Scenarios")
+            scenario_rows = st.data_editor(
+                pd.DataFrame({
+                    "name": ["Capacity +10% at MOGA", "Exclude SDZ articles", "Drop 2024 rule for DUKE NIT"],
+                    "stores": ["MOGA", "", "DUKE NIT"],
+                    "capacity_change_pct": [10, 0, 0],
+                    "exclude_prefixes": ["", "SDZ", ""],
+                    "drop_2024_rule": [False, False, True],
+                }),
+                num_rows="dynamic", use_container_width=True, key="scenario_rows")
+            if st.button("Run Scenarios"):
+                scenarios = []
+                for row in scenario_rows.dropna(subset=["name"]).itertuples():
+                    stores = tuple(normalize_store_name(store) for store in str(row.stores or "").split(",")
+                                   if store.strip())
+                    factor = 1 + (row.capacity_change_pct or 0) / 100
+                    scenarios.append(Scenario(
+                        name=row.name,
+                        capacity_factors={store: factor for store in stores} if factor != 1 else {},
+                        exclude_article_prefixes=tuple(
+                            p.strip() for p in str(row.exclude_prefixes or "").split(",") if p.strip()),
+                        ignore_2024_for=stores if row.drop_2024_rule else (),
+                        fair_share=network_mode == "Fair share",
+                        rank_by_demand=rank_by == "2024 demand",
+                        family_rules=family_rules))
+                with st.spinner(f"Running {len(scenarios)} scenarios..."):
+                    summary, store_deltas = run_scenarios(snapshot_path(dataset.key), scenarios,
+                                                          family_rules=family_rules)
+                st.dataframe(summary, use_container_width=True, hide_index=True)
+                st.caption("Allocated pieces per store: base plan, then change under each scenario")
+                st.dataframe(store_deltas, use_container_width=True)
+
+        store_panel()
+        overview_panel()
+        network_panel()
+        scenarios_panel()
+finally:
+    finish_rerun_profile()
+
+with profile_box:
+    rerun_profile_view()
@@ -0,0 +1,286 @@
+import heapq
+
+import numpy as np
+import pandas as pd
+
+from demand_scoring import NETWORK_CLUSTER
+
+# Ranking key for articles with no 2024 supply history
+NO_DEMAND = (0.0, 0.0)
+
+# Largest stores x articles block ranked at once by select_top_articles
+TOP_K_BLOCK_CELLS = 1 << 24
+
+
+# Articles in the godown that were NOT sent to each store in 2024
+def get_available_articles(store_capacities, godown_stock, articles_sent_in_2024):
+    available_articles = {}
+    for store in store_capacities:
+        sent = articles_sent_in_2024.get(store, ())
+        available_articles[store] = [article for article in godown_stock
+                                     if article not in sent and godown_stock[article] > 0]
+    return available_articles
+
+
+# How many articles get_available_articles lists for each store, without the lists
+def count_available_articles(store_capacities, godown_stock, articles_sent_in_2024):
+    in_stock = sum(1 for quantity in godown_stock.values() if quantity > 0)
+    return {store: in_stock - sum(1 for article in articles_sent_in_2024.get(store, ())
+                                  if godown_stock.get(article, 0) > 0)
+            for store in store_capacities}
+
+
+# Order a store's eligible articles, best first
+# (demand_scores: optional demand_scoring.DemandScores to rank by 2024 popularity;
+#  limit: only the best `limit` articles are needed, so a heap replaces the full sort)
+def rank_articles(store, available, godown_stock, demand_scores=None, limit=None):
+    if demand_scores is None:
+        # Sort by quantity available (highest first)
+        key = godown_stock.__getitem__
+    else:
+        # Sort by 2024 demand in the store's cluster, then network, then stock
+        rank_keys = demand_scores.for_store(store)
+        key = lambda x: (*rank_keys.get(x, NO_DEMAND), godown_stock[x])
+    if limit is not None and limit < len(available):
+        # Same order and tie-breaking as the sort below, in O(n log limit)
+        return heapq.nlargest(limit, available, key=key)
+    return sorted(available, key=key, reverse=True)
+
+
+# Function to create optimal allocation based on stock availability
+# (family_constraints: optional article_families.FamilyConstraints with
+#  per-store family exclusions and per-family caps)
+def create_allocation(store, store_capacities, godown_stock, available_articles,
+                      demand_scores=None, family_constraints=None):
+    available = available_articles[store]
+    max_capacity = store_capacities[store]
+    excluded, group_of, limits = _family_lookups(family_constraints, store)
+
+    # Only the top max_capacity in-stock articles can be allocated
+    in_stock = [article for article in available
+                if godown_stock[article] > 0 and article not in excluded]
+    limit = max(max_capacity, 0)
+    if limits:
+        # With caps, only the top max_capacity uncapped articles and the top
+        # min(cap, max_capacity) of each capped family can be allocated;
+        # rank just those (kept in their original order for tie-breaking)
+        by_group = {}
+        for article in in_stock:
+            by_group.setdefault(group_of.get(article), []).append(article)
+        candidates = set()
+        for group, articles in by_group.items():
+            top = limit if group is None else min(limits[group], limit)
+            candidates.update(rank_articles(store, articles, godown_stock, demand_scores, limit=top))
+        in_stock = [article for article in in_stock if article in candidates]
+    sorted_articles = rank_articles(store, in_stock, godown_stock, demand_scores, limit=limit)
+
+    allocation = []
+    total_allocated = 0
+    family_used = [0] * len(limits)
+
+    # Allocate articles respecting capacity constraints
+    for article in sorted_articles:
+        if total_allocated < max_capacity and godown_stock[article] > 0:
+            group = group_of.get(article)
+            if group is not None:
+                if family_used[group] >= limits[group]:
+                    continue
+                family_used[group] += 1
+            # Allocate one piece of this article
+            allocation.append({
+                "article": article,
+                "quantity": 1,
+                "available_in_godown": godown_stock[article]
+            })
+            total_allocated += 1
+
+            if total_allocated >= max_capacity:
+                break
+
+    capacity_percentage = (total_allocated / max_capacity * 100) if max_capacity else 0.0
+
+    return {
+        "allocation": allocation,
+        "total_allocated": total_allocated,
+        "capacity_percentage": round(capacity_percentage, 1)
+    }
+
+
+# Store-level view of compiled family rules: excluded articles, article ->
+# cap group, and cap per group
+def _family_lookups(family_constraints, store):
+    if family_constraints is None:
+        return frozenset(), {}, []
+    return (family_constraints.excluded_for(store), family_constraints.group_of,
+            family_constraints.limits)
+
+
+# Network-wide plan: every store allocated against one shared stock ledger,
+# so an article is never promised to more stores than the godown holds.
+# (progress: optional callback, called as progress(stores done, total stores))
+def build_network_plan(store_capacities, godown_stock, articles_sent_in_2024,
+                       demand_scores=None, progress=None, family_constraints=None):
+    available_articles = get_available_articles(
+        store_capacities, godown_stock, articles_sent_in_2024)
+    remaining_stock = dict(godown_stock)
+
+    stores, articles, available = [], [], []
+    for done, store in enumerate(store_capacities, 1):
+        store_allocation = create_allocation(
+            store, store_capacities, remaining_stock, available_articles, demand_scores,
+            family_constraints)
+        for item in store_allocation["allocation"]:
+            stores.append(store)
+            articles.append(item["article"])
+            available.append(godown_stock[item["article"]])
+            remaining_stock[item["article"]] -= item["quantity"]
+        if progress is not None:
+            progress(done, len(store_capacities))
+
+    return _plan_frame(stores, articles, available, store_capacities, godown_stock)
+
+
+# Fair-share plan: scarce stock is split across stores in proportion to their
+# weight (max_quantity by default) instead of going to whichever store is
+# visited first. Water-filling: the store with the lowest allocated/weight
+# ratio takes the next piece, so each piece costs O(log stores) on a heap.
+# Ties go to the earlier store, which keeps the plan reproducible.
+# (progress: called as progress(stores ranked, total stores) while ranking,
+#  which dominates the run time)
+def build_fair_share_plan(store_capacities, godown_stock, articles_sent_in_2024,
+                          weights=None, demand_scores=None, progress=None,
+                          family_constraints=None):
+    available_articles = get_available_articles(
+        store_capacities, godown_stock, articles_sent_in_2024)
+    remaining_stock = dict(godown_stock)
+    weights = store_capacities if weights is None else weights
+
+    ranked = {}
+    heap = []
+    for order, store in enumerate(store_capacities):
+        if store_capacities[store] > 0 and weights.get(store, 0) > 0:
+            excluded = _family_lookups(family_constraints, store)[0]
+            ranked[store] = rank_articles(
+                store, [article for article in available_articles[store] if article not in excluded],
+                godown_stock, demand_scores)
+            heap.append((0.0, order, store))
+        if progress is not None:
+            progress(order + 1, len(store_capacities))
+    heapq.heapify(heap)
+    position = dict.fromkeys(ranked, 0)
+    allocated = dict.fromkeys(ranked, 0)
+    group_of = family_constraints.group_of if family_constraints is not None else {}
+    limits = family_constraints.limits if family_constraints is not None else []
+    family_used = {store: [0] * len(limits) for store in ranked}
+
+    stores, articles, available = [], [], []
+    while heap:
+        _, order, store = heapq.heappop(heap)
+
+        # Skip past articles other stores have already used up, and families
+        # this store has reached its cap on
+        candidates, i, used = ranked[store], position[store], family_used[store]
+        while i < len(candidates):
+            article = candidates[i]
+            group = group_of.get(article)
+            if remaining_stock[article] > 0 and (group is None or used[group] < limits[group]):
+                break
+            i += 1
+        else:
+            continue  # nothing left this store can take
+        position[store] = i + 1
+        if group is not None:
+            used[group] += 1
+
+        remaining_stock[article] -= 1
+        allocated[store] += 1
+        stores.append(store)
+        articles.append(article)
+        available.append(godown_stock[article])
+
+        if allocated[store] < store_capacities[store]:
+            heapq.heappush(heap, (allocated[store] / weights[store], order, store))
+
+    plan = _plan_frame(stores, articles, available, store_capacities, godown_stock)
+    # Group lines by store (stable, so each store keeps its pick order)
+    return plan.sort_values("store_location", kind="stable", ignore_index=True)
+
+
+# Every store's create_allocation picks against the full godown stock, in one
+# batched pass: each cluster's ranking is computed once as a unique rank per
+# article, a stores x articles matrix holds those ranks (ineligible articles
+# get the sentinel n), and argpartition pulls each row's best k without sorting
+# the rest. Stores are processed in blocks of TOP_K_BLOCK_CELLS matrix cells.
+def select_top_articles(store_capacities, godown_stock, articles_sent_in_2024,
+                        demand_scores=None):
+    stores = list(store_capacities)
+    articles = pd.Index(list(godown_stock))
+    n = len(articles)
+    stock = np.fromiter(godown_stock.values(), dtype=np.int64, count=n)
+
+    if demand_scores is None:
+        orders = [np.argsort(-stock, kind="stable")]
+        store_cluster = np.zeros(len(stores), dtype=np.int64)
+    else:
+        cluster_names = pd.Index(list(demand_scores.rank_keys))
+        orders = []
+        for name in cluster_names:
+            keys = demand_scores.rank_keys[name]
+            demand = np.array([keys.get(article, NO_DEMAND) for article in articles]).reshape(-1, 2)
+            orders.append(np.lexsort((-stock, -demand[:, 1], -demand[:, 0])))
+        store_cluster = cluster_names.get_indexer(
+            [demand_scores.store_cluster.get(store, NETWORK_CLUSTER) for store in stores])
+    ranks = np.empty((len(orders), n), dtype=np.int64)
+    for i, order in enumerate(orders):
+        ranks[i, order] = np.arange(n)
+    out_of_stock = stock <= 0
+
+    selected = {}
+    block_size = max(1, TOP_K_BLOCK_CELLS // max(n, 1))
+    for start in range(0, len(stores), block_size):
+        block_stores = stores[start:start + block_size]
+        block = ranks[store_cluster[start:start + block_size]]
+        block[:, out_of_stock] = n
+        for row, store in enumerate(block_stores):
+            sent = articles.get_indexer(list(articles_sent_in_2024.get(store, ())))
+            block[row, sent[sent >= 0]] = n
+
+        k = np.array([min(max(store_capacities[store], 0), n) for store in block_stores])
+        k_max = int(k.max()) if len(k) else 0
+        if k_max == 0:
+            selected.update((store, []) for store in block_stores)
+            continue
+        if k_max < n:
+            top = np.argpartition(block, k_max - 1, axis=1)[:, :k_max]
+        else:
+            top = np.broadcast_to(np.arange(n), block.shape)
+        top_ranks = np.take_along_axis(block, top, axis=1)
+        by_rank = np.argsort(top_ranks, axis=1)
+        top = np.take_along_axis(top, by_rank, axis=1)
+        top_ranks = np.take_along_axis(top_ranks, by_rank, axis=1)
+        eligible = (top_ranks < n).sum(axis=1)
+        for row, store in enumerate(block_stores):
+            selected[store] = articles[top[row, :min(k[row], eligible[row])]].tolist()
+    return selected
+
+
+# create_allocation's result for a store from its select_top_articles picks
+def allocation_from_picks(store, store_capacities, godown_stock, picks):
+    max_capacity = store_capacities[store]
+    allocation = [{"article": article, "quantity": 1, "available_in_godown": godown_stock[article]}
+                  for article in picks]
+    capacity_percentage = (len(allocation) / max_capacity * 100) if max_capacity else 0.0
+    return {
+        "allocation": allocation,
+        "total_allocated": len(allocation),
+        "capacity_percentage": round(capacity_percentage, 1)
+    }
+
+
+def _plan_frame(stores, articles, available, store_capacities, godown_stock):
+    return pd.DataFrame({
+        "store_location": pd.Categorical(stores, categories=list(store_capacities)),
+        "article_number": pd.Categorical(articles, categories=list(godown_stock)),
+        "quantity": pd.Series(1, index=range(len(stores)), dtype="int32"),
+        "available_in_godown": pd.Series(available, dtype="int32"),
+    })
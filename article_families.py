@@ -0,0 +1,110 @@
+"""Article families and per-family allocation rules.
+
+Article codes carry their style: ``Z2393`` belongs to the ``Z23`` series and
+``SDZ3084R`` to ``SDZ30``. At ingest every article gets an integer family ID
+(letter prefix plus the first two digits), computed with one vectorized
+regex pass over the distinct codes, and the codes are indexed in sorted
+order so any prefix (``SDZ``, ``Z23``, ``SDZ3084``) selects its articles
+with two binary searches, like a walk down a prefix trie.
+
+Rules are compiled once into plain lookups (an excluded-article set per
+store, a cap group per article), so the allocator never looks at article
+strings while it allocates.
+"""
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from store_master import normalize_store_name
+
+# Series prefix: letters, then the first two digits
+FAMILY_PATTERN = r"^([A-Za-z]*\d{2})"
+
+# Stand-in for "every store" in a rule's exclude_stores
+ALL_STORES = "*"
+
+
+@dataclass(frozen=True)
+class FamilyRule:
+    # Article code prefix the rule applies to ("" for every article)
+    prefix: str
+    # At most this many articles of each matched family per store
+    max_per_store: Optional[int] = None
+    # Stores that get none of the matched articles (ALL_STORES for every store)
+    exclude_stores: tuple = ()
+
+
+class ArticleFamilies:
+    """Family IDs and a sorted prefix index over a dataset's article codes."""
+
+    def __init__(self, articles):
+        self.articles = pd.Index(list(articles))
+        codes = pd.Series(self.articles.astype(str))
+        keys = codes.str.extract(FAMILY_PATTERN, expand=False).fillna(codes)
+        self.family_id, self.families = pd.factorize(keys.to_numpy())
+        self._order = np.argsort(codes.to_numpy(), kind="stable")
+        self._sorted = codes.to_numpy().astype(str)[self._order]
+
+    def with_prefix(self, prefix):
+        """Positions (in article order) of the articles whose code starts with ``prefix``."""
+        lo = np.searchsorted(self._sorted, prefix, side="left")
+        hi = np.searchsorted(self._sorted, prefix + "\U0010ffff", side="left")
+        return np.sort(self._order[lo:hi])
+
+
+class FamilyConstraints:
+    """Rules compiled against one dataset's articles.
+
+    Each article under a capped prefix gets a cap group, one per (rule,
+    family) pair, so "at most 3 per family" applies to each family the
+    prefix covers; the longest matching capped prefix wins.
+    """
+
+    def __init__(self, families, rules):
+        n = len(families.articles)
+        rule_of = np.full(n, -1)
+        matched_length = np.full(n, -1)
+        excluded = {}
+        for position, rule in enumerate(rules):
+            articles = families.with_prefix(rule.prefix)
+            if rule.max_per_store is not None:
+                longer = matched_length[articles] < len(rule.prefix)
+                rule_of[articles[longer]] = position
+                matched_length[articles[longer]] = len(rule.prefix)
+            for store in rule.exclude_stores:
+                store = store if store == ALL_STORES else normalize_store_name(store)
+                excluded.setdefault(store, []).append(articles)
+
+        capped = np.flatnonzero(rule_of >= 0)
+        group_keys = rule_of[capped] * len(families.families) + families.family_id[capped]
+        group_codes, group_keys = pd.factorize(group_keys)
+        self.limits = [rules[key // len(families.families)].max_per_store for key in group_keys]
+        self.group_of = dict(zip(families.articles[capped], group_codes.tolist()))
+
+        everywhere = excluded.pop(ALL_STORES, [])
+        self._excluded_everywhere = frozenset(families.articles[np.concatenate(everywhere)]
+                                              if everywhere else ())
+        self._excluded = {store: self._excluded_everywhere
+                          | frozenset(families.articles[np.concatenate(positions)])
+                          for store, positions in excluded.items()}
+
+    def excluded_for(self, store):
+        return self._excluded.get(store, self._excluded_everywhere)
+
+
+def read_family_rules(df):
+    """Rules from a table with ``prefix``, ``max_per_store`` and ``exclude_stores`` columns.
+
+    ``exclude_stores`` is a comma-separated list of stores, or ``*`` for all.
+    """
+    rules = []
+    for row in df.itertuples(index=False):
+        prefix = "" if pd.isna(row.prefix) else str(row.prefix).strip()
+        cap = None if pd.isna(row.max_per_store) else int(row.max_per_store)
+        stores = "" if pd.isna(row.exclude_stores) else str(row.exclude_stores)
+        stores = tuple(store.strip() for store in stores.split(",") if store.strip())
+        if cap is not None or stores:
+            rules.append(FamilyRule(prefix=prefix, max_per_store=cap, exclude_stores=stores))
+    return rules
@@ -0,0 +1,105 @@
+"""Table extraction from the word boxes of a report page.
+
+PyMuPDF returns every word on a page with its bounding box. Words are
+grouped into rows by the vertical centre of their box, and into columns by
+comparing their left edge with the left edges of the column headings, which
+are read once from the first page and reused for every page of the report.
+Both steps are a sort and a ``searchsorted`` over NumPy arrays, and a cell's
+words are joined left to right, so a store name keeps all of its words
+("DUKE NIT") however wide the gap between them.
+"""
+import numpy as np
+import pandas as pd
+
+from table_parser import LAYOUTS, check_layout
+
+# Words whose vertical centres are closer than this share a row (fraction of the median word height)
+ROW_TOLERANCE = 0.5
+# How far left of its column heading a cell may start (fraction of the median word height)
+COLUMN_SLACK = 0.5
+
+
+def page_words(page):
+    """``(boxes, text)``: an ``(n, 4)`` array of x0, top, x1, bottom, and each word."""
+    words = page.get_text("words")
+    boxes = np.array([word[:4] for word in words], dtype=float).reshape(-1, 4)
+    text = np.array([word[4] for word in words], dtype=object)
+    return boxes, text
+
+
+def _median_height(boxes):
+    return float(np.median(boxes[:, 3] - boxes[:, 1]))
+
+
+def _rows(boxes):
+    """Row number of each word, counted from the top of the page."""
+    centre = (boxes[:, 1] + boxes[:, 3]) / 2
+    order = np.argsort(centre, kind="stable")
+    breaks = np.diff(centre[order]) > ROW_TOLERANCE * _median_height(boxes)
+    row = np.empty(len(boxes), dtype=np.int64)
+    row[order] = np.concatenate(([0], np.cumsum(breaks)))
+    return row
+
+
+def _cells(row, column, x0, text, columns):
+    """Row, column and text of every non-empty cell, its words joined left to right."""
+    order = np.lexsort((x0, column, row))
+    key = (row * columns + column)[order]
+    starts = np.flatnonzero(np.concatenate(([True], key[1:] != key[:-1])))
+    joined = pd.Series(np.add.reduceat(text[order] + " ", starts)).str.rstrip()
+    return row[order][starts], column[order][starts], joined.to_numpy()
+
+
+def learn_columns(page, layout):
+    """Left edges of the layout's columns, read off its heading on ``page``.
+
+    Returns ``None`` when the page has no heading for the layout.
+    """
+    table = LAYOUTS[layout]
+    boxes, text = page_words(page)
+    if not len(text):
+        return None
+    row = _rows(boxes)
+    line_rows, _, lines = _cells(row, np.zeros_like(row), boxes[:, 0], text, 1)
+    check_layout("\n".join(lines), layout)
+
+    for heading_row, line in zip(line_rows, lines):
+        if table.header.search(line):
+            break
+    else:
+        return None
+    words = np.flatnonzero(row == heading_row)
+    words = words[np.argsort(boxes[words, 0], kind="stable")]
+
+    starts = []
+    headings = iter(table.headings)
+    heading = next(headings)
+    for word in words:
+        if text[word].casefold() == heading.casefold():
+            starts.append(boxes[word, 0])
+            heading = next(headings, None)
+            if heading is None:
+                break
+    if len(starts) != len(table.headings):
+        return None
+    return np.array(starts) - COLUMN_SLACK * _median_height(boxes)
+
+
+def parse_page(page, layout, columns):
+    """Column tuples for every table row on ``page``, given ``learn_columns`` edges."""
+    table = LAYOUTS[layout]
+    boxes, text = page_words(page)
+    if not len(text):
+        return []
+    row = _rows(boxes)
+    # Words left of the first column join it, so stray text fails the field check
+    column = np.maximum(np.searchsorted(columns, boxes[:, 0], side="right") - 1, 0)
+    cell_row, cell_column, cell_text = _cells(row, column, boxes[:, 0], text, len(columns))
+
+    grid = np.full((row.max() + 1, len(columns)), "", dtype=object)
+    grid[cell_row, cell_column] = cell_text
+    # A row is a table row when every cell has its column's shape (headings and totals are not)
+    keep = np.ones(len(grid), dtype=bool)
+    for position, field in enumerate(table.fields):
+        keep &= pd.Series(grid[:, position]).str.fullmatch(field).to_numpy()
+    return list(zip(*(grid[keep, position] for position in range(len(columns)))))
@@ -0,0 +1,87 @@
+"""On-demand CPU profile of Streamlit reruns.
+
+A ``RerunProfiler`` wraps one script rerun in cProfile. The finished profile
+is shown as a table of functions, sorted by cumulative time, and can be
+downloaded in the standard ``.prof`` format (``pstats``, ``snakeviz``) for
+a flame view. Fragment reruns and background jobs run elsewhere and are
+not included.
+
+From Python 3.12 cProfile hooks the whole process rather than one thread:
+a second profiler cannot start while one is running, and calls made by
+other sessions' threads during the rerun show up in its profile. One rerun
+in the process is profiled at a time; other sessions get ``ProfilerBusy``.
+"""
+import cProfile
+import marshal
+import pstats
+import threading
+from dataclasses import dataclass
+
+import pandas as pd
+
+from memory_profile import short_path
+
+# ?profile=1 switches profiling on for the session
+PROFILE_QUERY_PARAM = "profile"
+# Functions listed in the stats table
+STATS_ROWS = 200
+
+# Held while any session's rerun is being profiled
+_profiler_lock = threading.Lock()
+
+
+class ProfilerBusy(RuntimeError):
+    """Another rerun in this process is being profiled."""
+
+
+@dataclass(frozen=True)
+class RerunProfile:
+    stats: pstats.Stats
+
+    @property
+    def seconds(self):
+        return self.stats.total_tt
+
+    def to_frame(self, limit=STATS_ROWS):
+        """The ``limit`` functions with the most cumulative time."""
+        rows = []
+        for (filename, lineno, function), (primitive, calls, own, cumulative, _) in \
+                self.stats.stats.items():
+            rows.append((function, f"{short_path(filename)}:{lineno}" if lineno else "",
+                         calls, primitive, own, cumulative))
+        df = pd.DataFrame(rows, columns=["function", "location", "calls", "primitive_calls",
+                                         "own_s", "cumulative_s"])
+        df = df.nlargest(limit, "cumulative_s").reset_index(drop=True)
+        df["per_call_ms"] = df["cumulative_s"] / df["calls"] * 1000
+        return df.round({"own_s": 4, "cumulative_s": 4, "per_call_ms": 3})
+
+    def to_bytes(self):
+        # The layout pstats.dump_stats writes
+        return marshal.dumps(self.stats.stats)
+
+
+class RerunProfiler:
+    """Profiles the calling thread from construction until ``finish()``.
+
+    Raises ``ProfilerBusy`` if another rerun, or another profiling tool, is
+    profiling the process; call ``finish()`` in a ``finally`` so the
+    profiler is never left running.
+    """
+
+    def __init__(self):
+        if not _profiler_lock.acquire(blocking=False):
+            raise ProfilerBusy("Another rerun is being profiled")
+        try:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        except ValueError as e:
+            # "Another profiling tool is already active" (Python 3.12+)
+            _profiler_lock.release()
+            raise ProfilerBusy(str(e)) from e
+
+    def finish(self):
+        try:
+            self._profile.disable()
+        finally:
+            _profiler_lock.release()
+        return RerunProfile(pstats.Stats(self._profile))
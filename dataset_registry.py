@@ -0,0 +1,283 @@
+"""Process-wide registry of parsed datasets shared across Streamlit sessions.
+
+Every session that uploads the same three PDFs gets a handle to one shared,
+read-only ``Dataset`` keyed by the content hash of the files (see
+``snapshot.dataset_key``). Datasets are reference counted: a handle pins its
+dataset until it is released or garbage collected with the session, and
+unpinned datasets are evicted least-recently-used first once the registry
+grows past its memory cap. A dataset whose store names were resolved with an
+older alias table is reloaded the next time it is acquired.
+"""
+import os
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Mapping
+
+import pandas as pd
+
+from article_families import ArticleFamilies
+from demand_scoring import DemandScores, compute_demand_scores
+from extraction import (extract_stock_data, extract_supply_data, extract_max_data,
+                        build_logic_inputs)
+from memory_profile import memory_stage
+from snapshot import is_current_snapshot, resolve_snapshot, snapshot_path, write_snapshot
+from store_master import StoreMatches, aliases_key, load_store_aliases, resolve_store_names
+
+DEFAULT_MAX_BYTES = int(os.getenv("DATASET_REGISTRY_MAX_MB", "1024")) * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class Dataset:
+    key: str
+    df_stock: pd.DataFrame
+    df_supply: pd.DataFrame
+    df_max: pd.DataFrame
+    store_capacities: Mapping[str, int]
+    godown_stock: Mapping[str, int]
+    articles_sent_in_2024: Mapping[str, frozenset]
+    demand_scores: DemandScores
+    article_families: ArticleFamilies
+    # Supply-report store names matched approximately or not at all
+    store_matches: StoreMatches
+    nbytes: int
+
+    @property
+    def cache_key(self):
+        """``key`` plus the alias table its store names were resolved with."""
+        return f"{self.key}/{self.store_matches.aliases_key}"
+
+
+def is_current_dataset(dataset):
+    """Whether ``dataset``'s store names were resolved with the current alias table."""
+    return dataset.store_matches.aliases_key == aliases_key(load_store_aliases())
+
+
+def _estimate_nbytes(frames, mappings):
+    total = sum(int(df.memory_usage(deep=True).sum()) for df in frames)
+    for mapping in mappings:
+        total += sys.getsizeof(mapping)
+        for value in mapping.values():
+            total += sys.getsizeof(value)
+    return total
+
+
+def build_dataset(key, df_stock, df_supply, df_max, store_matches=None):
+    """Wrap parsed tables and their lookup dictionaries as a read-only ``Dataset``."""
+    with memory_stage("logic inputs"):
+        store_capacities, godown_stock, articles_sent_in_2024 = build_logic_inputs(
+            df_stock, df_supply, df_max)
+    # Scored once here so ranking by demand costs a lookup per article later
+    with memory_stage("demand scores"):
+        demand_scores = compute_demand_scores(df_supply)
+    # Family IDs and the prefix index that family rules are compiled against
+    with memory_stage("article families"):
+        article_families = ArticleFamilies(godown_stock)
+    nbytes = _estimate_nbytes(
+        (df_stock, df_supply, df_max),
+        (store_capacities, godown_stock, articles_sent_in_2024,
+         *demand_scores.rank_keys.values()))
+    return Dataset(
+        key=key,
+        df_stock=df_stock,
+        df_supply=df_supply,
+        df_max=df_max,
+        store_capacities=MappingProxyType(store_capacities),
+        godown_stock=MappingProxyType(godown_stock),
+        articles_sent_in_2024=MappingProxyType(articles_sent_in_2024),
+        demand_scores=demand_scores,
+        article_families=article_families,
+        store_matches=store_matches or StoreMatches(),
+        nbytes=nbytes,
+    )
+
+
+def load_snapshot_dataset(key):
+    # Store names are resolved with the current alias table as the snapshot is read
+    return build_dataset(key, *resolve_snapshot(snapshot_path(key)))
+
+
+def parse_pdf_reports(stock_file, supply_file, max_file, progress=None):
+    """Parse the three reports into ``(df_stock, df_supply, df_max)``, store names as printed.
+
+    ``progress(report, done, total)`` is called after each parsed page.
+    """
+    def pages(report):
+        return None if progress is None else lambda done, total: progress(report, done, total)
+
+    with memory_stage("extract stock"):
+        df_stock = extract_stock_data(stock_file, pages("stock"))
+    with memory_stage("extract supply"):
+        df_supply = extract_supply_data(supply_file, pages("supply"))
+    with memory_stage("extract max"):
+        df_max = extract_max_data(max_file, pages("max"))
+    return df_stock, df_supply, df_max
+
+
+def parse_pdf_dataset(stock_file, supply_file, max_file, progress=None):
+    """Parse the three reports into ``(df_stock, df_supply, df_max, store_matches)``.
+
+    Store names are on canonical store keys; ``store_matches`` (see
+    ``store_master.StoreMatches``) lists the ones to review.
+    """
+    df_stock, df_supply, df_max = parse_pdf_reports(stock_file, supply_file, max_file, progress)
+    # Supply-report store names are mapped onto the max report's store keys
+    # before anything is cached, so every later join is on canonical keys
+    with memory_stage("resolve store names"):
+        df_supply, df_max, store_matches = resolve_store_names(
+            df_supply, df_max, load_store_aliases())
+    return df_stock, df_supply, df_max, store_matches
+
+
+def load_pdf_dataset(key, stock_file, supply_file, max_file, progress=None):
+    """Parse the three reports, or map their snapshot if this content was seen before.
+
+    A snapshot from an older version is rebuilt. ``progress(report, done,
+    total)`` is called after each parsed page.
+    """
+    directory = snapshot_path(key)
+    if not is_current_snapshot(directory):
+        tables = parse_pdf_reports(stock_file, supply_file, max_file, progress)
+        with memory_stage("write snapshot"):
+            write_snapshot(directory, *tables, source_key=key)
+    return load_snapshot_dataset(key)
+
+
+class DatasetHandle:
+    """A session's reference to a shared dataset. Releases itself when collected."""
+
+    def __init__(self, registry, entry):
+        self.key = entry.dataset.key
+        self.dataset = entry.dataset
+        self._finalizer = weakref.finalize(self, registry._release, entry)
+
+    def release(self):
+        self._finalizer()
+
+    @property
+    def released(self):
+        return not self._finalizer.alive
+
+
+class _Entry:
+    __slots__ = ("dataset", "refcount")
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.refcount = 0
+
+
+class DatasetRegistry:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        # Re-entrant: a handle's finalizer may run from garbage collection
+        # triggered while this thread already holds the lock.
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._total_bytes = 0
+
+    def acquire(self, key, loader):
+        """Return a handle to dataset ``key``, calling ``loader()`` only if it is not loaded.
+
+        Concurrent callers for the same key wait on the first caller's load
+        instead of parsing the PDFs again. A loaded dataset resolved with an
+        older alias table is dropped and loaded again.
+        """
+        current_aliases = aliases_key(load_store_aliases())
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.dataset.store_matches.aliases_key != current_aliases:
+                # Sessions holding the old dataset keep it until they let go
+                self._drop_locked(key)
+                entry = None
+            if entry is not None:
+                return self._pin_locked(key, entry)
+            future = self._loading.get(key)
+            owner = future is None
+            if owner:
+                future = self._loading[key] = Future()
+
+        if not owner:
+            future.result()
+            return self.acquire(key, loader)
+
+        try:
+            dataset = loader()
+            if dataset.key != key:
+                raise ValueError(f"Loader returned dataset {dataset.key!r} for key {key!r}")
+        except BaseException as exc:
+            with self._lock:
+                del self._loading[key]
+            future.set_exception(exc)
+            raise
+
+        with self._lock:
+            entry = self._entries[key] = _Entry(dataset)
+            self._total_bytes += dataset.nbytes
+            del self._loading[key]
+            handle = self._pin_locked(key, entry)
+            self._evict_locked()
+        future.set_result(dataset)
+        return handle
+
+    def get(self, key):
+        """Return a new handle to an already loaded, current dataset, or ``None``."""
+        current_aliases = aliases_key(load_store_aliases())
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.dataset.store_matches.aliases_key != current_aliases:
+                return None
+            return self._pin_locked(key, entry)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "datasets": len(self._entries),
+                "pinned": sum(1 for entry in self._entries.values() if entry.refcount),
+                "total_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _pin_locked(self, key, entry):
+        entry.refcount += 1
+        self._entries.move_to_end(key)
+        return DatasetHandle(self, entry)
+
+    def _release(self, entry):
+        with self._lock:
+            entry.refcount -= 1
+            # A dropped entry is no longer counted against the cap
+            if self._entries.get(entry.dataset.key) is entry:
+                self._evict_locked()
+
+    def _drop_locked(self, key):
+        entry = self._entries.pop(key)
+        self._total_bytes -= entry.dataset.nbytes
+
+    def _evict_locked(self):
+        # Oldest first; datasets still held by a session are never evicted,
+        # so the cap may be exceeded while every dataset is in use.
+        for key in list(self._entries):
+            if self._total_bytes <= self.max_bytes:
+                break
+            entry = self._entries[key]
+            if entry.refcount == 0:
+                self._drop_locked(key)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """The registry shared by every session in this process."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = DatasetRegistry()
+        return _registry
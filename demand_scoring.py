@@ -0,0 +1,66 @@
+"""Article popularity scores from 2024 supply volumes.
+
+Scores are computed once per dataset with grouped sums over the supply
+history and stored on the registry's ``Dataset``, so ranking at allocation
+time is a dictionary lookup per article.
+
+A store was never sent its own 2024 articles again, so its own history says
+nothing about the articles it is still eligible for. Its cluster's history
+does: each article is scored by its share of the volume supplied to the
+store's cluster, with the network-wide share as the tie-breaker.
+"""
+from dataclasses import dataclass, field
+from typing import Mapping
+
+import pandas as pd
+
+from store_master import normalize_store_name
+
+NETWORK_CLUSTER = "ALL"
+
+
+@dataclass(frozen=True)
+class DemandScores:
+    # {cluster: {article: (cluster share, network share)}}
+    rank_keys: Mapping[str, Mapping[str, tuple]]
+    store_cluster: Mapping[str, str] = field(default_factory=dict)
+
+    def for_store(self, store):
+        """Ranking keys for one store's articles; articles with no history are absent."""
+        return self.rank_keys.get(self.store_cluster.get(store, NETWORK_CLUSTER),
+                                  self.rank_keys[NETWORK_CLUSTER])
+
+
+def compute_demand_scores(df_supply, store_clusters=None):
+    """Score articles by 2024 supply volume, network-wide and per store cluster.
+
+    ``store_clusters`` maps a store to a cluster name; stores without one
+    (or every store, when it is omitted) are scored against the whole network.
+    """
+    qty = df_supply["quantity_supplied_2024"]
+    network = qty.groupby(df_supply["article_number"], sort=False, observed=True).sum()
+    network = network / max(network.sum(), 1)
+
+    network = network.to_dict()
+    clusters = {NETWORK_CLUSTER: network}
+    store_cluster = {}
+    if store_clusters:
+        store_cluster = dict(store_clusters)
+        cluster = df_supply["store_location"].map(store_cluster)
+        by_cluster = qty.groupby([cluster, df_supply["article_number"]],
+                                 sort=False, observed=True).sum()
+        totals = by_cluster.groupby(level=0).transform("sum").clip(lower=1)
+        for name, shares in (by_cluster / totals).groupby(level=0):
+            clusters[name] = shares.droplevel(0).to_dict()
+
+    rank_keys = {
+        name: {article: (shares.get(article, 0.0), share) for article, share in network.items()}
+        for name, shares in clusters.items()
+    }
+    return DemandScores(rank_keys=rank_keys, store_cluster=store_cluster)
+
+
+def read_store_clusters(file):
+    """Read a ``store_location, cluster`` CSV into a mapping."""
+    df = pd.read_csv(file)
+    return dict(zip(df["store_location"].map(normalize_store_name), df["cluster"]))
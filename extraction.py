@@ -0,0 +1,33 @@
+from page_cache import parse_pdf_incremental
+
+# Each report is parsed from its pages' word boxes, column by column (see
+# box_parser.py), falling back to its layout's line pattern when it has no
+# column headings (see table_parser.py); pages already parsed from an earlier
+# revision of the report come from the page cache (see page_cache.py).
+
+
+def extract_stock_data(file, progress=None):
+    return parse_pdf_incremental(file, "stock", progress)
+
+
+def extract_supply_data(file, progress=None):
+    return parse_pdf_incremental(file, "supply", progress)
+
+
+def extract_max_data(file, progress=None):
+    return parse_pdf_incremental(file, "max", progress)
+
+
+# Convert the extracted tables into the dictionaries the allocation logic uses
+# (each store's 2024 articles are a frozenset: the allocators test membership
+#  once per store and article)
+def build_logic_inputs(df_stock, df_supply, df_max):
+    store_capacities = dict(
+        zip(df_max['store_location'], df_max['max_quantity']))
+    godown_stock = dict(
+        zip(df_stock['article_number'], df_stock['quantity_available']))
+    articles_sent_in_2024 = {
+        store: frozenset(articles)
+        for store, articles in df_supply.groupby('store_location', observed=True)['article_number']
+    }
+    return store_capacities, godown_stock, articles_sent_in_2024
@@ -0,0 +1,430 @@
+"""AI insights for a store's allocation: prompt, providers and answer cache.
+
+Insights are streamed, so the first words show while the rest is still
+being generated; only the finished text is cached. When switched on (by
+default with ``INSIGHTS_OFFLINE=1``), an offline stand-in writes rule-based
+insights from the same numbers and streams them word by word, so the panel
+can be demonstrated and tested without API keys or network access.
+
+For many stores at once, ``generate_batched_insights`` sends one compact
+line per store and the instructions once per batch, and asks for a JSON
+object keyed by store. Each validated answer goes into the same cache the
+per-store panel reads. Batches are sized to the models' answer and context
+limits, from a running estimate of answer tokens per store. A batch whose
+answer is cut short or invalid is split in half and retried; stores left
+out of a valid answer are retried in a later batch.
+
+Stores with near-identical profiles get near-identical advice, so answers
+can optionally be shared between them. Every answer is also kept as a
+template under a bucket of its store's features (capacity, fill rate and
+eligible articles, each in bands), with the store's name and numbers
+replaced by placeholders. With sharing on, a store with no answer of its
+own is given the template of its bucket, filled in with its own name and
+numbers. Coarser bands share more answers; a maximum age keeps shared
+answers fresh. Other figures in a shared answer (such as free pieces) are
+those of the store it was written for.
+"""
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from langchain.prompts import PromptTemplate
+
+from llm_router import Provider, chat_providers, invoke_hedged
+from store_master import normalize_store_name
+
+# Finished insight texts kept per process
+INSIGHT_CACHE_SIZE = 4096
+INSIGHTS_OFFLINE = os.getenv("INSIGHTS_OFFLINE", "") == "1"
+# Pause between words of the offline stand-in, to look like a streamed answer
+OFFLINE_WORD_DELAY = 0.02
+
+# Rough size of a token, for budgeting prompts and answers
+CHARS_PER_TOKEN = 4
+# Context window and answer limit (tokens) of each provider's model
+MODEL_CONTEXT_TOKENS = {"openai": 128_000, "anthropic": 200_000, "offline": 32_000}
+MODEL_OUTPUT_TOKENS = {"openai": 16_384, "anthropic": 8_192, "offline": 8_192}
+# Share of the answer limit a batch is planned to fill, leaving room for a long answer
+OUTPUT_HEADROOM = 0.75
+# Answer tokens per store assumed until batches have been measured
+ANSWER_TOKENS_PER_STORE = 120
+MAX_BATCH_STORES = 200
+# Valid answers a store may be left out of before it is given up
+MAX_STORE_MISSES = 2
+
+# Band widths of each sharing level: capacity and eligible articles grow by a
+# factor per band, fill rate by percentage points
+SHARING_LEVELS = {
+    "fine": {"capacity": 1.25, "fill": 5, "eligible": 1.5},
+    "coarse": {"capacity": 2.0, "fill": 20, "eligible": 3.0},
+}
+INSIGHT_SHARING = os.getenv("INSIGHT_SHARING", "off")
+# Shared answers older than this are generated afresh
+SHARED_INSIGHT_MAX_AGE_HOURS = float(os.getenv("SHARED_INSIGHT_MAX_AGE_HOURS", "24"))
+
+INSIGHTS_PROMPT = PromptTemplate(
+    input_variables=["store", "capacity",
+                     "allocated", "percentage"],
+    template="""
+    You are a retail inventory management expert. Analyze the following allocation data for {store} store:
+    - Maximum capacity: {capacity} pieces
+    - Currently allocated: {allocated} pieces ({percentage}% of capacity)
+
+    Provide 3 concise bullet points of insights or recommendations to optimize this jacket allocation.
+    Focus on inventory turnover, store-specific strategy, and efficiency.
+    """
+)
+
+
+BATCH_PROMPT = PromptTemplate(
+    input_variables=["stores"],
+    template="""
+    You are a retail inventory management expert. Each line below is one store's jacket allocation:
+    store | maximum capacity (pieces) | currently allocated (pieces) | % of capacity
+
+    {stores}
+
+    For every store, provide 3 concise bullet points of insights or recommendations to optimize its
+    jacket allocation, focusing on inventory turnover, store-specific strategy, and efficiency.
+    Answer with only a JSON object that maps each store name, exactly as written above, to one string
+    holding its 3 bullet points, each starting with "- " and separated by newlines.
+    """
+)
+
+
+def insight_inputs(store, capacity, allocated, percentage, eligible=None):
+    # eligible (articles the store may receive) only buckets shared answers
+    return {"store": store, "capacity": capacity, "allocated": allocated,
+            "percentage": percentage, "eligible": eligible}
+
+
+def insight_key(inputs, offline=False):
+    """Cache key of one store's insights; the same for streamed and batched answers."""
+    return (offline, inputs["store"], inputs["capacity"], inputs["allocated"],
+            inputs["percentage"])
+
+
+def _geometric_band(value, factor):
+    return math.floor(math.log(max(value, 1), factor))
+
+
+def bucket_key(inputs, offline=False, sharing="fine"):
+    """Cache key of the answer template shared by stores in the same feature bands."""
+    bands = SHARING_LEVELS[sharing]
+    eligible = inputs.get("eligible")
+    return ("shared", sharing, offline,
+            _geometric_band(inputs["capacity"], bands["capacity"]),
+            math.floor(float(inputs["percentage"]) / bands["fill"]),
+            None if eligible is None else _geometric_band(eligible, bands["eligible"]))
+
+
+# Numbers up to this are left as written in shared answers ("top 1 article", "2 weeks")
+MIN_TEMPLATED_NUMBER = 2
+
+
+def _numbers(inputs):
+    # Each number as it is written in an answer, with its placeholder, in templating order.
+    # The percentage goes first and only with its "%", so "100%" is never taken for a
+    # capacity of 100; the first form of each placeholder is used to fill in
+    percentage = float(inputs["percentage"])
+    return [(f"{percentage:.1f}%", "<percentage>%"),
+            (f"{percentage:g}%", "<percentage>%"),
+            (str(inputs["capacity"]), "<capacity>"),
+            (str(inputs["allocated"]), "<allocated>")]
+
+
+def to_template(text, inputs):
+    """``text`` with the store's name and numbers replaced by placeholders."""
+    text = re.sub(rf"(?<!\w){re.escape(inputs['store'])}(?!\w)", "<store>", text,
+                  flags=re.IGNORECASE)
+    for number, placeholder in _numbers(inputs):
+        # Small numbers stay as written ("top 1 article")
+        if not number.endswith("%") and int(number) <= MIN_TEMPLATED_NUMBER:
+            continue
+        # Whole numbers only: not 50 inside 500 or 50.5. A capacity equal to
+        # the allocated count (a full store) becomes <capacity>; the bucket
+        # is the 100% fill band, so every store sharing it refills the same
+        text = re.sub(rf"(?<![\d.]){re.escape(number)}(?!\.?\d)", placeholder, text)
+    return text
+
+
+def from_template(template, inputs):
+    """A shared answer filled in for the store of ``inputs``."""
+    template = template.replace("<store>", inputs["store"])
+    filled = set()
+    for number, placeholder in _numbers(inputs):
+        if placeholder not in filled:
+            template = template.replace(placeholder, number)
+            filled.add(placeholder)
+    return template
+
+
+def offline_insights(inputs):
+    """Rule-based stand-in for the model's three bullet points."""
+    store, capacity = inputs["store"], inputs["capacity"]
+    allocated, percentage = inputs["allocated"], float(inputs["percentage"])
+    unfilled = max(capacity - allocated, 0)
+    if percentage >= 90:
+        fill = (f"{store} is nearly full at {percentage:.1f}% of its {capacity}-piece capacity; "
+                "prioritise the fastest-moving articles for the remaining space.")
+    elif percentage >= 50:
+        fill = (f"{store} is at {percentage:.1f}% of capacity with {unfilled} pieces free; "
+                "top up with articles that sold well in similar stores.")
+    else:
+        fill = (f"{store} is only {percentage:.1f}% filled ({unfilled} pieces free); the godown "
+                "lacks eligible stock, so consider transfers or relaxing the 2024 repeat rule.")
+    return "\n".join([
+        f"- {fill}",
+        f"- Review sell-through of the {allocated} allocated pieces after two weeks and move "
+        "slow articles to stores with higher demand.",
+        "- Spread sizes and styles across the allocation so no single article ties up "
+        "a large share of the store's capacity.",
+    ])
+
+
+def _offline_stream(inputs):
+    for word in re.findall(r"\S+\s*", offline_insights(inputs)):
+        time.sleep(OFFLINE_WORD_DELAY)
+        yield word
+
+
+OFFLINE_PROVIDER = Provider("offline", offline_insights, _offline_stream)
+
+
+def _store_lines(batch):
+    return "\n".join(f"{inputs['store']} | {inputs['capacity']} | {inputs['allocated']} | "
+                     f"{inputs['percentage']}" for inputs in batch)
+
+
+def _offline_batch(inputs):
+    answers = {}
+    for line in inputs["stores"].splitlines():
+        store, capacity, allocated, percentage = (field.strip() for field in line.split("|"))
+        answers[store] = offline_insights(insight_inputs(
+            store, int(capacity), int(allocated), float(percentage)))
+    return json.dumps(answers)
+
+
+OFFLINE_BATCH_PROVIDER = Provider(
+    "offline", _offline_batch, lambda inputs: iter([_offline_batch(inputs)]))
+
+
+def insight_providers(api_key=None, backup_api_key=None, offline=INSIGHTS_OFFLINE):
+    """Providers in order of preference, or just the offline stand-in."""
+    if offline:
+        return [OFFLINE_PROVIDER]
+    return chat_providers(INSIGHTS_PROMPT, api_key, backup_api_key)
+
+
+def batch_providers(api_key=None, backup_api_key=None, offline=INSIGHTS_OFFLINE):
+    """Providers answering ``BATCH_PROMPT`` with JSON, allowed their full answer length."""
+    if offline:
+        return [OFFLINE_BATCH_PROVIDER]
+    return chat_providers(BATCH_PROMPT, api_key, backup_api_key, json_output=True,
+                          max_tokens=MODEL_OUTPUT_TOKENS)
+
+
+def _tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def batch_size(providers, answer_tokens_per_store, prompt_tokens_per_store):
+    """Stores per batch that every provider can take in and answer in full."""
+    instructions = _tokens(BATCH_PROMPT.format(stores=""))
+    size = MAX_BATCH_STORES
+    for provider in providers:
+        output = MODEL_OUTPUT_TOKENS.get(provider.name, min(MODEL_OUTPUT_TOKENS.values()))
+        context = MODEL_CONTEXT_TOKENS.get(provider.name, min(MODEL_CONTEXT_TOKENS.values()))
+        size = min(size,
+                   int(output * OUTPUT_HEADROOM / answer_tokens_per_store),
+                   int((context - output - instructions) / prompt_tokens_per_store))
+    return max(size, 1)
+
+
+def parse_batch_answer(text, stores):
+    """``{store: insights}`` for the requested stores found in a JSON answer.
+
+    Raises ``ValueError`` when the answer is not a JSON object (for example
+    when it was cut off); stores missing from it are simply left out.
+    """
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.strip("`").removeprefix("json").strip()
+    answer = json.loads(text)
+    if not isinstance(answer, dict):
+        raise ValueError("Expected a JSON object keyed by store")
+    by_name = {normalize_store_name(name): value for name, value in answer.items()}
+    insights = {}
+    for store in stores:
+        value = answer.get(store, by_name.get(normalize_store_name(store)))
+        if isinstance(value, list):
+            value = "\n".join(f"- {str(point).lstrip('- ')}" for point in value)
+        if isinstance(value, str) and value.strip():
+            insights[store] = value.strip()
+    return insights
+
+
+def generate_batched_insights(store_inputs, providers, cache, offline=False, progress=None,
+                              sharing="off", max_age=None):
+    """Fill ``cache`` with insights for every store in ``store_inputs`` not yet in it.
+
+    With ``sharing``, only one store per bucket is asked about and the others
+    share its answer; a store whose bucket ends up with no answer is asked
+    about itself. ``progress(done, total)`` is called after each batch.
+    Returns a summary of calls made, stores answered, shared and failed, and
+    estimated prompt tokens against one prompt per store.
+    """
+    pending = [inputs for inputs in store_inputs
+               if cache.lookup(inputs, offline, sharing, max_age, count=False) is None]
+    shared = 0
+    followers = []
+    if sharing in SHARING_LEVELS:
+        buckets = {}
+        for inputs in pending:
+            if buckets.setdefault(bucket_key(inputs, offline, sharing), inputs) is not inputs:
+                followers.append(inputs)
+        pending = list(buckets.values())
+    total = len(pending)
+    prompt_tokens_per_store = max(
+        (_tokens(_store_lines([inputs])) for inputs in pending), default=1)
+    answer_tokens_per_store = ANSWER_TOKENS_PER_STORE
+    # Lowered when a batch comes back cut short or invalid
+    size_cap = MAX_BATCH_STORES
+    single_prompt_tokens = sum(_tokens(INSIGHTS_PROMPT.format(**inputs)) for inputs in pending)
+    calls = prompt_tokens = 0
+    misses = Counter()
+    failed = []
+
+    while pending or followers:
+        if not pending:
+            # Every bucket asked about: followers share a stored template, the rest are asked
+            pending = [inputs for inputs in followers
+                       if cache.lookup(inputs, offline, sharing, max_age, count=False) is None]
+            shared = len(followers) - len(pending)
+            followers = []
+            total += len(pending)
+            single_prompt_tokens += sum(_tokens(INSIGHTS_PROMPT.format(**inputs)) for inputs in pending)
+            continue
+        size = min(size_cap, batch_size(providers, answer_tokens_per_store,
+                                         prompt_tokens_per_store))
+        batch, pending = pending[:size], pending[size:]
+        prompt = {"stores": _store_lines(batch)}
+        # Batch latencies are their own hedge statistics: a batch answer takes
+        # far longer than the first chunk of a streamed one
+        text, _ = invoke_hedged(providers, prompt, call_type="batch")
+        calls += 1
+        prompt_tokens += _tokens(BATCH_PROMPT.format(**prompt))
+        try:
+            answers = parse_batch_answer(text, [inputs["store"] for inputs in batch])
+        except ValueError:
+            # Cut short or not JSON: retry in smaller batches
+            if len(batch) == 1:
+                failed.append(batch[0]["store"])
+            else:
+                size_cap = max(len(batch) // 2, 1)
+                pending = batch + pending
+        else:
+            if answers:
+                # Running estimate of answer length, for sizing the next batches
+                measured = _tokens(text) / len(answers)
+                answer_tokens_per_store = max(answer_tokens_per_store * 0.5 + measured * 0.5, 1)
+            for inputs in batch:
+                store = inputs["store"]
+                if store in answers:
+                    cache.remember(inputs, answers[store], offline)
+                    continue
+                misses[store] += 1
+                if misses[store] >= MAX_STORE_MISSES:
+                    failed.append(store)
+                else:
+                    pending.append(inputs)
+        if progress is not None:
+            progress(total - len(pending) - len(failed), total)
+
+    return {
+        "stores": total,
+        "answered": total - len(failed),
+        "shared": shared,
+        "failed": failed,
+        "calls": calls,
+        "prompt_tokens": prompt_tokens,
+        "single_prompt_tokens": single_prompt_tokens,
+    }
+
+
+class InsightCache:
+    """Finished insight texts by key, least recently used dropped first.
+
+    ``lookup`` and ``remember`` work per store and also keep the shared
+    templates; they count lookups and hits for ``stats``.
+    """
+
+    def __init__(self, max_entries=INSIGHT_CACHE_SIZE):
+        self.max_entries = max_entries
+        # key -> (text, time stored)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._lookups = self._exact_hits = self._shared_hits = 0
+
+    def get(self, key, max_age=None):
+        """The text under ``key``, unless missing or stored more than ``max_age`` seconds ago."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            text, stored_at = entry
+            if max_age is not None and time.monotonic() - stored_at > max_age:
+                # Left in place: other callers may accept older answers, and a new one replaces it
+                return None
+            self._entries.move_to_end(key)
+            return text
+
+    def put(self, key, text):
+        with self._lock:
+            self._entries[key] = (text, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def lookup(self, inputs, offline=False, sharing="off", max_age=None, count=True):
+        """The store's own insights, else (with ``sharing``) its bucket's, filled in for it.
+
+        ``max_age`` (seconds) applies to shared answers only. With ``count=False``
+        the lookup is a probe and is left out of ``stats``.
+        """
+        text = self.get(insight_key(inputs, offline))
+        shared = False
+        if text is None and sharing in SHARING_LEVELS:
+            template = self.get(bucket_key(inputs, offline, sharing), max_age)
+            if template is not None:
+                text, shared = from_template(template, inputs), True
+        if not count:
+            return text
+        with self._lock:
+            self._lookups += 1
+            if shared:
+                self._shared_hits += 1
+            elif text is not None:
+                self._exact_hits += 1
+        return text
+
+    def remember(self, inputs, text, offline=False):
+        """Keep a store's insights, and its template for every sharing level."""
+        self.put(insight_key(inputs, offline), text)
+        template = to_template(text, inputs)
+        for sharing in SHARING_LEVELS:
+            self.put(bucket_key(inputs, offline, sharing), template)
+
+    def stats(self):
+        with self._lock:
+            lookups, exact, shared = self._lookups, self._exact_hits, self._shared_hits
+        return {
+            "lookups": lookups,
+            "exact_hits": exact,
+            "shared_hits": shared,
+            "hit_rate": (exact + shared) / lookups if lookups else None,
+        }
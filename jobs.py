@@ -0,0 +1,252 @@
+"""Background jobs for long PDF extractions and plan builds.
+
+Jobs run on a small thread pool owned by the process, so they keep running
+across Streamlit reruns and browser refreshes; a session only holds the job
+id. Each job's state (status, stage, progress, result) is written to
+``jobs/<id>.json`` so it can be looked up again after a page reload, and jobs
+that were still queued or running when the process stopped come back as
+``interrupted``. Cancellation is cooperative: the job stops at its next
+progress report (the next page or store). Finished jobs are removed with
+their files once their result is attached or dismissed, or after
+``JOB_RETENTION`` seconds if no session ever collects them.
+"""
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field, replace
+from typing import Optional
+
+from dataset_registry import get_registry, load_pdf_dataset
+from plan_export import write_plan_arrow
+from plan_validation import check_plan
+
+JOB_ROOT = "jobs"
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+
+# Seconds a finished job and its files are kept when no session collects them
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", "86400"))
+
+# Minimum seconds between progress writes to a job's state file
+PROGRESS_SAVE_INTERVAL = 0.5
+
+FINISHED = ("done", "failed", "cancelled", "interrupted")
+
+
+class JobCancelled(Exception):
+    pass
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    # queued, running, done, failed, cancelled or interrupted
+    status: str = "queued"
+    stage: str = ""
+    done: int = 0
+    total: int = 0
+    error: Optional[str] = None
+    # JSON-serialisable output, e.g. {"dataset_key": ...} or {"plan_file": ...}
+    result: Optional[dict] = None
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+
+    @property
+    def finished(self):
+        return self.status in FINISHED
+
+    @property
+    def fraction(self):
+        return self.done / self.total if self.total else 0.0
+
+
+class JobContext:
+    """Handed to a running job to report progress and notice cancellation."""
+
+    def __init__(self, queue, job_id):
+        self.queue = queue
+        self.job_id = job_id
+
+    @property
+    def cancelled(self):
+        return self.queue._cancel_requested(self.job_id)
+
+    def progress(self, stage, done, total):
+        if self.cancelled:
+            raise JobCancelled()
+        self.queue._update(self.job_id, stage=stage, done=done, total=total)
+
+    def callback(self, stage):
+        """A ``progress(done, total)`` callback for one stage."""
+        return lambda done, total: self.progress(stage, done, total)
+
+
+class JobQueue:
+    def __init__(self, root=JOB_ROOT, max_workers=JOB_WORKERS):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._futures = {}
+        self._cancelled = set()
+        self._saved_at = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._load_locked()
+
+    def submit(self, kind, fn, *args):
+        """Queue ``fn(context, *args)``; its return value becomes the job's result."""
+        job = Job(id=uuid.uuid4().hex[:12], kind=kind)
+        with self._lock:
+            self._prune_locked()
+            self._jobs[job.id] = job
+            self._save_locked(job)
+            self._futures[job.id] = self._executor.submit(self._run, job.id, fn, args)
+        return job.id
+
+    def get(self, job_id):
+        """A copy of the job's current state, or ``None`` for an unknown id."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return replace(job) if job is not None else None
+
+    def jobs(self):
+        with self._lock:
+            return sorted((replace(job) for job in self._jobs.values()),
+                          key=lambda job: job.created_at, reverse=True)
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return False
+            self._cancelled.add(job_id)
+            future = self._futures.get(job_id)
+            if future is not None and future.cancel():
+                # Never started; a running job stops at its next progress report
+                del self._futures[job_id]
+                self._cancelled.discard(job_id)
+                self._set_locked(job, status="cancelled")
+            return True
+
+    def discard(self, job_id):
+        """Forget a finished job and delete its state and output files."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or not job.finished:
+                return False
+            self._discard_locked(job)
+            return True
+
+    def _discard_locked(self, job):
+        del self._jobs[job.id]
+        self._saved_at.pop(job.id, None)
+        # jobs/<id>.json and outputs such as jobs/<id>.arrow
+        for name in os.listdir(self.root):
+            if name.startswith(f"{job.id}."):
+                try:
+                    os.remove(os.path.join(self.root, name))
+                except FileNotFoundError:
+                    pass
+
+    def _prune_locked(self):
+        cutoff = time.time() - JOB_RETENTION
+        for job in list(self._jobs.values()):
+            if job.finished and job.updated_at < cutoff:
+                self._discard_locked(job)
+
+    def _run(self, job_id, fn, args):
+        self._update(job_id, status="running")
+        try:
+            result = fn(JobContext(self, job_id), *args)
+        except JobCancelled:
+            self._update(job_id, status="cancelled")
+        except Exception as e:
+            self._update(job_id, status="failed", error=str(e) or type(e).__name__)
+        else:
+            self._update(job_id, status="done", result=result)
+        finally:
+            with self._lock:
+                self._futures.pop(job_id, None)
+                self._cancelled.discard(job_id)
+
+    def _cancel_requested(self, job_id):
+        with self._lock:
+            return job_id in self._cancelled
+
+    def _update(self, job_id, **changes):
+        with self._lock:
+            self._set_locked(self._jobs[job_id], **changes)
+
+    def _set_locked(self, job, **changes):
+        for name, value in changes.items():
+            setattr(job, name, value)
+        job.updated_at = time.time()
+        # Progress ticks are throttled; status changes are always written
+        if "status" in changes or job.updated_at - self._saved_at.get(job.id, 0) >= PROGRESS_SAVE_INTERVAL:
+            self._save_locked(job)
+
+    def _save_locked(self, job):
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(asdict(job), f)
+        os.replace(tmp_path, os.path.join(self.root, f"{job.id}.json"))
+        self._saved_at[job.id] = job.updated_at
+
+    def _load_locked(self):
+        for name in os.listdir(self.root):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.root, name), encoding="utf-8") as f:
+                    job = Job(**json.load(f))
+            except (OSError, ValueError, TypeError):
+                continue
+            self._jobs[job.id] = job
+            if not job.finished:
+                # Its thread died with the previous process
+                self._set_locked(job, status="interrupted")
+        self._prune_locked()
+
+
+def extraction_job(context, key, stock_pdf, supply_pdf, max_pdf):
+    """Parse the three reports (bytes) into the registry and a snapshot."""
+    def load():
+        return load_pdf_dataset(
+            key, io.BytesIO(stock_pdf), io.BytesIO(supply_pdf), io.BytesIO(max_pdf),
+            progress=lambda report, done, total: context.progress(f"{report} pages", done, total))
+
+    # The snapshot outlives the registry entry, so the session can map it later
+    get_registry().acquire(key, load).release()
+    return {"dataset_key": key}
+
+
+def plan_job(context, build_plan, df_supply, df_max):
+    """Build a plan, validate it and save it as Arrow.
+
+    ``build_plan(progress)`` returns the plan and the stock table it drew from.
+    """
+    plan, df_stock = build_plan(context.callback("stores"))
+    if context.cancelled:
+        raise JobCancelled()
+    check_plan(plan, df_stock, df_supply, df_max)
+    path = os.path.join(context.queue.root, f"{context.job_id}.arrow")
+    write_plan_arrow(plan, path)
+    return {"plan_file": path, "lines": len(plan)}
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """The job queue shared by every session in this process."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
@@ -0,0 +1,289 @@
+"""Hedged LLM calls across providers.
+
+A request goes to the primary provider first. If no answer has come back
+after the hedge delay, or the primary fails, the same request is sent to
+the next provider, and the first good answer wins. The hedge delay is
+adaptive. It follows the primary's recent p95 latency, so only about one
+call in twenty is sent twice, and the slowest tail is cut.
+
+Streamed calls race on the first chunk instead of the whole answer: the
+first provider to start answering is streamed to the end, and the others
+are stopped.
+
+Latency, errors and wins are tracked per provider and call type (for
+example ``openai/stream`` and ``openai/batch``) for the whole process, so a
+quick streamed first chunk never sets the hedge delay of a multi-second
+batch call, or the other way round. Latency is the time until content
+starts to arrive: the first chunk of a streamed call, or the whole answer
+otherwise. A losing call is left to run until that point, so its latency
+still counts towards the statistics.
+"""
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable, Iterator
+
+import numpy as np
+from langchain_anthropic import ChatAnthropic
+from langchain_core.output_parsers import StrOutputParser
+from langchain_openai import ChatOpenAI
+
+OPENAI_MODEL = "gpt-4o-mini"
+ANTHROPIC_MODEL = os.getenv("ANTHROPIC_MODEL", "claude-3-5-haiku-latest")
+# Per-request timeout in seconds; a provider that hangs does not hold a worker for long
+LLM_TIMEOUT = 60
+LLM_ROUTER_WORKERS = int(os.getenv("LLM_ROUTER_WORKERS", "8"))
+
+# The hedge delay is the primary's p95 latency, kept within these bounds (seconds)
+HEDGE_QUANTILE = 95
+MIN_HEDGE_DELAY = 1.0
+MAX_HEDGE_DELAY = 15.0
+# Used until the primary has this many successful calls on record
+DEFAULT_HEDGE_DELAY = 5.0
+MIN_SAMPLES = 10
+# Successful calls kept per provider for the latency quantiles
+LATENCY_WINDOW = 200
+
+
+@dataclass(frozen=True)
+class Provider:
+    name: str
+    # Take the prompt inputs; return the answer text, or yield it in chunks
+    invoke: Callable[[dict], str]
+    stream: Callable[[dict], Iterator[str]]
+
+
+class ProviderStats:
+    def __init__(self, window=LATENCY_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.wins = 0
+        self.hedged = 0
+
+    def quantile(self, q):
+        return float(np.percentile(self.latencies, q)) if self.latencies else None
+
+    def summary(self):
+        p50, p95 = self.quantile(50), self.quantile(95)
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "wins": self.wins,
+            "hedged": self.hedged,
+            "p50_s": round(p50, 2) if p50 is not None else None,
+            "p95_s": round(p95, 2) if p95 is not None else None,
+        }
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=LLM_ROUTER_WORKERS, thread_name_prefix="llm")
+
+
+def _stats_for(name):
+    # Callers hold _stats_lock
+    stats = _stats.get(name)
+    if stats is None:
+        stats = _stats[name] = ProviderStats()
+    return stats
+
+
+def stats_key(name, call_type):
+    """Key of the statistics for ``call_type`` calls to provider ``name``."""
+    return f"{name}/{call_type}"
+
+
+def provider_stats():
+    """``{provider/call type: summary}`` for every provider called in this process."""
+    with _stats_lock:
+        return {name: stats.summary() for name, stats in _stats.items()}
+
+
+def hedge_delay(key):
+    """Seconds to wait on a call (``stats_key``) before hedging to the next provider."""
+    with _stats_lock:
+        stats = _stats.get(key)
+        if stats is None or len(stats.latencies) < MIN_SAMPLES:
+            return DEFAULT_HEDGE_DELAY
+        return min(max(stats.quantile(HEDGE_QUANTILE), MIN_HEDGE_DELAY), MAX_HEDGE_DELAY)
+
+
+def _record(key, seconds=None):
+    # seconds is None for a failed call
+    with _stats_lock:
+        stats = _stats_for(key)
+        stats.requests += 1
+        if seconds is None:
+            stats.errors += 1
+        else:
+            stats.latencies.append(seconds)
+
+
+def _call(provider, inputs, call_type):
+    key = stats_key(provider.name, call_type)
+    start = time.perf_counter()
+    try:
+        text = provider.invoke(inputs)
+    except Exception:
+        _record(key)
+        raise
+    _record(key, time.perf_counter() - start)
+    return text, provider.name
+
+
+def invoke_hedged(providers, inputs, call_type="invoke"):
+    """``(text, provider name)`` of the first good answer; providers in order of preference.
+
+    ``call_type`` names the kind of call (e.g. ``"batch"``) whose latencies
+    set its hedge delay. Raises the first error when every provider fails.
+    """
+    if not providers:
+        raise ValueError("No LLM provider configured")
+    primary, backups = providers[0], list(providers[1:])
+    pending = {_executor.submit(_call, primary, inputs, call_type)}
+    first_error = None
+    while True:
+        timeout = hedge_delay(stats_key(primary.name, call_type)) if backups else None
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                text, name = future.result()
+            except Exception as e:
+                first_error = first_error or e
+                continue
+            with _stats_lock:
+                _stats_for(stats_key(name, call_type)).wins += 1
+            return text, name
+        # Too slow or failed: hedge to the next provider, still accepting a late answer
+        if backups:
+            with _stats_lock:
+                _stats_for(stats_key(primary.name, call_type)).hedged += 1
+            pending.add(_executor.submit(_call, backups.pop(0), inputs, call_type))
+        elif not pending:
+            raise first_error
+
+
+# Marks the end of a streamed answer
+_END = object()
+
+
+def _stream(provider, inputs, attempt, events, stop, call_type):
+    """Push ``(attempt, chunk, error)`` events until the answer ends or ``stop`` is set."""
+    key = stats_key(provider.name, call_type)
+    start = time.perf_counter()
+    started = False
+    chunks = provider.stream(inputs)
+    try:
+        for chunk in chunks:
+            if not chunk:
+                continue
+            if not started:
+                started = True
+                _record(key, time.perf_counter() - start)
+            events.put((attempt, chunk, None))
+            if stop.is_set():
+                return
+    except Exception as e:
+        if not started:
+            _record(key)
+        events.put((attempt, None, e))
+        return
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+    if not started:
+        _record(key, time.perf_counter() - start)
+    events.put((attempt, _END, None))
+
+
+def stream_hedged(providers, inputs, call_type="stream"):
+    """Yield the answer of the first provider to start answering, chunk by chunk.
+
+    Hedges like ``invoke_hedged``, but on the first chunk: once a provider has
+    started answering, the others are stopped. An error before any provider
+    answers moves on to the next one; an error mid-answer is raised.
+    """
+    if not providers:
+        raise ValueError("No LLM provider configured")
+    events = queue.Queue()
+    stops = []
+
+    def start(provider):
+        stops.append(threading.Event())
+        _executor.submit(_stream, provider, inputs, len(stops) - 1, events, stops[-1], call_type)
+
+    primary, backups = providers[0], list(providers[1:])
+    start(primary)
+    running, winner, first_error = 1, None, None
+    try:
+        while True:
+            timeout = (hedge_delay(stats_key(primary.name, call_type))
+                       if winner is None and backups else None)
+            try:
+                attempt, chunk, error = events.get(timeout=timeout)
+            except queue.Empty:
+                attempt, chunk, error = None, None, None
+            if winner is not None and attempt != winner:
+                continue
+            if error is not None:
+                if winner is not None:
+                    raise error
+                running -= 1
+                first_error = first_error or error
+            if chunk is None:
+                # Too slow or failed before answering: hedge to the next provider
+                if backups:
+                    with _stats_lock:
+                        _stats_for(stats_key(primary.name, call_type)).hedged += 1
+                    start(backups.pop(0))
+                    running += 1
+                elif not running:
+                    raise first_error
+                continue
+
+            if winner is None:
+                winner = attempt
+                with _stats_lock:
+                    _stats_for(stats_key(providers[attempt].name, call_type)).wins += 1
+                for position, stop in enumerate(stops):
+                    if position != winner:
+                        stop.set()
+            if chunk is _END:
+                return
+            yield chunk
+    finally:
+        for stop in stops:
+            stop.set()
+
+
+def chat_providers(prompt, openai_api_key=None, anthropic_api_key=None, json_output=False,
+                   max_tokens=None):
+    """OpenAI then Anthropic, for the keys given, each answering ``prompt``.
+
+    With ``json_output`` OpenAI is held to a JSON object answer; Anthropic
+    has no such mode and follows the prompt's instructions. ``max_tokens``
+    maps provider name to its answer length limit.
+    """
+    max_tokens = max_tokens or {}
+    llms = []
+    if openai_api_key:
+        llm = ChatOpenAI(
+            model=OPENAI_MODEL, temperature=0, openai_api_key=openai_api_key,
+            timeout=LLM_TIMEOUT, max_retries=1, max_tokens=max_tokens.get("openai"))
+        if json_output:
+            llm = llm.bind(response_format={"type": "json_object"})
+        llms.append(("openai", llm))
+    if anthropic_api_key:
+        options = {"max_tokens": max_tokens["anthropic"]} if "anthropic" in max_tokens else {}
+        llms.append(("anthropic", ChatAnthropic(
+            model=ANTHROPIC_MODEL, temperature=0, anthropic_api_key=anthropic_api_key,
+            timeout=LLM_TIMEOUT, max_retries=1, **options)))
+
+    chains = [(name, prompt | llm | StrOutputParser()) for name, llm in llms]
+    return [Provider(name, chain.invoke, chain.stream) for name, chain in chains]
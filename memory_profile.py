@@ -0,0 +1,265 @@
+"""Memory profile of the ingestion and planning pipeline, stage by stage.
+
+The pipeline marks its stage boundaries with ``memory_stage(name)``, which
+costs nothing unless a profile is active. Inside ``profile()`` tracemalloc
+runs, and each stage records the memory it left allocated, the peak reached
+while it ran, and the allocation sites that grew the most. Sites are shown
+where the memory was allocated (often inside pandas or PyMuPDF) together
+with the line in this project that led there.
+
+tracemalloc traces the whole process, so profile one pipeline at a time
+(the CLI below), not a busy Streamlit worker. It sees Python allocations
+only; memory held natively by MuPDF or Arrow buffers is not counted.
+
+Usage (CLI)::
+
+    python memory_profile.py 5_Jacket_Stock.pdf 5_Jacket_Supply_24.pdf 5_Max_Pcs.pdf
+    python memory_profile.py snapshots/<key> --budget "extract supply=200" --report memory.json
+
+Budgets are peak MB per stage (``total`` for the whole run); the command
+exits with status 1 when one is exceeded, so a benchmark run can gate on it.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from dataclasses import asdict, dataclass
+
+import pandas as pd
+
+# Allocation sites reported per stage
+TOP_SITES = 10
+# Stack depth kept per allocation, enough to get from pandas internals back to our code
+TRACE_FRAMES = 25
+
+MB = 1024 * 1024
+_PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+class MemoryBudgetExceeded(AssertionError):
+    def __init__(self, overruns):
+        self.overruns = overruns
+        super().__init__("; ".join(
+            f"{stage}: peak {peak / MB:.1f} MB > budget {budget / MB:.1f} MB"
+            for stage, peak, budget in overruns))
+
+
+@dataclass(frozen=True)
+class AllocationSite:
+    # Where the memory was allocated, and the project line that called into it
+    site: str
+    caller: str
+    size: int
+    count: int
+
+
+@dataclass(frozen=True)
+class StageMemory:
+    name: str
+    seconds: float
+    # Traced memory held at the end of the stage, and its net change over the stage
+    current: int
+    retained: int
+    # Highest traced memory while the stage ran
+    peak: int
+    top_sites: tuple
+
+
+def short_path(filename):
+    """Project files relative to the project, library files as package/module.py."""
+    if filename.startswith(_PROJECT_ROOT):
+        return os.path.relpath(filename, _PROJECT_ROOT)
+    return filename.rpartition("site-packages" + os.sep)[2]
+
+
+def _frame(frame):
+    return f"{short_path(frame.filename)}:{frame.lineno}"
+
+
+def _caller(traceback):
+    # Frames run from the outermost call to the allocation; the nearest project frame wins
+    for frame in reversed(traceback):
+        if frame.filename.startswith(_PROJECT_ROOT) and frame.filename != __file__:
+            return _frame(frame)
+    return ""
+
+
+class MemoryProfiler:
+    def __init__(self, top=TOP_SITES):
+        self.top = top
+        self.stages = []
+        self.peak = 0
+        self._lock = threading.RLock()
+
+    @contextmanager
+    def stage(self, name):
+        with self._lock:
+            before = self._snapshot()
+            start_current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                seconds = time.perf_counter() - start
+                current, peak = tracemalloc.get_traced_memory()
+                sites = self._top_sites(self._snapshot().compare_to(before, "traceback"))
+                self.peak = max(self.peak, peak)
+                self.stages.append(StageMemory(
+                    name=name, seconds=round(seconds, 3), current=current,
+                    retained=current - start_current, peak=peak, top_sites=sites))
+
+    @staticmethod
+    def _snapshot():
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+
+    def _top_sites(self, differences):
+        # Tracebacks that end in the same place from the same caller are one site
+        sites = {}
+        for difference in differences:
+            if difference.size_diff <= 0:
+                continue
+            key = (_frame(difference.traceback[-1]), _caller(difference.traceback))
+            size, count = sites.get(key, (0, 0))
+            sites[key] = (size + difference.size_diff, count + difference.count_diff)
+        ranked = sorted(sites.items(), key=lambda item: item[1][0], reverse=True)[:self.top]
+        return tuple(AllocationSite(site=site, caller=caller, size=size, count=count)
+                     for (site, caller), (size, count) in ranked)
+
+    def to_frame(self):
+        return pd.DataFrame({
+            "stage": [stage.name for stage in self.stages],
+            "seconds": [stage.seconds for stage in self.stages],
+            "retained_mb": [round(stage.retained / MB, 2) for stage in self.stages],
+            "current_mb": [round(stage.current / MB, 2) for stage in self.stages],
+            "peak_mb": [round(stage.peak / MB, 2) for stage in self.stages],
+        })
+
+    def report(self):
+        lines = [self.to_frame().to_string(index=False), "",
+                 f"Peak over the run: {self.peak / MB:.2f} MB"]
+        for stage in self.stages:
+            lines += ["", f"{stage.name}: top allocation sites"]
+            for site in stage.top_sites:
+                caller = f" (from {site.caller})" if site.caller and site.caller != site.site else ""
+                lines.append(f"  {site.size / MB:9.2f} MB {site.count:9d} blocks  {site.site}{caller}")
+        return "\n".join(lines)
+
+    def write_report(self, path):
+        """Write the report as JSON (``.json``) or text."""
+        with open(path, "w", encoding="utf-8") as f:
+            if path.endswith(".json"):
+                json.dump({"peak": self.peak, "stages": [asdict(stage) for stage in self.stages]},
+                          f, indent=2)
+            else:
+                f.write(self.report() + "\n")
+
+    def check_budgets(self, budgets):
+        """Raise ``MemoryBudgetExceeded`` when a stage's peak is over its budget (bytes).
+
+        ``budgets`` maps stage names, or ``"total"`` for the whole run, to bytes.
+        """
+        peaks = {"total": self.peak}
+        for stage in self.stages:
+            peaks[stage.name] = max(peaks.get(stage.name, 0), stage.peak)
+        overruns = [(name, peaks[name], budget) for name, budget in budgets.items()
+                    if name in peaks and peaks[name] > budget]
+        if overruns:
+            raise MemoryBudgetExceeded(overruns)
+
+
+_active = None
+
+
+def memory_stage(name):
+    """Mark a pipeline stage; recorded only while a profile is active."""
+    profiler = _active
+    return profiler.stage(name) if profiler is not None else nullcontext()
+
+
+@contextmanager
+def profile(top=TOP_SITES, frames=TRACE_FRAMES):
+    """Trace allocations and collect the stages run inside the block."""
+    global _active
+    if _active is not None:
+        raise RuntimeError("A memory profile is already running")
+    profiler = MemoryProfiler(top)
+    tracemalloc.start(frames)
+    _active = profiler
+    try:
+        yield profiler
+    finally:
+        _active = None
+        profiler.peak = max(profiler.peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+
+def profile_pipeline(source, build_plan=None):
+    """Profile loading ``source`` and building a network plan from it.
+
+    ``source`` is a snapshot directory or a ``(stock, supply, max)`` triple of
+    PDF paths. PDFs are parsed even if their snapshot exists; set
+    ``PAGE_CACHE_ROOT=`` to parse every page as if never seen.
+    """
+    from allocation import build_network_plan
+    from dataset_registry import build_dataset, parse_pdf_dataset
+    from plan_validation import validate_plan
+    from snapshot import read_snapshot
+
+    build_plan = build_plan or build_network_plan
+    with profile() as profiler:
+        if isinstance(source, str):
+            with memory_stage("read snapshot"):
+                tables = read_snapshot(source)
+            dataset = build_dataset(os.path.basename(source), *tables)
+        else:
+            dataset = build_dataset("profile", *parse_pdf_dataset(*source))
+        with memory_stage("network plan"):
+            plan = build_plan(dataset.store_capacities, dataset.godown_stock,
+                              dataset.articles_sent_in_2024)
+        with memory_stage("validate plan"):
+            validate_plan(plan, dataset.df_stock, dataset.df_supply, dataset.df_max)
+    return profiler
+
+
+def _budget(text):
+    name, _, megabytes = text.rpartition("=")
+    if not name:
+        raise argparse.ArgumentTypeError(f"Expected STAGE=MB, got {text!r}")
+    return name, float(megabytes) * MB
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Memory profile of the allocation pipeline")
+    parser.add_argument("source", nargs="+", help="snapshot directory, or stock, supply and max PDFs")
+    parser.add_argument("--budget", action="append", type=_budget, default=[],
+                        help="peak budget as STAGE=MB (repeatable; 'total' for the whole run)")
+    parser.add_argument("--report", help="also write the report to this .json or .txt file")
+    args = parser.parse_args(argv)
+    if len(args.source) not in (1, 3):
+        parser.error("give one snapshot directory or three PDFs")
+
+    profiler = profile_pipeline(args.source[0] if len(args.source) == 1 else tuple(args.source))
+    print(profiler.report())
+    if args.report:
+        profiler.write_report(args.report)
+    try:
+        profiler.check_budgets(dict(args.budget))
+    except MemoryBudgetExceeded as e:
+        print(f"\n❌ Memory budget exceeded: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    # Run as the imported module, so stages marked by the pipeline reach this profile
+    import memory_profile
+    sys.exit(memory_profile.main())
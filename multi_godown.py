@@ -0,0 +1,251 @@
+"""Allocation across several godowns, each with its own stock ledger.
+
+Every store draws from its preferred godowns first (lowest ``rank`` in the
+preference table) and spills over to the others only when those run dry.
+The allocation works on integer codes in rounds. In each round every store
+proposes its best remaining articles at once, each from the best-ranked
+godown that still holds that article. Proposals are then cut by store
+capacity and by each godown ledger, and what survives is committed.
+
+Articles are ranked once per demand cluster. Each store keeps a position in
+its cluster's ranking, and a round only looks at a window of about twice the
+store's remaining capacity from there, so the stores x articles x godowns
+grid is never built. Articles a store can no longer take (allocated, sent
+in 2024, excluded, or out of stock) stay that way, so the position skips
+them for good; a window with too few live articles is widened and retried.
+"""
+import numpy as np
+import pandas as pd
+
+from allocation import NO_DEMAND
+from demand_scoring import NETWORK_CLUSTER
+from store_master import normalize_store_name
+
+
+def combine_godown_stock(godown_stocks):
+    """One stock table with a ``godown`` column from ``{godown: df_stock}``."""
+    frames = [df[["article_number", "quantity_available"]].assign(godown=godown)
+              for godown, df in godown_stocks.items()]
+    if not frames:
+        return pd.DataFrame(columns=["godown", "article_number", "quantity_available"])
+    ledger = pd.concat(frames, ignore_index=True)
+    return (ledger.groupby(["godown", "article_number"], as_index=False, sort=False)
+            ["quantity_available"].sum())
+
+
+def read_godown_preferences(file):
+    """Read a ``store_location, godown[, rank]`` CSV; rank defaults to row order per store."""
+    prefs = pd.read_csv(file)
+    prefs["store_location"] = prefs["store_location"].map(normalize_store_name)
+    if "rank" not in prefs:
+        prefs["rank"] = prefs.groupby("store_location").cumcount()
+    return prefs[["store_location", "godown", "rank"]]
+
+
+def _group_position(keys):
+    """Position of each element within its run of equal, contiguous ``keys``."""
+    n = len(keys)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    run_lengths = np.diff(np.r_[starts, n])
+    return np.arange(n) - np.repeat(starts, run_lengths)
+
+
+# A store's window covers this many times its remaining capacity, to absorb dead articles
+WINDOW_FACTOR = 2
+
+
+def build_multi_godown_plan(store_capacities, godown_stocks, articles_sent_in_2024,
+                            godown_preferences=None, demand_scores=None, family_constraints=None,
+                            progress=None):
+    """Network plan sourced from several godowns.
+
+    ``godown_stocks`` maps a godown name to its stock table
+    (``article_number``, ``quantity_available``). ``godown_preferences``
+    is an optional DataFrame of ``store_location, godown, rank``; godowns a
+    store does not rank come after its ranked ones, in ``godown_stocks`` order.
+    With ``demand_scores``, articles are offered by 2024 demand before stock depth.
+    ``family_constraints`` (see ``article_families.py``) excludes families per
+    store and caps how many articles of a family each store receives.
+    ``progress(stores done, total stores)`` is called after each round.
+    """
+    ledger = combine_godown_stock(godown_stocks)
+    ledger = ledger[ledger["quantity_available"] > 0].reset_index(drop=True)
+
+    stores = pd.Index(list(store_capacities))
+    godowns = pd.Index(list(godown_stocks))
+    articles = pd.Index(ledger["article_number"].unique())
+    n_stores, n_godowns, n_articles = len(stores), len(godowns), len(articles)
+
+    line_godown = godowns.get_indexer(ledger["godown"])
+    line_article = articles.get_indexer(ledger["article_number"])
+    line_stock = ledger["quantity_available"].to_numpy(dtype=np.int64)
+    remaining = line_stock.copy()
+    capacity_left = np.array([store_capacities[store] for store in stores], dtype=np.int64)
+
+    # Articles with the deepest total stock are offered first, as in create_allocation
+    article_total = np.bincount(line_article, weights=line_stock, minlength=n_articles)
+
+    has_preferences = godown_preferences is not None and len(godown_preferences)
+    unranked = int(godown_preferences["rank"].max()) + 1 if has_preferences else 0
+    rank = np.tile(unranked + np.arange(n_godowns), (n_stores, 1))
+    if has_preferences:
+        pref_store = stores.get_indexer(godown_preferences["store_location"])
+        pref_godown = godowns.get_indexer(godown_preferences["godown"])
+        known = (pref_store >= 0) & (pref_godown >= 0)
+        rank[pref_store[known], pref_godown[known]] = (
+            godown_preferences["rank"].to_numpy()[known])
+
+    # One flag per (store, article): set for pairs supplied in 2024 and for
+    # pairs already allocated from some godown
+    resolved = np.zeros(n_stores * n_articles, dtype=bool)
+    for store, sent in articles_sent_in_2024.items():
+        if store in stores:
+            codes = articles.get_indexer(list(sent))
+            resolved[stores.get_loc(store) * n_articles + codes[codes >= 0]] = True
+
+    # Family rules: excluded pairs count as resolved; caps are a per-store
+    # countdown per cap group, looked up by article code
+    n_groups = 0
+    if family_constraints is not None:
+        for position, store in enumerate(stores):
+            codes = articles.get_indexer(list(family_constraints.excluded_for(store)))
+            resolved[position * n_articles + codes[codes >= 0]] = True
+        n_groups = len(family_constraints.limits)
+        article_group = np.array([family_constraints.group_of.get(article, -1)
+                                  for article in articles], dtype=np.int64)
+        family_left = np.tile(np.array(family_constraints.limits, dtype=np.int64), (n_stores, 1))
+
+    # Articles in offer order per demand cluster: 2024 demand, then deepest stock
+    if demand_scores is None:
+        store_cluster = np.zeros(n_stores, dtype=np.int64)
+        demand_keys = [np.zeros((2, n_articles))]
+    else:
+        cluster_names = pd.Index(list(demand_scores.rank_keys))
+        store_cluster = cluster_names.get_indexer(
+            [demand_scores.store_cluster.get(store, NETWORK_CLUSTER) for store in stores])
+        demand_keys = []
+        for name in cluster_names:
+            keys = demand_scores.rank_keys[name]
+            demand_keys.append(np.array(
+                [keys.get(article, NO_DEMAND) for article in articles]).reshape(-1, 2).T)
+    article_order = np.stack([
+        np.lexsort((np.arange(n_articles), -article_total, -keys[1], -keys[0]))
+        for keys in demand_keys])
+
+    # Ledger lines of each article, and each store's preference for a line
+    # (godown rank, then ledger order) as one integer; lower is better
+    lines_by_article = np.argsort(line_article, kind="stable")
+    article_lines = np.bincount(line_article, minlength=n_articles)
+    article_first_line = np.r_[0, np.cumsum(article_lines)[:-1]]
+    no_line = np.iinfo(np.int64).max
+
+    def best_lines(s, article):
+        """Best-ranked ledger line with stock left for each (store, article), or -1."""
+        if not len(s):
+            return np.zeros(0, dtype=np.int64)
+        counts = article_lines[article]
+        owner = np.repeat(np.arange(len(s)), counts)
+        line = lines_by_article[np.repeat(article_first_line[article], counts)
+                                + _group_position(owner)]
+        preference = rank[s[owner], line_godown[line]] * len(ledger) + line
+        preference[remaining[line] <= 0] = no_line
+        best = np.minimum.reduceat(preference, np.r_[0, np.cumsum(counts)[:-1]])
+        return np.where(best < no_line, best % len(ledger), -1)
+
+    def proposals(active, width):
+        """Each active store's best live articles within ``width`` of its position.
+
+        Advances positions past dead articles. Returns ``(store, line, pair)``
+        of the proposals, and the stores (with their widths) whose window held
+        too few live articles to fill their capacity; those propose nothing yet.
+        """
+        start = position[active]
+        s = np.repeat(active, width)
+        offset = _group_position(s)
+        inside = position[s] + offset < n_articles
+        s, offset = s[inside], offset[inside]
+        article = article_order[store_cluster[s], position[s] + offset]
+        pair = s * n_articles + article
+        live = ~resolved[pair]
+        if n_groups:
+            group = article_group[article]
+            live &= (group < 0) | (family_left[s, group.clip(min=0)] > 0)
+        line = np.full(len(s), -1, dtype=np.int64)
+        line[live] = best_lines(s[live], article[live])
+        live &= line >= 0
+
+        # Everything before a store's first live article is dead for good
+        first_live = np.full(n_stores, n_articles, dtype=np.int64)
+        np.minimum.at(first_live, s[live], offset[live])
+        position[active] = np.minimum(start + np.minimum(first_live[active], width), n_articles)
+
+        s, line, pair = s[live], line[live], pair[live]
+        if n_groups:
+            # Only each store's best remaining-cap articles of a capped family
+            group = article_group[line_article[line]]
+            key = np.where(group >= 0, s * n_groups + group, -1)
+            by_group = np.argsort(key, kind="stable")
+            rank_in_group = np.empty(len(key), dtype=np.int64)
+            rank_in_group[by_group] = _group_position(key[by_group])
+            within_cap = (group < 0) | (rank_in_group < family_left[s, group.clip(min=0)])
+            s, line, pair = s[within_cap], line[within_cap], pair[within_cap]
+        within_capacity = _group_position(s) < capacity_left[s]
+        s, line, pair = s[within_capacity], line[within_capacity], pair[within_capacity]
+
+        proposed = np.bincount(s, minlength=n_stores)[active]
+        short = (proposed < capacity_left[active]) & (start + width < n_articles)
+        done = ~np.isin(s, active[short])
+        return (s[done], line[done], pair[done]), active[short], width[short]
+
+    position = np.zeros(n_stores, dtype=np.int64)
+    out_store, out_line = [], []
+    while True:
+        active = np.flatnonzero((capacity_left > 0) & (position < n_articles))
+        if not len(active):
+            break
+        # Widen short windows until every store sees enough live articles
+        found = []
+        width = WINDOW_FACTOR * capacity_left[active]
+        while len(active):
+            candidates, active, width = proposals(active, width)
+            found.append(candidates)
+            width = width * 2
+        s, line, pair = (np.concatenate(column) for column in zip(*found))
+        if not len(s):
+            break
+
+        # Each ledger line serves stores in store order until it runs out
+        by_line = np.lexsort((s, line))
+        s, line, pair = s[by_line], line[by_line], pair[by_line]
+        accepted = _group_position(line) < remaining[line]
+        s, line, pair = s[accepted], line[accepted], pair[accepted]
+
+        out_store.append(s)
+        out_line.append(line)
+        remaining -= np.bincount(line, minlength=len(remaining))
+        capacity_left -= np.bincount(s, minlength=n_stores)
+        resolved[pair] = True
+        if n_groups:
+            group = article_group[line_article[line]]
+            capped = group >= 0
+            family_left -= np.bincount(s[capped] * n_groups + group[capped],
+                                       minlength=n_stores * n_groups).reshape(n_stores, n_groups)
+        if progress is not None:
+            progress(int(np.count_nonzero((capacity_left <= 0) | (position >= n_articles))), n_stores)
+    if progress is not None:
+        progress(n_stores, n_stores)
+
+    plan_store = np.concatenate(out_store) if out_store else np.zeros(0, dtype=np.int64)
+    plan_line = np.concatenate(out_line) if out_line else np.zeros(0, dtype=np.int64)
+    order = np.lexsort((-article_total[line_article[plan_line]], plan_store))
+    plan_store, plan_line = plan_store[order], plan_line[order]
+
+    return pd.DataFrame({
+        "store_location": pd.Categorical.from_codes(plan_store, categories=stores),
+        "article_number": pd.Categorical.from_codes(line_article[plan_line], categories=articles),
+        "godown": pd.Categorical.from_codes(line_godown[plan_line], categories=godowns),
+        "quantity": np.ones(len(plan_line), dtype=np.int32),
+        "available_in_godown": line_stock[plan_line].astype(np.int32),
+    })
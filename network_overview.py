@@ -0,0 +1,108 @@
+"""Network-wide aggregates of an allocation plan for the overview dashboard.
+
+An overview is a few NumPy arrays indexed by store and by article, filled
+with one ``bincount`` each over the plan's integer codes. It is computed once
+per plan version and cached; charts only slice these arrays, so the overview
+renders in the same time for five stores or a thousand.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from plan_validation import _codes
+
+# Stores per row of the utilization heatmap
+HEATMAP_COLUMNS = 40
+
+
+@dataclass(frozen=True)
+class NetworkOverview:
+    stores: np.ndarray
+    store_capacity: np.ndarray
+    store_allocated: np.ndarray
+    articles: np.ndarray
+    article_stock: np.ndarray
+    article_allocated: np.ndarray
+
+    @property
+    def utilization(self):
+        """Allocated share of each store's capacity (0 for stores without capacity)."""
+        return np.divide(self.store_allocated, self.store_capacity,
+                         out=np.zeros(len(self.stores)), where=self.store_capacity > 0)
+
+    @property
+    def unfilled(self):
+        return np.clip(self.store_capacity - self.store_allocated, 0, None)
+
+    @property
+    def depletion(self):
+        """Share of each article's godown stock the plan sends out."""
+        return np.divide(self.article_allocated, self.article_stock,
+                         out=np.zeros(len(self.articles)), where=self.article_stock > 0)
+
+    def totals(self):
+        capacity = int(self.store_capacity.sum())
+        allocated = int(self.store_allocated.sum())
+        stock = int(self.article_stock.sum())
+        return {
+            "capacity": capacity,
+            "allocated": allocated,
+            "unfilled": int(self.unfilled.sum()),
+            "fill_rate": round(allocated / capacity * 100, 1) if capacity else 0.0,
+            "stock": stock,
+            "leftover_stock": stock - int(self.article_allocated.sum()),
+            "full_stores": int((self.unfilled == 0).sum()),
+            # Articles the plan empties; ones with no stock to begin with don't count
+            "depleted_articles": int(((self.article_stock > 0)
+                                      & (self.article_allocated >= self.article_stock)).sum()),
+        }
+
+    def heatmap(self, columns=HEATMAP_COLUMNS):
+        """Stores laid out on a grid, in store order, with their utilization."""
+        position = np.arange(len(self.stores))
+        return pd.DataFrame({
+            "row": position // columns,
+            "column": position % columns,
+            "store": self.stores,
+            "utilization": self.utilization.round(3),
+            "allocated": self.store_allocated,
+            "capacity": self.store_capacity,
+        })
+
+    def top_unfilled(self, n=20):
+        order = np.argsort(-self.unfilled, kind="stable")[:n]
+        order = order[self.unfilled[order] > 0]
+        return pd.DataFrame({"unfilled": self.unfilled[order]}, index=self.stores[order])
+
+    def top_depleted(self, n=20):
+        order = np.argsort(-self.depletion, kind="stable")[:n]
+        return pd.DataFrame({"depletion": self.depletion[order].round(3)},
+                            index=self.articles[order])
+
+    def depletion_histogram(self, bins=10):
+        counts, edges = np.histogram(self.depletion, bins=bins, range=(0, 1))
+        labels = [f"{int(lo * 100)}–{int(hi * 100)}%" for lo, hi in zip(edges[:-1], edges[1:])]
+        return pd.DataFrame({"articles": counts}, index=pd.Index(labels, name="stock allocated"))
+
+
+def compute_network_overview(plan, store_capacities, godown_stock):
+    """Aggregate a plan against the capacities and stock it was built from."""
+    stores = pd.Index(list(store_capacities))
+    articles = pd.Index(list(godown_stock))
+    quantity = plan["quantity"].to_numpy()
+
+    store_codes = _codes(plan["store_location"], stores)
+    article_codes = _codes(plan["article_number"], articles)
+    by_store, by_article = store_codes >= 0, article_codes >= 0
+
+    return NetworkOverview(
+        stores=stores.to_numpy(),
+        store_capacity=np.fromiter(store_capacities.values(), dtype=np.int64, count=len(stores)),
+        store_allocated=np.bincount(store_codes[by_store], weights=quantity[by_store],
+                                    minlength=len(stores)).astype(np.int64),
+        articles=articles.to_numpy(),
+        article_stock=np.fromiter(godown_stock.values(), dtype=np.int64, count=len(articles)),
+        article_allocated=np.bincount(article_codes[by_article], weights=quantity[by_article],
+                                      minlength=len(articles)).astype(np.int64),
+    )
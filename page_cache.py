@@ -0,0 +1,200 @@
+"""Page-level cache for re-ingesting revised reports.
+
+The ERP re-exports a report with a few pages appended or corrected, yet
+text extraction is paid per page. Each page is therefore identified by a
+hash of its raw content stream, read with PyMuPDF without extracting any
+text, and the rows parsed from it are kept per layout in
+``page_cache/<layout>.arrow``. The cache is shared by every report of the
+layout and holds at most ``PAGE_CACHE_MAX_PAGES`` pages, dropping the least
+recently ingested ones first. Re-ingesting a report extracts and parses
+only the pages whose hash is not in the cache and splices their rows
+between the cached ones, in page order. Pages are parsed from their word
+boxes (see ``box_parser.py``), or from their text when the report has no
+column headings.
+
+A page's content stream holds its text-drawing operators, so a corrected
+quantity or an added line changes the hash. The cache file records the
+parser pattern it was built with and is ignored once that pattern changes.
+"""
+import hashlib
+import io
+import json
+import os
+import tempfile
+from contextlib import nullcontext
+
+import fitz  # PyMuPDF
+import numpy as np
+import pandas as pd
+import pdfplumber
+
+from box_parser import learn_columns, parse_page
+from table_parser import LAYOUTS, check_layout, parse_rows, rows_to_frame
+
+# Empty to turn the cache off
+PAGE_CACHE_ROOT = os.getenv("PAGE_CACHE_ROOT", "page_cache")
+PAGE_CACHE_VERSION = 2
+# Pages kept per layout across all reports; 0 for no limit
+PAGE_CACHE_MAX_PAGES = int(os.getenv("PAGE_CACHE_MAX_PAGES", "20000"))
+
+
+def _read_bytes(file):
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, "rb") as f:
+            return f.read()
+    if hasattr(file, "getvalue"):
+        return file.getvalue()
+    position = file.tell()
+    data = file.read()
+    file.seek(position)
+    return data
+
+
+def page_hashes(doc):
+    """Content hash of every page of an open PyMuPDF document, in page order."""
+    return [hashlib.blake2b(page.read_contents(), digest_size=16).hexdigest() for page in doc]
+
+
+def _fingerprint(layout):
+    return hashlib.blake2b(LAYOUTS[layout].line.pattern.encode(), digest_size=8).hexdigest()
+
+
+class PageCache:
+    """Parsed rows of previously seen pages, one Arrow file per layout.
+
+    Pages are stored least recently used first, so the file order is the
+    eviction order.
+    """
+
+    def __init__(self, root=PAGE_CACHE_ROOT, max_pages=PAGE_CACHE_MAX_PAGES):
+        self.root = root
+        self.max_pages = max_pages
+
+    def _path(self, layout):
+        return os.path.join(self.root, f"{layout}.arrow")
+
+    def load(self, layout):
+        """``(rows, spans)``: the cached rows and ``{page hash: (start, stop)}`` into them.
+
+        ``spans`` is ordered least recently used first.
+        """
+        import pyarrow as pa
+
+        empty = rows_to_frame([], layout), {}
+        path = self._path(layout)
+        if not os.path.isfile(path):
+            return empty
+        try:
+            with pa.memory_map(path, "r") as source:
+                table = pa.ipc.open_file(source).read_all()
+            meta = json.loads(table.schema.metadata[b"pages"])
+        except (OSError, ValueError, KeyError, pa.ArrowInvalid):
+            return empty
+        if meta.get("version") != PAGE_CACHE_VERSION or meta.get("parser") != _fingerprint(layout):
+            return empty
+
+        counts = np.asarray(meta["counts"], dtype=np.int64)
+        stops = np.cumsum(counts)
+        spans = dict(zip(meta["hashes"], zip((stops - counts).tolist(), stops.tolist())))
+        return table.to_pandas(), spans
+
+    def store(self, layout, rows, hashes, counts):
+        """Replace the layout's cache with ``rows``, laid out page by page as ``hashes``."""
+        import pyarrow as pa
+
+        meta = {"version": PAGE_CACHE_VERSION, "parser": _fingerprint(layout),
+                "hashes": list(hashes), "counts": [int(count) for count in counts]}
+        table = pa.Table.from_pandas(rows, preserve_index=False)
+        table = table.replace_schema_metadata({b"pages": json.dumps(meta).encode()})
+
+        # Written aside and swapped in, so a concurrent reader never maps half a file
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(tmp_path, self._path(layout))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+def _text_rows(pdf, position, layout):
+    # For reports without column headings: rows from the page's extracted text
+    text = pdf.pages[position].extract_text() or ""
+    if position == 0:
+        check_layout(text, layout)
+    return parse_rows(text, layout)
+
+
+def parse_pdf_incremental(file, layout, progress=None, cache=None):
+    """Parse a report PDF, extracting only the pages not seen before.
+
+    Returns the same table as ``parse_pdf(file, layout)``. ``progress(done,
+    total)`` is called after each page; cached pages count as done at once.
+    Raises ``ValueError`` if ``file`` is not a readable PDF.
+    """
+    if cache is None and PAGE_CACHE_ROOT:
+        cache = PageCache()
+
+    data = _read_bytes(file)
+    try:
+        doc = fitz.open(stream=data, filetype="pdf")
+    except fitz.FileDataError as e:
+        # Not a PDF, empty or damaged: bad input like a report in the wrong slot
+        raise ValueError(f"Not a readable {layout} report PDF: {e}") from e
+    with doc:
+        hashes = page_hashes(doc)
+        cached, spans = cache.load(layout) if cache is not None else (rows_to_frame([], layout), {})
+
+        # First occurrence of each page not in the cache
+        missing = {}
+        for position, page_hash in enumerate(hashes):
+            if page_hash not in spans:
+                missing.setdefault(page_hash, position)
+
+        done = len(hashes) - len(missing)
+        if progress is not None and done:
+            progress(done, len(hashes))
+        new_rows, new_spans = [], {}
+        if missing:
+            columns = learn_columns(doc[0], layout) if len(doc) else None
+            text_pdf = (nullcontext() if columns is not None
+                        else pdfplumber.open(io.BytesIO(data)))
+            with text_pdf:
+                for page_hash, position in missing.items():
+                    if columns is not None:
+                        rows = parse_page(doc[position], layout, columns)
+                    else:
+                        rows = _text_rows(text_pdf, position, layout)
+                    new_spans[page_hash] = (len(cached) + len(new_rows),
+                                            len(cached) + len(new_rows) + len(rows))
+                    new_rows.extend(rows)
+                    done += 1
+                    if progress is not None:
+                        progress(done, len(hashes))
+            fresh = rows_to_frame(new_rows, layout)
+            combined = pd.concat([cached, fresh], ignore_index=True) if len(cached) else fresh
+            spans.update(new_spans)
+        else:
+            combined = cached
+
+    def take(pages):
+        ranges = [np.arange(*spans[page_hash]) for page_hash in pages]
+        order = np.concatenate(ranges) if ranges else np.array([], dtype=np.int64)
+        return combined.take(order).reset_index(drop=True)
+
+    if cache is not None:
+        # Other reports' pages stay, least recently used first; this report's
+        # pages move to the end and the oldest beyond the bound drop out
+        distinct = list(dict.fromkeys(hashes))
+        current = set(distinct)
+        order = [page_hash for page_hash in spans if page_hash not in current] + distinct
+        if cache.max_pages:
+            order = order[-cache.max_pages:]
+        if missing or order != list(spans):
+            cache.store(layout, take(order), order,
+                        [spans[page_hash][1] - spans[page_hash][0] for page_hash in order])
+
+    return take(hashes).astype(LAYOUTS[layout].dtypes)
@@ -1,9 +1,5 @@
 import streamlit as st
-import pdfplumber
-import pandas as pd
-import logging
-
-logging.getLogger("pdfminer").setLevel(logging.ERROR)
+from extraction import extract_stock_data, extract_supply_data, extract_max_data
 
 st.set_page_config(page_title="🧥 Jacket Allocation Data Extractor", layout="wide")
 
@@ -17,49 +13,7 @@ supply_file = st.file_uploader("Upload '5_Jacket_Supply_24.pdf'", type=["pdf"])
 max_file = st.file_uploader("Upload '5_Max_Pcs.pdf'", type=["pdf"])
 
 # ----------- 2. Helper Functions -----------
-
-def extract_stock_data(file):
-    stock_entries = []
-    with pdfplumber.open(file) as pdf:
-        for page in pdf.pages:
-            lines = page.extract_text().split('\n')
-            for line in lines:
-                parts = line.strip().split()
-                if len(parts) == 2 and parts[1].isdigit():
-                    stock_entries.append({
-                        "article_number": parts[0],
-                        "quantity_available": int(parts[1])
-                    })
-    return pd.DataFrame(stock_entries)
-
-def extract_supply_data(file):
-    supply_entries = []
-    with pdfplumber.open(file) as pdf:
-        for page in pdf.pages:
-            lines = page.extract_text().split('\n')
-            for line in lines:
-                parts = line.strip().rsplit(" ", 2)
-                if len(parts) == 3 and parts[2].isdigit():
-                    supply_entries.append({
-                        "store_location": parts[0],
-                        "article_number": parts[1],
-                        "quantity_supplied_2024": int(parts[2])
-                    })
-    return pd.DataFrame(supply_entries)
-
-def extract_max_data(file):
-    max_entries = []
-    with pdfplumber.open(file) as pdf:
-        for page in pdf.pages:
-            lines = page.extract_text().split('\n')
-            for line in lines:
-                parts = line.strip().rsplit(" ", 1)
-                if len(parts) == 2 and parts[1].isdigit():
-                    max_entries.append({
-                        "store_location": parts[0],
-                        "max_quantity": int(parts[1])
-                    })
-    return pd.DataFrame(max_entries)
+# Parsers live in extraction.py / table_parser.py
 
 # ----------- 3. Extract & Display Data -----------
 if stock_file and supply_file and max_file:
@@ -0,0 +1,106 @@
+"""Line-level differences between two plans or two input snapshots.
+
+Key columns (store, article, godown) are interned into integer codes over the
+union of both sides and packed into one int64 per line. Each side is then
+reduced to sorted unique keys with summed values, and the two sorted key
+arrays are merged with ``searchsorted``. Diffing two million-line plans takes
+a few hundred milliseconds.
+"""
+import numpy as np
+import pandas as pd
+
+from plan_validation import _codes
+from snapshot import SNAPSHOT_TABLES, read_snapshot
+
+# (key columns, value column) compared for each snapshot table
+SNAPSHOT_DIFF_KEYS = {
+    "stock": (["article_number"], "quantity_available"),
+    "supply": (["store_location", "article_number"], "quantity_supplied_2024"),
+    "max": (["store_location"], "max_quantity"),
+}
+
+
+def _distinct(values):
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return pd.Index(values.cat.categories)
+    return pd.Index(values.unique())
+
+
+def _summed(keys, values):
+    """Sorted unique keys and the summed value per key."""
+    unique, inverse = np.unique(keys, return_inverse=True)
+    return unique, np.bincount(inverse, weights=values, minlength=len(unique)).astype(np.int64)
+
+
+def diff_tables(old, new, keys, value):
+    """Added, removed and changed rows between ``old`` and ``new``.
+
+    Rows are matched on ``keys`` (repeated keys are summed) and compared on
+    ``value``. Returns the key columns plus ``change``, ``old_value``,
+    ``new_value`` and ``delta``, ordered by key; unchanged rows are left out.
+    """
+    indexes = []
+    old_packed = np.zeros(len(old), dtype=np.int64)
+    new_packed = np.zeros(len(new), dtype=np.int64)
+    for column in keys:
+        index = _distinct(old[column]).append(_distinct(new[column])).unique()
+        index = index[~index.isna()]
+        old_packed = old_packed * (len(index) + 1) + _codes(old[column], index) + 1
+        new_packed = new_packed * (len(index) + 1) + _codes(new[column], index) + 1
+        indexes.append(index)
+
+    old_keys, old_values = _summed(old_packed, old[value].to_numpy())
+    new_keys, new_values = _summed(new_packed, new[value].to_numpy())
+
+    # Sorted merge: position of every old key among the new keys
+    position = np.searchsorted(new_keys, old_keys).clip(max=max(len(new_keys) - 1, 0))
+    in_new = (new_keys[position] == old_keys) if len(new_keys) else np.zeros(len(old_keys), bool)
+    in_old = np.zeros(len(new_keys), dtype=bool)
+    in_old[position[in_new]] = True
+
+    changed = in_new.copy()
+    changed[in_new] = old_values[in_new] != new_values[position[in_new]]
+    removed, added = ~in_new, ~in_old
+
+    packed = np.concatenate([old_keys[removed], new_keys[added], old_keys[changed]])
+    before = np.concatenate([old_values[removed], np.zeros(added.sum(), np.int64),
+                             old_values[changed]])
+    after = np.concatenate([np.zeros(removed.sum(), np.int64), new_values[added],
+                            new_values[position[changed]]])
+    change = np.repeat(["removed", "added", "changed"], [removed.sum(), added.sum(), changed.sum()])
+    order = np.argsort(packed, kind="stable")
+    packed = packed[order]
+
+    columns = {}
+    for column, index in reversed(list(zip(keys, indexes))):
+        packed, codes = np.divmod(packed, len(index) + 1)
+        columns[column] = pd.Categorical.from_codes(codes - 1, categories=index)
+    diff = pd.DataFrame({column: columns[column] for column in keys})
+    diff["change"] = pd.Categorical(change[order], categories=["added", "removed", "changed"])
+    diff["old_value"] = before[order]
+    diff["new_value"] = after[order]
+    diff["delta"] = diff["new_value"] - diff["old_value"]
+    return diff
+
+
+def diff_plans(old_plan, new_plan):
+    """Plan lines added, removed or re-quantified between two plans."""
+    keys = ["store_location", "article_number"]
+    if "godown" in old_plan and "godown" in new_plan:
+        keys.append("godown")
+    diff = diff_tables(old_plan, new_plan, keys, "quantity")
+    return diff.rename(columns={"old_value": "old_quantity", "new_value": "new_quantity"})
+
+
+def diff_snapshots(old_dir, new_dir):
+    """``{table: diff}`` for the stock, supply and max tables of two snapshots."""
+    old_tables = dict(zip(SNAPSHOT_TABLES, read_snapshot(old_dir)))
+    new_tables = dict(zip(SNAPSHOT_TABLES, read_snapshot(new_dir)))
+    return {name: diff_tables(old_tables[name], new_tables[name], keys, value)
+            for name, (keys, value) in SNAPSHOT_DIFF_KEYS.items()}
+
+
+def diff_summary(diff):
+    """Line counts and net delta per change type."""
+    return (diff.groupby("change", observed=False)["delta"]
+            .agg(lines="size", net_delta="sum").reset_index())
@@ -0,0 +1,182 @@
+import io
+import os
+import tempfile
+
+import pandas as pd
+
+from plan_validation import check_plan
+from store_master import load_store_aliases, resolve_store_column
+
+# Rows written per chunk. Each chunk is encoded on its own, so memory stays
+# bounded by the chunk size rather than by the size of the plan.
+EXPORT_CHUNK_ROWS = 50_000
+
+
+def iter_plan_chunks(plan, chunk_rows=EXPORT_CHUNK_ROWS):
+    for start in range(0, len(plan), chunk_rows):
+        yield plan.iloc[start:start + chunk_rows]
+
+
+def iter_plan_csv(plan, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Yield the plan as CSV text, one chunk at a time (header first)."""
+    yield ",".join(plan.columns) + "\n"
+    for chunk in iter_plan_chunks(plan, chunk_rows):
+        yield chunk.to_csv(index=False, header=False)
+
+
+def write_plan_csv(plan, path, chunk_rows=EXPORT_CHUNK_ROWS):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        for text in iter_plan_csv(plan, chunk_rows):
+            f.write(text)
+
+
+def _plan_schema(plan):
+    import pyarrow as pa
+
+    # Store and article columns are dictionary-encoded: a few hundred stores and
+    # a few thousand articles repeat across every line of the plan.
+    fields = []
+    for column in plan.columns:
+        if column in ("store_location", "article_number", "godown"):
+            fields.append(pa.field(column, pa.dictionary(pa.int32(), pa.string())))
+        elif plan[column].dtype == object:
+            fields.append(pa.field(column, pa.string()))
+        else:
+            fields.append(pa.field(column, pa.from_numpy_dtype(plan[column].dtype)))
+    return pa.schema(fields)
+
+
+def _arrow_batches(plan, schema, chunk_rows):
+    import pyarrow as pa
+
+    for chunk in iter_plan_chunks(plan, chunk_rows):
+        yield pa.RecordBatch.from_pandas(chunk, schema=schema, preserve_index=False)
+
+
+def write_plan_parquet(plan, path, chunk_rows=EXPORT_CHUNK_ROWS):
+    import pyarrow.parquet as pq
+
+    schema = _plan_schema(plan)
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        for batch in _arrow_batches(plan, schema, chunk_rows):
+            writer.write_batch(batch, row_group_size=chunk_rows)
+
+
+def write_plan_arrow(plan, path, chunk_rows=EXPORT_CHUNK_ROWS):
+    import pyarrow as pa
+
+    schema = _plan_schema(plan)
+    with pa.OSFile(str(path), "wb") as sink:
+        with pa.ipc.new_file(sink, schema) as writer:
+            for batch in _arrow_batches(plan, schema, chunk_rows):
+                writer.write_batch(batch)
+
+
+def write_plan_excel(plan, path, chunk_rows=EXPORT_CHUNK_ROWS):
+    import xlsxwriter
+
+    # constant_memory flushes each row to disk as soon as it is written
+    workbook = xlsxwriter.Workbook(str(path), {"constant_memory": True})
+    try:
+        sheet = workbook.add_worksheet("Allocation")
+        sheet.write_row(0, 0, list(plan.columns))
+        row = 1
+        for chunk in iter_plan_chunks(plan, chunk_rows):
+            for values in chunk.itertuples(index=False, name=None):
+                sheet.write_row(row, 0, [v.item() if hasattr(v, "item") else v for v in values])
+                row += 1
+    finally:
+        workbook.close()
+
+
+EXPORT_FORMATS = {
+    "csv": (write_plan_csv, "text/csv"),
+    "parquet": (write_plan_parquet, "application/vnd.apache.parquet"),
+    "arrow": (write_plan_arrow, "application/vnd.apache.arrow.file"),
+    "xlsx": (write_plan_excel, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+
+def export_plan(plan, path, fmt="csv", chunk_rows=EXPORT_CHUNK_ROWS, *, inputs):
+    """Write the plan in ``fmt``.
+
+    ``inputs`` is the ``(df_stock, df_supply, df_max)`` the plan was built
+    from; the plan is validated first and ``PlanValidationError`` is raised
+    instead of writing an invalid file. Pass ``inputs=None`` only for a plan
+    that was already checked (e.g. by a background job).
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    if inputs is not None:
+        check_plan(plan, *inputs)
+    writer, _ = EXPORT_FORMATS[fmt]
+    writer(plan, path, chunk_rows)
+
+
+def export_plan_bytes(plan, fmt="csv", chunk_rows=EXPORT_CHUNK_ROWS, *, inputs):
+    """Encode the plan into an in-memory file for ``st.download_button``; see ``export_plan``."""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    if inputs is not None:
+        check_plan(plan, *inputs)
+    if fmt == "csv":
+        buffer = io.BytesIO()
+        for text in iter_plan_csv(plan, chunk_rows):
+            buffer.write(text.encode("utf-8"))
+        return buffer.getvalue()
+
+    # pyarrow and xlsxwriter stream to a file; hand back its bytes afterwards
+    fd, tmp_path = tempfile.mkstemp(suffix=f".{fmt}")
+    os.close(fd)
+    try:
+        # Checked above
+        export_plan(plan, tmp_path, fmt, chunk_rows, inputs=None)
+        with open(tmp_path, "rb") as f:
+            return f.read()
+    finally:
+        os.remove(tmp_path)
+
+
+def plan_from_records(records, stores=None, aliases=None):
+    """Normalise a list of ``{"store", "article", "quantity"}`` dicts (agent output).
+
+    With ``stores`` (the dataset's store keys), store names are resolved onto
+    them like the reports' names (``aliases`` defaults to the alias file), and
+    the ``StoreMatches`` to review are kept in ``plan.attrs["store_matches"]``.
+    """
+    df = pd.DataFrame(records).rename(columns={
+        "store": "store_location",
+        "location": "store_location",
+        "article": "article_number",
+    })
+    for column in ("store_location", "article_number"):
+        if column in df:
+            df[column] = df[column].astype("category")
+    if stores is not None and "store_location" in df:
+        aliases = load_store_aliases() if aliases is None else aliases
+        df["store_location"], df.attrs["store_matches"] = resolve_store_column(
+            df["store_location"], list(stores), aliases)
+    if "quantity" in df:
+        df["quantity"] = pd.to_numeric(df["quantity"], errors="coerce").fillna(0).astype("int32")
+    return df
+
+
+def read_plan(file, fmt="csv", stores=None):
+    """Read a plan written by ``export_plan`` back into a DataFrame.
+
+    ``stores`` resolves its store names as in ``plan_from_records``.
+    """
+    if fmt == "csv":
+        plan = pd.read_csv(file, dtype={"store_location": "category", "article_number": "category",
+                                        "godown": "category"})
+    elif fmt == "parquet":
+        plan = pd.read_parquet(file)
+    elif fmt == "arrow":
+        import pyarrow as pa
+
+        plan = pa.ipc.open_file(file).read_pandas()
+    elif fmt == "xlsx":
+        plan = pd.read_excel(file, sheet_name="Allocation", dtype={"article_number": str})
+    else:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    return plan_from_records(plan, stores)
@@ -0,0 +1,168 @@
+"""Vectorized constraint checks for an allocation plan.
+
+A plan is any DataFrame with ``store_location``, ``article_number`` and
+``quantity`` columns. Stores and articles are mapped to integer codes once,
+then every rule is a ``bincount`` or a packed-pair lookup over those codes, so a
+million-line plan is checked in a fraction of a second.
+"""
+import numpy as np
+import pandas as pd
+
+VIOLATION_COLUMNS = ["rule", "store_location", "article_number", "value", "limit"]
+
+# Largest store x article space checked with a dense bitmap (one byte per pair)
+PAIR_BITMAP_LIMIT = 1 << 26
+
+
+class PlanValidationError(ValueError):
+    def __init__(self, violations):
+        self.violations = violations
+        rules = violations["rule"].value_counts().to_dict()
+        summary = ", ".join(f"{count} {rule}" for rule, count in rules.items())
+        super().__init__(f"Allocation plan failed validation: {summary}")
+
+
+def _codes(values, index):
+    """Positions of ``values`` in ``index`` (-1 when missing)."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # Look up each distinct category once, then broadcast through the codes
+        category_codes = index.get_indexer(values.cat.categories)
+        codes = values.cat.codes.to_numpy()
+        return np.where(codes >= 0, category_codes[codes], -1)
+    return index.get_indexer(values)
+
+
+def _violations(rule, stores, articles, value, limit):
+    return pd.DataFrame({
+        "rule": rule,
+        "store_location": stores,
+        "article_number": articles,
+        "value": value,
+        "limit": limit,
+    }, columns=VIOLATION_COLUMNS)
+
+
+def _godown_violations(plan, df_stock):
+    ledger = (df_stock.groupby(["godown", "article_number"], sort=False)
+              ["quantity_available"].sum())
+    lines = ledger.index.get_indexer(
+        pd.MultiIndex.from_arrays([plan["godown"].astype(str), plan["article_number"].astype(str)]))
+    quantity = plan["quantity"].to_numpy()
+    found = []
+
+    unknown = lines < 0
+    if unknown.any():
+        rows = plan[unknown]
+        found.append(_violations("unknown_godown_article", rows["store_location"].to_numpy(),
+                                 rows["article_number"].to_numpy(), rows["quantity"].to_numpy(), 0))
+
+    allocated = np.bincount(lines[~unknown], weights=quantity[~unknown],
+                            minlength=len(ledger)).astype(np.int64)
+    limit = ledger.to_numpy()
+    over = np.flatnonzero(allocated > limit)
+    if len(over):
+        found.append(_violations(
+            "godown_over_stock", None,
+            [f"{godown}/{article}" for godown, article in ledger.index[over]],
+            allocated[over], limit[over]))
+    return found
+
+
+def validate_plan(plan, df_stock, df_supply, df_max):
+    """Return one row per violated constraint (an empty frame when the plan is valid).
+
+    When ``df_stock`` carries a ``godown`` column (see
+    ``multi_godown.combine_godown_stock``), article totals are checked against
+    the sum over godowns, and plans with a ``godown`` column are also checked
+    against each godown's own ledger.
+    """
+    if "godown" in df_stock:
+        stock = (df_stock.groupby("article_number", as_index=False, sort=False)
+                 ["quantity_available"].sum())
+    else:
+        stock = df_stock.drop_duplicates("article_number", keep="last")
+    capacity = df_max.drop_duplicates("store_location", keep="last")
+    article_index = pd.Index(stock["article_number"])
+    store_index = pd.Index(capacity["store_location"])
+    stock_qty = stock["quantity_available"].to_numpy()
+    store_max = capacity["max_quantity"].to_numpy()
+
+    article_codes = _codes(plan["article_number"], article_index)
+    store_codes = _codes(plan["store_location"], store_index)
+    quantity = plan["quantity"].to_numpy()
+    found = []
+
+    unknown_article = article_codes < 0
+    if unknown_article.any():
+        rows = plan[unknown_article]
+        found.append(_violations("unknown_article", rows["store_location"].to_numpy(),
+                                 rows["article_number"].to_numpy(), rows["quantity"].to_numpy(), 0))
+
+    unknown_store = store_codes < 0
+    if unknown_store.any():
+        rows = plan[unknown_store]
+        found.append(_violations("unknown_store", rows["store_location"].to_numpy(),
+                                 rows["article_number"].to_numpy(), rows["quantity"].to_numpy(), 0))
+
+    non_positive = quantity <= 0
+    if non_positive.any():
+        rows = plan[non_positive]
+        found.append(_violations("non_positive_quantity", rows["store_location"].to_numpy(),
+                                 rows["article_number"].to_numpy(), rows["quantity"].to_numpy(), 1))
+
+    # Summed allocation per article must fit the godown stock
+    known = ~unknown_article
+    allocated = np.bincount(article_codes[known], weights=quantity[known],
+                            minlength=len(article_index)).astype(np.int64)
+    over = np.flatnonzero(allocated > stock_qty)
+    if len(over):
+        found.append(_violations("article_over_stock", None, article_index[over].to_numpy(),
+                                 allocated[over], stock_qty[over]))
+
+    if "godown" in df_stock and "godown" in plan:
+        found.extend(_godown_violations(plan, df_stock))
+
+    # Summed allocation per store must fit the store's max quantity
+    known = ~unknown_store
+    allocated = np.bincount(store_codes[known], weights=quantity[known],
+                            minlength=len(store_index)).astype(np.int64)
+    over = np.flatnonzero(allocated > store_max)
+    if len(over):
+        found.append(_violations("store_over_capacity", store_index[over].to_numpy(), None,
+                                 allocated[over], store_max[over]))
+
+    # No (store, article) pair may repeat a 2024 supply line
+    supply_articles = _codes(df_supply["article_number"], article_index)
+    supply_stores = _codes(df_supply["store_location"], store_index)
+    in_range = (supply_articles >= 0) & (supply_stores >= 0)
+    # Pairs are packed into one int64: a bitmap lookup when the store x article
+    # space is small enough, otherwise a binary search over the sorted 2024 pairs
+    pair_space = len(store_index) * len(article_index)
+    supplied_pairs = supply_stores[in_range].astype(np.int64) * len(article_index) + supply_articles[in_range]
+    plan_pairs = store_codes.astype(np.int64) * len(article_index) + article_codes
+    repeated = ~unknown_article & ~unknown_store
+    if pair_space <= PAIR_BITMAP_LIMIT:
+        supplied = np.zeros(pair_space, dtype=bool)
+        supplied[supplied_pairs] = True
+        repeated &= supplied[np.where(repeated, plan_pairs, 0)]
+    elif len(supplied_pairs):
+        supplied_pairs = np.sort(supplied_pairs)
+        positions = np.searchsorted(supplied_pairs, plan_pairs).clip(max=len(supplied_pairs) - 1)
+        repeated &= supplied_pairs[positions] == plan_pairs
+    else:
+        repeated[:] = False
+    if repeated.any():
+        rows = plan[repeated]
+        found.append(_violations("repeat_from_2024", rows["store_location"].to_numpy(),
+                                 rows["article_number"].to_numpy(), rows["quantity"].to_numpy(), 0))
+
+    if not found:
+        return pd.DataFrame(columns=VIOLATION_COLUMNS)
+    return pd.concat(found, ignore_index=True)
+
+
+def check_plan(plan, df_stock, df_supply, df_max):
+    """Raise ``PlanValidationError`` if the plan breaks any constraint."""
+    violations = validate_plan(plan, df_stock, df_supply, df_max)
+    if len(violations):
+        raise PlanValidationError(violations)
@@ -0,0 +1,155 @@
+"""What-if scenarios run side by side in a process pool.
+
+Each scenario is a set of overrides on one base dataset: scale some stores'
+capacity, exclude article prefixes, drop the 2024 rule for some stores, or
+apply family rules (see ``article_families.py``).
+Workers memory-map the base snapshot (see ``snapshot.py``) once when they
+start, so the base tables are shared through the page cache rather than
+pickled to every task.
+
+Usage (CLI)::
+
+    python scenarios.py snapshots/<key> scenarios.json
+
+where ``scenarios.json`` is a list of objects with the ``Scenario`` fields.
+"""
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Mapping
+
+import pandas as pd
+
+from allocation import build_network_plan, build_fair_share_plan
+from article_families import ArticleFamilies, FamilyConstraints, FamilyRule
+from demand_scoring import compute_demand_scores
+from extraction import build_logic_inputs
+from snapshot import read_snapshot
+
+BASE_SCENARIO = "Base"
+
+
+@dataclass(frozen=True)
+class Scenario:
+    name: str
+    # {store: multiplier}, e.g. {"MOGA": 1.1} for "capacity +10% at MOGA"
+    capacity_factors: Mapping[str, float] = field(default_factory=dict)
+    exclude_article_prefixes: tuple = ()
+    # Stores that may receive articles they were already sent in 2024
+    ignore_2024_for: tuple = ()
+    fair_share: bool = False
+    rank_by_demand: bool = False
+    # article_families.FamilyRule exclusions and per-family caps
+    family_rules: tuple = ()
+
+
+_worker_inputs = None
+
+
+def _init_worker(snapshot_dir):
+    global _worker_inputs
+    df_stock, df_supply, df_max = read_snapshot(snapshot_dir)
+    store_capacities, godown_stock, articles_sent_in_2024 = build_logic_inputs(
+        df_stock, df_supply, df_max)
+    _worker_inputs = (store_capacities, godown_stock, articles_sent_in_2024,
+                      compute_demand_scores(df_supply), ArticleFamilies(godown_stock))
+
+
+def _run_scenario(scenario):
+    (store_capacities, godown_stock, articles_sent_in_2024, demand_scores,
+     article_families) = _worker_inputs
+    # Excluded articles stay in the godown, so leftover counts the full base stock
+    stock = sum(godown_stock.values())
+
+    if scenario.capacity_factors:
+        store_capacities = {
+            store: int(round(capacity * scenario.capacity_factors.get(store, 1.0)))
+            for store, capacity in store_capacities.items()}
+    if scenario.exclude_article_prefixes:
+        prefixes = tuple(scenario.exclude_article_prefixes)
+        godown_stock = {article: qty for article, qty in godown_stock.items()
+                        if not article.startswith(prefixes)}
+    if scenario.ignore_2024_for:
+        articles_sent_in_2024 = {store: sent for store, sent in articles_sent_in_2024.items()
+                                 if store not in scenario.ignore_2024_for}
+
+    # Compiled against the base articles; excluded ones are never offered anyway
+    family_constraints = (FamilyConstraints(article_families, list(scenario.family_rules))
+                          if scenario.family_rules else None)
+
+    build_plan = build_fair_share_plan if scenario.fair_share else build_network_plan
+    plan = build_plan(store_capacities, godown_stock, articles_sent_in_2024,
+                      demand_scores=demand_scores if scenario.rank_by_demand else None,
+                      family_constraints=family_constraints)
+
+    per_store = plan.groupby("store_location", observed=False)["quantity"].sum()
+    allocated = int(per_store.sum())
+    capacity = sum(store_capacities.values())
+    summary = {
+        "scenario": scenario.name,
+        "allocated": allocated,
+        "capacity": capacity,
+        "fill_rate": round(allocated / capacity * 100, 1) if capacity else 0.0,
+        "leftover_stock": stock - allocated,
+        "plan_lines": len(plan),
+    }
+    return summary, per_store.rename(scenario.name)
+
+
+def run_scenarios(snapshot_dir, scenarios, max_workers=None, family_rules=()):
+    """Run the base plan and every scenario in parallel.
+
+    ``family_rules`` apply to the base plan; give scenarios the same rules
+    to compare like with like. Returns ``(summary, store_deltas)``: one row per scenario with fill rate
+    and leftover stock, and one column per scenario with each store's change
+    in allocated pieces against the base plan.
+    """
+    scenarios = [Scenario(BASE_SCENARIO, family_rules=tuple(family_rules))] + list(scenarios)
+    max_workers = max_workers or min(len(scenarios), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                             initargs=(snapshot_dir,)) as pool:
+        results = list(pool.map(_run_scenario, scenarios))
+
+    summary = pd.DataFrame([row for row, _ in results])
+    per_store = pd.concat([allocated for _, allocated in results], axis=1).fillna(0).astype(int)
+    base = per_store[BASE_SCENARIO]
+    store_deltas = per_store.drop(columns=BASE_SCENARIO).sub(base, axis=0)
+    store_deltas.insert(0, BASE_SCENARIO, base)
+    store_deltas.index.name = "store_location"
+    summary["fill_rate_delta"] = summary["fill_rate"] - summary.loc[0, "fill_rate"]
+    return summary, store_deltas
+
+
+def scenario_from_dict(data):
+    return Scenario(
+        name=data["name"],
+        capacity_factors=dict(data.get("capacity_factors", {})),
+        exclude_article_prefixes=tuple(data.get("exclude_article_prefixes", ())),
+        ignore_2024_for=tuple(data.get("ignore_2024_for", ())),
+        fair_share=bool(data.get("fair_share", False)),
+        rank_by_demand=bool(data.get("rank_by_demand", False)),
+        family_rules=tuple(
+            FamilyRule(prefix=rule.get("prefix", ""), max_per_store=rule.get("max_per_store"),
+                       exclude_stores=tuple(rule.get("exclude_stores", ())))
+            for rule in data.get("family_rules", ())),
+    )
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        print(__doc__)
+        return 2
+    with open(argv[1], encoding="utf-8") as f:
+        scenarios = [scenario_from_dict(item) for item in json.load(f)]
+    summary, store_deltas = run_scenarios(argv[0], scenarios)
+    print(summary.to_string(index=False))
+    print()
+    print(store_deltas.to_string())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,321 @@
+"""Local HTTP service for ingestion, allocation, validation and export.
+
+Run on localhost with::
+
+    uvicorn service:app --port 8000
+
+Endpoints are async. PDF parsing and plan building run on a thread pool
+(``SERVICE_WORKERS`` threads), so the event loop keeps accepting requests
+while plans are solved. Datasets stay warm between requests in the
+process-wide registry (see ``dataset_registry.py``), and one uploaded or
+snapshotted dataset is addressed by its content key. ``GET /metrics``
+reports request latency percentiles per endpoint.
+"""
+import asyncio
+import io
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+import numpy as np
+from fastapi import FastAPI, File, HTTPException, Request, UploadFile
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel
+
+from allocation import build_network_plan, build_fair_share_plan
+from article_families import FamilyConstraints, FamilyRule
+from dataset_registry import (get_registry, is_current_dataset, load_pdf_dataset,
+                              load_snapshot_dataset)
+from plan_export import EXPORT_FORMATS, export_plan_bytes, plan_from_records
+from plan_validation import PlanValidationError, validate_plan
+from snapshot import dataset_key, is_current_snapshot, list_snapshots, snapshot_path
+
+SERVICE_WORKERS = int(os.getenv("SERVICE_WORKERS", str(min(8, os.cpu_count() or 1))))
+
+# Requests kept per endpoint for the latency percentiles
+LATENCY_WINDOW = 2048
+
+
+class LatencyTracker:
+    """Rolling per-endpoint request latencies."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._lock = threading.Lock()
+        self._window = window
+        self._samples = {}
+        self._counts = {}
+
+    def record(self, endpoint, seconds):
+        with self._lock:
+            samples = self._samples.get(endpoint)
+            if samples is None:
+                samples = self._samples[endpoint] = deque(maxlen=self._window)
+            samples.append(seconds)
+            self._counts[endpoint] = self._counts.get(endpoint, 0) + 1
+
+    def summary(self):
+        with self._lock:
+            samples = {endpoint: np.array(values) for endpoint, values in self._samples.items()}
+            counts = dict(self._counts)
+        return {
+            endpoint: {
+                "requests": counts[endpoint],
+                "p50_ms": round(float(np.percentile(values, 50)) * 1000, 2),
+                "p95_ms": round(float(np.percentile(values, 95)) * 1000, 2),
+                "p99_ms": round(float(np.percentile(values, 99)) * 1000, 2),
+                "max_ms": round(float(values.max()) * 1000, 2),
+            }
+            for endpoint, values in samples.items()
+        }
+
+
+latency = LatencyTracker()
+# Datasets this service keeps pinned in the registry, by key
+_handles = {}
+_handles_lock = threading.Lock()
+_executor = None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global _executor
+    _executor = ThreadPoolExecutor(max_workers=SERVICE_WORKERS, thread_name_prefix="allocation")
+    try:
+        yield
+    finally:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        with _handles_lock:
+            for handle in _handles.values():
+                handle.release()
+            _handles.clear()
+
+
+app = FastAPI(title="Article Allocation Service", lifespan=lifespan)
+
+
+@app.middleware("http")
+async def track_latency(request: Request, call_next):
+    start = time.perf_counter()
+    try:
+        return await call_next(request)
+    finally:
+        route = request.scope.get("route")
+        endpoint = f"{request.method} {route.path}" if route else "unmatched"
+        latency.record(endpoint, time.perf_counter() - start)
+
+
+@app.exception_handler(PlanValidationError)
+async def plan_validation_error(request: Request, exc: PlanValidationError):
+    return JSONResponse(status_code=422, content={
+        "detail": str(exc), "violations": _records(exc.violations)})
+
+
+async def run_in_pool(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+
+
+def _records(df):
+    # Through JSON so NumPy scalars and NaN come out as plain JSON values
+    return json.loads(df.to_json(orient="records"))
+
+
+def _pin(key, loader):
+    with _handles_lock:
+        handle = _handles.get(key)
+        if handle is not None and not is_current_dataset(handle.dataset):
+            # Store names resolved with an older alias table: load it again
+            del _handles[key]
+            handle.release()
+            handle = None
+    if handle is None:
+        handle = get_registry().acquire(key, loader)
+        with _handles_lock:
+            if key in _handles:
+                handle.release()
+                handle = _handles[key]
+            else:
+                _handles[key] = handle
+    return handle.dataset
+
+
+def _dataset(key):
+    """The warm dataset for ``key``, mapped from its snapshot on first use."""
+    with _handles_lock:
+        loaded = key in _handles
+    if not loaded and not is_current_snapshot(snapshot_path(key)):
+        raise HTTPException(status_code=404, detail=f"Unknown dataset {key}")
+    return _pin(key, lambda: load_snapshot_dataset(key))
+
+
+def _describe(dataset):
+    return {
+        "key": dataset.key,
+        "stores": len(dataset.store_capacities),
+        "articles": len(dataset.godown_stock),
+        "supply_lines": len(dataset.df_supply),
+        "total_capacity": int(sum(dataset.store_capacities.values())),
+        "total_stock": int(sum(dataset.godown_stock.values())),
+    }
+
+
+class FamilyRuleModel(BaseModel):
+    # Article code prefix ("" for every article); see article_families.FamilyRule
+    prefix: str = ""
+    max_per_store: Optional[int] = None
+    # Store names, or "*" for every store
+    exclude_stores: List[str] = []
+
+
+class PlanRequest(BaseModel):
+    # "network" (stores in order) or "fair_share"
+    mode: str = "network"
+    # "stock" or "demand"
+    rank_by: str = "stock"
+    # Family exclusions and per-family caps, as in the app's family rules
+    family_rules: List[FamilyRuleModel] = []
+    # Return the plan as a file in this export format instead of JSON
+    format: Optional[str] = None
+
+
+class PlanLine(BaseModel):
+    store: str
+    article: str
+    quantity: int
+    godown: Optional[str] = None
+
+
+class PlanLines(BaseModel):
+    lines: List[PlanLine]
+    format: str = "csv"
+
+
+def _plan_lines(body, dataset):
+    # Store names resolved onto the dataset's store keys, as in the reports
+    if not body.lines:
+        raise HTTPException(status_code=400, detail="No plan lines")
+    return plan_from_records([line.model_dump(exclude_none=True) for line in body.lines],
+                             stores=dataset.store_capacities)
+
+
+def _build_plan(dataset, request):
+    if request.mode not in ("network", "fair_share"):
+        raise HTTPException(status_code=400, detail=f"Unknown mode {request.mode}")
+    if request.rank_by not in ("stock", "demand"):
+        raise HTTPException(status_code=400, detail=f"Unknown rank_by {request.rank_by}")
+    rules = [FamilyRule(prefix=rule.prefix, max_per_store=rule.max_per_store,
+                        exclude_stores=tuple(rule.exclude_stores))
+             for rule in request.family_rules]
+    build_plan = build_fair_share_plan if request.mode == "fair_share" else build_network_plan
+    return build_plan(
+        dataset.store_capacities, dataset.godown_stock, dataset.articles_sent_in_2024,
+        demand_scores=dataset.demand_scores if request.rank_by == "demand" else None,
+        family_constraints=FamilyConstraints(dataset.article_families, rules) if rules else None)
+
+
+def _inputs(dataset):
+    return dataset.df_stock, dataset.df_supply, dataset.df_max
+
+
+def _export_response(plan, fmt, dataset):
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported export format: {fmt}")
+    data = export_plan_bytes(plan, fmt, inputs=_inputs(dataset))
+    return Response(content=data, media_type=EXPORT_FORMATS[fmt][1], headers={
+        "Content-Disposition": f'attachment; filename="network_allocation.{fmt}"'})
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok", "workers": SERVICE_WORKERS}
+
+
+@app.get("/metrics")
+async def metrics():
+    return {"latency": latency.summary(), "registry": get_registry().stats()}
+
+
+@app.get("/datasets")
+async def list_datasets():
+    with _handles_lock:
+        loaded = list(_handles)
+    return {"loaded": loaded, "snapshots": [key for key, _ in list_snapshots()]}
+
+
+@app.post("/datasets")
+async def ingest(stock: UploadFile = File(...), supply: UploadFile = File(...),
+                 max_pcs: UploadFile = File(...)):
+    """Parse the three report PDFs (or reuse their snapshot) and keep the dataset warm."""
+    sources = [await upload.read() for upload in (stock, supply, max_pcs)]
+    key = dataset_key(*sources)
+
+    def load():
+        return _pin(key, lambda: load_pdf_dataset(key, *(io.BytesIO(data) for data in sources)))
+
+    try:
+        dataset = await run_in_pool(load)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return _describe(dataset)
+
+
+@app.get("/datasets/{key}")
+async def describe_dataset(key: str):
+    return _describe(await run_in_pool(_dataset, key))
+
+
+@app.delete("/datasets/{key}")
+async def release_dataset(key: str):
+    with _handles_lock:
+        handle = _handles.pop(key, None)
+    if handle is None:
+        raise HTTPException(status_code=404, detail=f"Dataset {key} is not loaded")
+    handle.release()
+    return {"released": key}
+
+
+@app.post("/datasets/{key}/plan")
+async def plan(key: str, request: PlanRequest):
+    """Build a validated network plan; JSON lines, or a file when ``format`` is set."""
+    def solve():
+        dataset = _dataset(key)
+        network_plan = _build_plan(dataset, request)
+        if request.format is not None:
+            return _export_response(network_plan, request.format, dataset)
+        violations = validate_plan(network_plan, *_inputs(dataset))
+        if len(violations):
+            raise PlanValidationError(violations)
+        return {
+            "key": key,
+            "total_allocated": int(network_plan["quantity"].sum()),
+            "lines": _records(network_plan),
+        }
+
+    return await run_in_pool(solve)
+
+
+@app.post("/datasets/{key}/validate")
+async def validate(key: str, body: PlanLines):
+    """Check externally built plan lines against the dataset's constraints."""
+    def check():
+        dataset = _dataset(key)
+        plan = _plan_lines(body, dataset)
+        violations = validate_plan(plan, *_inputs(dataset))
+        return {"valid": not len(violations), "violations": _records(violations),
+                "store_matches": plan.attrs["store_matches"].to_dict()}
+
+    return await run_in_pool(check)
+
+
+@app.post("/datasets/{key}/export")
+async def export(key: str, body: PlanLines):
+    """Validate plan lines and return them as a file in ``format``."""
+    def encode():
+        dataset = _dataset(key)
+        return _export_response(_plan_lines(body, dataset), body.format, dataset)
+
+    return await run_in_pool(encode)
@@ -0,0 +1,204 @@
+"""Columnar snapshots of the parsed stock, supply and max tables.
+
+A snapshot is a directory holding one Arrow IPC file per table plus a
+``manifest.json``. Arrow IPC files can be memory-mapped, so every session,
+the CLI and the agent reading the same snapshot share one copy of the data
+through the OS page cache instead of each holding their own.
+
+Store names are kept as the reports print them and resolved onto canonical
+store keys on every read (see ``store_master.py``), so a corrected alias
+table applies to existing snapshots without parsing the PDFs again.
+
+Usage (CLI)::
+
+    python snapshot.py build 5_Jacket_Stock.pdf 5_Jacket_Supply_24.pdf 5_Max_Pcs.pdf
+    python snapshot.py show snapshots/<key>
+"""
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+from store_master import load_store_aliases, resolve_store_names
+
+SNAPSHOT_ROOT = "snapshots"
+SNAPSHOT_FORMAT = "article-allocation-snapshot"
+# 2: store names resolved onto canonical keys, with the store matches in the manifest
+# 3: store names as printed, resolved on read
+SNAPSHOT_VERSION = 3
+MANIFEST_NAME = "manifest.json"
+
+SNAPSHOT_TABLES = ("stock", "supply", "max")
+
+
+def dataset_key(*sources):
+    """Content hash of the uploaded report files (bytes or file-like objects)."""
+    digest = hashlib.sha256()
+    for source in sources:
+        if hasattr(source, "getvalue"):
+            data = source.getvalue()
+        elif hasattr(source, "read"):
+            position = source.tell()
+            data = source.read()
+            source.seek(position)
+        else:
+            data = source
+        digest.update(hashlib.sha256(data).digest())
+    return digest.hexdigest()[:16]
+
+
+def write_snapshot(directory, df_stock, df_supply, df_max, source_key=None):
+    """Write the tables, as parsed (store names unresolved), as a snapshot."""
+    import pyarrow as pa
+
+    frames = {"stock": df_stock, "supply": df_supply, "max": df_max}
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "version": SNAPSHOT_VERSION,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "source_key": source_key,
+        "tables": {},
+    }
+
+    # Write into a temporary sibling directory and swap it in, so a reader
+    # never maps a half-written snapshot.
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=parent, prefix=".snapshot-")
+    try:
+        for name, df in frames.items():
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            file_name = f"{name}.arrow"
+            with pa.OSFile(os.path.join(staging, file_name), "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            manifest["tables"][name] = {
+                "file": file_name,
+                "rows": table.num_rows,
+                "columns": {field.name: str(field.type) for field in table.schema},
+            }
+        with open(os.path.join(staging, MANIFEST_NAME), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+        os.replace(staging, directory)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return manifest
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST_NAME), encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        raise ValueError(f"{directory} is not an allocation snapshot")
+    version = manifest.get("version", 0)
+    if version > SNAPSHOT_VERSION:
+        raise ValueError(
+            f"Snapshot version {version} is newer than supported ({SNAPSHOT_VERSION})")
+    if version < SNAPSHOT_VERSION:
+        raise ValueError(
+            f"Snapshot version {version} is outdated ({SNAPSHOT_VERSION}); rebuild it from the PDFs")
+    return manifest
+
+
+def is_current_snapshot(directory):
+    """Whether ``directory`` holds a snapshot this version reads; outdated ones are rebuilt."""
+    try:
+        read_manifest(directory)
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+def map_snapshot(directory):
+    """Memory-map every table of a snapshot as a zero-copy ``pyarrow.Table``."""
+    import pyarrow as pa
+
+    manifest = read_manifest(directory)
+    tables = {}
+    for name in SNAPSHOT_TABLES:
+        source = pa.memory_map(os.path.join(directory, manifest["tables"][name]["file"]), "r")
+        tables[name] = pa.ipc.open_file(source).read_all()
+    return tables
+
+
+def resolve_snapshot(directory, aliases=None):
+    """Load a snapshot as ``(df_stock, df_supply, df_max, store_matches)``.
+
+    Store names are resolved with ``aliases`` (the current alias table by
+    default); ``store_matches`` is the ``store_master.StoreMatches`` to review.
+    """
+    tables = map_snapshot(directory)
+    df_stock, df_supply, df_max = (tables[name].to_pandas() for name in SNAPSHOT_TABLES)
+    df_supply, df_max, store_matches = resolve_store_names(
+        df_supply, df_max, load_store_aliases() if aliases is None else aliases)
+    return df_stock, df_supply, df_max, store_matches
+
+
+def read_snapshot(directory, aliases=None):
+    """Load a snapshot as the ``(df_stock, df_supply, df_max)`` DataFrames, store names resolved."""
+    return resolve_snapshot(directory, aliases)[:3]
+
+
+def list_snapshots(root=SNAPSHOT_ROOT):
+    """Return ``(key, manifest)`` pairs under ``root``, newest first."""
+    if not os.path.isdir(root):
+        return []
+    snapshots = []
+    for key in os.listdir(root):
+        path = os.path.join(root, key)
+        if key.startswith(".") or not os.path.isfile(os.path.join(path, MANIFEST_NAME)):
+            continue
+        try:
+            snapshots.append((key, read_manifest(path)))
+        except ValueError:
+            continue
+    snapshots.sort(key=lambda item: item[1]["created_at"], reverse=True)
+    return snapshots
+
+
+def snapshot_path(key, root=SNAPSHOT_ROOT):
+    return os.path.join(root, key)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) == 4 and argv[0] == "build":
+        from dataset_registry import parse_pdf_reports
+
+        sources = []
+        for path in argv[1:]:
+            with open(path, "rb") as f:
+                sources.append(f.read())
+        key = dataset_key(*sources)
+        # Same parsing and store-name resolution as the app and the service
+        manifest = write_snapshot(snapshot_path(key), *parse_pdf_reports(*argv[1:]),
+                                  source_key=key)
+        matches = resolve_snapshot(snapshot_path(key))[3]
+        print(f"✅ Snapshot written to {snapshot_path(key)}")
+        for name, info in manifest["tables"].items():
+            print(f"  {name}: {info['rows']} rows")
+        for name, (store, score) in matches.fuzzy.items():
+            print(f"  ⚠️ {name!r} matched to {store!r} by similarity ({score:.2f}); confirm it")
+        if matches.unresolved:
+            print(f"  ⚠️ Supply report stores with no max quantity: {', '.join(matches.unresolved)}")
+        return 0
+    if len(argv) == 2 and argv[0] == "show":
+        manifest = read_manifest(argv[1])
+        print(json.dumps(manifest, indent=2))
+        for name, table in map_snapshot(argv[1]).items():
+            print(f"\n{name}:")
+            print(table.slice(0, 5).to_pandas())
+        return 0
+    print(__doc__)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
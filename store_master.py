@@ -0,0 +1,164 @@
+"""Store master: one canonical key per store, however the reports spell it.
+
+The max-pcs report is the store list of record. Its names are normalized
+(upper case, punctuation dropped, blanks collapsed) into the canonical store
+keys, and every other store name (supply report, cluster and preference
+tables) is resolved onto those keys:
+
+1. exact match of the normalized name against the keys and the alias table,
+2. otherwise the closest key by trigram similarity, found through an
+   inverted trigram index, so only stores sharing a trigram with the name
+   are scored instead of every store.
+
+Each distinct raw name is resolved once and memoized. Fuzzy matches are
+reported with their score next to the names that matched nothing, so an
+operator can confirm them (or correct them in the alias table).
+"""
+import hashlib
+import os
+import re
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Mapping
+
+import numpy as np
+import pandas as pd
+
+# Minimum trigram (Dice) similarity for a fuzzy match
+FUZZY_MATCH_THRESHOLD = 0.7
+
+# Optional alias table: CSV with ``alias, store_location`` columns
+STORE_ALIASES_FILE = os.getenv("STORE_ALIASES_FILE", "store_aliases.csv")
+
+_DROPPED = re.compile(r"[.']")
+_SEPARATORS = re.compile(r"[^0-9A-Z&]+")
+
+
+def normalize_store_name(name):
+    """``"Duke R.O."`` -> ``"DUKE RO"``."""
+    name = _DROPPED.sub("", str(name).upper())
+    return _SEPARATORS.sub(" ", name).strip()
+
+
+@dataclass(frozen=True)
+class StoreMatches:
+    """How a supply report's store names were resolved, for an operator to review."""
+    # Raw names that match no store of the max report
+    unresolved: tuple = ()
+    # Raw name -> (store key, trigram similarity) for names matched only approximately
+    fuzzy: Mapping[str, tuple] = field(default_factory=dict)
+    # Content hash of the alias table the names were resolved with
+    aliases_key: str = ""
+
+    def to_dict(self):
+        return {"unresolved": list(self.unresolved),
+                "fuzzy": {name: list(match) for name, match in self.fuzzy.items()},
+                "aliases_key": self.aliases_key}
+
+
+def _trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class StoreMaster:
+    def __init__(self, stores, aliases=None):
+        self.stores = list(dict.fromkeys(normalize_store_name(store) for store in stores))
+        self._lookup = {store: store for store in self.stores}
+        for alias, store in (aliases or {}).items():
+            store = normalize_store_name(store)
+            if store not in self._lookup:
+                self.stores.append(store)
+                self._lookup[store] = store
+            self._lookup[normalize_store_name(alias)] = store
+
+        # Normalized name -> similarity, for names resolved by trigram similarity
+        self.fuzzy_scores = {}
+        self._grams = [_trigrams(store) for store in self.stores]
+        self._index = defaultdict(list)
+        for position, grams in enumerate(self._grams):
+            for gram in grams:
+                self._index[gram].append(position)
+
+    def resolve(self, raw, threshold=FUZZY_MATCH_THRESHOLD):
+        """Canonical key for ``raw``, or ``None`` when nothing is close enough."""
+        key = normalize_store_name(raw)
+        if key in self._lookup:
+            return self._lookup[key]
+
+        grams = _trigrams(key)
+        shared = Counter(position for gram in grams for position in self._index.get(gram, ()))
+        best, best_score = None, threshold
+        for position, count in sorted(shared.items()):
+            score = 2 * count / (len(grams) + len(self._grams[position]))
+            if score > best_score or (best is None and score == best_score):
+                best, best_score = self.stores[position], score
+        self._lookup[key] = best
+        if best is not None:
+            self.fuzzy_scores[key] = best_score
+        return best
+
+    def resolve_many(self, names):
+        """``{raw name: canonical key or None}`` for the distinct names given."""
+        return {name: self.resolve(name) for name in pd.unique(np.asarray(names, dtype=object))}
+
+
+def read_store_aliases(file):
+    """Read an ``alias, store_location`` CSV into a mapping."""
+    df = pd.read_csv(file)
+    return dict(zip(df["alias"], df["store_location"]))
+
+
+def load_store_aliases(path=STORE_ALIASES_FILE):
+    return read_store_aliases(path) if os.path.isfile(path) else {}
+
+
+def aliases_key(aliases):
+    """Content hash of an alias table; changes whenever an alias is added or corrected."""
+    text = "\n".join(f"{normalize_store_name(alias)}\t{normalize_store_name(store)}"
+                     for alias, store in sorted((aliases or {}).items()))
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+def _canonical_column(values, resolved):
+    names = pd.Series(values, copy=False).astype("category")
+    categories = [resolved.get(name) or normalize_store_name(name)
+                  for name in names.cat.categories]
+    return pd.Categorical(np.asarray(categories, dtype=object)[names.cat.codes.to_numpy()],
+                          categories=list(dict.fromkeys(categories)))
+
+
+def resolve_store_names(df_supply, df_max, aliases=None):
+    """Rewrite both tables' ``store_location`` onto canonical store keys.
+
+    Returns ``(df_supply, df_max, matches)``. ``matches`` (``StoreMatches``)
+    lists the supply-report names that match no store in the max report
+    (kept, normalized, with no capacity) and those matched only by
+    similarity, with their scores.
+    """
+    master = StoreMaster(df_max["store_location"], aliases)
+    max_names = master.resolve_many(df_max["store_location"])
+    supply_names = master.resolve_many(df_supply["store_location"])
+
+    df_max = df_max.assign(store_location=_canonical_column(df_max["store_location"], max_names))
+    df_supply = df_supply.assign(
+        store_location=_canonical_column(df_supply["store_location"], supply_names))
+    return df_supply, df_max, _store_matches(master, supply_names, aliases)
+
+
+def resolve_store_column(values, stores, aliases=None):
+    """Resolve store names (for example the lines of a plan) onto the keys in ``stores``.
+
+    Returns ``(categorical, matches)`` as in ``resolve_store_names``.
+    """
+    master = StoreMaster(stores, aliases)
+    names = master.resolve_many(values)
+    return _canonical_column(values, names), _store_matches(master, names, aliases)
+
+
+def _store_matches(master, names, aliases):
+    unresolved = sorted(name for name, store in names.items() if store is None)
+    fuzzy = {name: (store, round(master.fuzzy_scores[normalize_store_name(name)], 2))
+             for name, store in names.items()
+             if normalize_store_name(name) in master.fuzzy_scores}
+    return StoreMatches(tuple(unresolved), fuzzy, aliases_key(aliases))
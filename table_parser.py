@@ -0,0 +1,154 @@
+"""Single-pass parser for the stock, supply and max-pcs report layouts.
+
+Each layout is one precompiled, line-anchored pattern. ``findall`` runs the
+whole page text through the regex engine in one pass and returns typed
+column tuples, so no line is split or re-scanned in Python. Store names may
+contain spaces ("DUKE RO") and article codes may carry letter prefixes or
+suffixes ("SDZ3084R", "Z9188CM").
+
+Reports with column headings are read from their word boxes instead (see
+``box_parser.py``); the text patterns remain for reports without them.
+"""
+import re
+from dataclasses import dataclass
+
+import pandas as pd
+import pdfplumber
+import logging
+logging.getLogger("pdfminer").setLevel(logging.ERROR)
+
+# Article codes always contain a digit: Z2393, SDZ3084R, Z9188CM
+_ARTICLE = r"[A-Za-z]*\d[A-Za-z0-9/-]*"
+# Store names start with a letter and may contain spaces: DUKE RO, DUKE NIT
+_STORE = r"[A-Za-z][A-Za-z0-9.&'()/ \t-]*?"
+_QTY = r"\d+"
+
+
+@dataclass(frozen=True)
+class TableLayout:
+    name: str
+    header: re.Pattern
+    line: re.Pattern
+    columns: tuple
+    dtypes: dict
+    # Pattern of each column's cell, and the first word of its heading
+    fields: tuple
+    headings: tuple
+
+
+def _line(*fields):
+    # Anchored at both ends of a line; fields separated by runs of blanks
+    body = r"[ \t]+".join(f"({field})" for field in fields)
+    return re.compile(rf"^[ \t]*{body}[ \t]*$", re.MULTILINE)
+
+
+LAYOUTS = {
+    "stock": TableLayout(
+        name="stock",
+        header=re.compile(r"^\s*Article\s+No\.?\s+Quantity\s*$", re.MULTILINE | re.IGNORECASE),
+        line=_line(_ARTICLE, _QTY),
+        columns=("article_number", "quantity_available"),
+        dtypes={"quantity_available": "int64"},
+        fields=(_ARTICLE, _QTY),
+        headings=("Article", "Quantity"),
+    ),
+    "supply": TableLayout(
+        name="supply",
+        header=re.compile(r"^\s*Location\s+Name\s+Article\s+No\.?\s+Quantity\s*$",
+                          re.MULTILINE | re.IGNORECASE),
+        line=_line(_STORE, _ARTICLE, _QTY),
+        columns=("store_location", "article_number", "quantity_supplied_2024"),
+        dtypes={"quantity_supplied_2024": "int64"},
+        fields=(_STORE, _ARTICLE, _QTY),
+        headings=("Location", "Article", "Quantity"),
+    ),
+    "max": TableLayout(
+        name="max",
+        header=re.compile(r"^\s*Location\s+Name\s+Quantity\s*$", re.MULTILINE | re.IGNORECASE),
+        line=_line(_STORE, _QTY),
+        columns=("store_location", "max_quantity"),
+        dtypes={"max_quantity": "int64"},
+        fields=(_STORE, _QTY),
+        headings=("Location", "Quantity"),
+    ),
+}
+
+_WHITESPACE_RUN = re.compile(r"\s+")
+
+
+def _detect_header(first_page_text):
+    for name, layout in LAYOUTS.items():
+        if layout.header.search(first_page_text):
+            return name
+    return None
+
+
+def detect_layout(first_page_text):
+    """Name of the report layout, judged from the first page of text."""
+    name = _detect_header(first_page_text)
+    if name is not None:
+        return name
+
+    # No recognised header: fall back to whichever pattern matches most lines.
+    # Stock lines ("Z2393 27") also satisfy the max pattern, so stock wins ties.
+    counts = {name: len(layout.line.findall(first_page_text)) for name, layout in LAYOUTS.items()}
+    if counts["supply"]:
+        return "supply"
+    if counts["stock"] or counts["max"]:
+        return "stock" if counts["stock"] >= counts["max"] else "max"
+    raise ValueError("Could not recognise the report layout from the first page")
+
+
+def parse_rows(text, layout):
+    """Raw column tuples for every table line in ``text``."""
+    return LAYOUTS[layout].line.findall(text)
+
+
+def rows_to_frame(rows, layout):
+    """Typed DataFrame from column tuples returned by ``parse_rows``."""
+    table = LAYOUTS[layout]
+    df = pd.DataFrame.from_records(rows, columns=list(table.columns))
+    if "store_location" in df:
+        # Collapse repeated blanks inside store names; only distinct names are touched
+        renames = {}
+        for name in pd.unique(df["store_location"]):
+            cleaned = _WHITESPACE_RUN.sub(" ", name)
+            if cleaned != name:
+                renames[name] = cleaned
+        if renames:
+            df["store_location"] = df["store_location"].replace(renames)
+    return df.astype(table.dtypes)
+
+
+def parse_text(text, layout):
+    """Parse report text with the given layout name into a typed DataFrame."""
+    return rows_to_frame(parse_rows(text, layout), layout)
+
+
+def check_layout(first_page_text, layout):
+    """Catch a report uploaded into the wrong slot before it parses to nothing."""
+    detected = _detect_header(first_page_text)
+    if detected is not None and detected != layout:
+        raise ValueError(f"Expected a {layout} report but the PDF looks like a {detected} report")
+
+
+def parse_pages(page_texts, layout=None):
+    """Parse a sequence of page texts; the layout is detected from the first page."""
+    page_texts = [text or "" for text in page_texts]
+    first_page = page_texts[0] if page_texts else ""
+    if layout is None:
+        layout = detect_layout(first_page)
+    else:
+        check_layout(first_page, layout)
+    return parse_text("\n".join(page_texts), layout)
+
+
+def parse_pdf(file, layout=None, progress=None):
+    """Parse a report PDF; ``progress(done, total)`` is called after each page's text."""
+    with pdfplumber.open(file) as pdf:
+        page_texts = []
+        for page in pdf.pages:
+            page_texts.append(page.extract_text())
+            if progress is not None:
+                progress(len(page_texts), len(pdf.pages))
+        return parse_pages(page_texts, layout)
@@ -1,5 +1,4 @@
 import os
-import pandas as pd
 from dotenv import load_dotenv
 from langchain.chat_models import ChatOpenAI
 from langchain.agents import initialize_agent, Tool
@@ -7,19 +6,38 @@ from langchain.agents.agent_types import AgentType
 from langchain.tools import tool
 from langchain.document_loaders import PDFPlumberLoader
 from langchain_core.output_parsers import JsonOutputParser
+from plan_export import plan_from_records, export_plan
+from plan_validation import PlanValidationError
+from snapshot import read_snapshot
+from extraction import extract_stock_data, extract_supply_data, extract_max_data
+from store_master import load_store_aliases, resolve_store_names
 
 # Load environment
 load_dotenv()
 os.environ["OPENAI_API_KEY"] = os.getenv("OPENAI_API_KEY")
 
-# --- 1. Load PDFs ---
-stock_loader = PDFPlumberLoader("5_Jacket_Stock.pdf")
-supply_loader = PDFPlumberLoader("5_Jacket_Supply_24.pdf")
-max_pcs_loader = PDFPlumberLoader("5_Max_Pcs.pdf")
+# --- 1. Load PDFs (or map a saved snapshot) ---
+snapshot_dir = os.getenv("SNAPSHOT_DIR")
 
-stock_docs = stock_loader.load()
-supply_docs = supply_loader.load()
-max_pcs_docs = max_pcs_loader.load()
+if snapshot_dir:
+    # Parsed tables written by `python snapshot.py build ...`, on canonical store keys
+    plan_inputs = read_snapshot(snapshot_dir)
+    stock_text, supply_text, max_pcs_text = (df.to_string(index=False) for df in plan_inputs)
+else:
+    stock_loader = PDFPlumberLoader("5_Jacket_Stock.pdf")
+    supply_loader = PDFPlumberLoader("5_Jacket_Supply_24.pdf")
+    max_pcs_loader = PDFPlumberLoader("5_Max_Pcs.pdf")
+
+    # Join all pages content into one string
+    stock_text = "\n".join([doc.page_content for doc in stock_loader.load()])
+    supply_text = "\n".join([doc.page_content for doc in supply_loader.load()])
+    max_pcs_text = "\n".join([doc.page_content for doc in max_pcs_loader.load()])
+
+    # Parsed tables used to validate the agent's plan, on canonical store keys
+    df_supply, df_max, _ = resolve_store_names(extract_supply_data("5_Jacket_Supply_24.pdf"),
+                                               extract_max_data("5_Max_Pcs.pdf"),
+                                               load_store_aliases())
+    plan_inputs = (extract_stock_data("5_Jacket_Stock.pdf"), df_supply, df_max)
 
 # --- 2. Tools using LangChain @tool decorator ---
 
@@ -41,18 +59,17 @@ max_pcs_docs = max_pcs_loader.load()
 @tool
 def get_stock(input_text: str) -> str:
     """Returns godown stock: article number and quantity available."""
-    # Join all pages content into one string
-    return "\n".join([doc.page_content for doc in stock_docs])
+    return stock_text
 
 @tool
 def get_supply(input_text: str) -> str:
     """Returns supply data for 2024: location, article, and quantity sent."""
-    return "\n".join([doc.page_content for doc in supply_docs])
+    return supply_text
 
 @tool
 def get_max_limits(input_text: str) -> str:
     """Returns max quantity allowed for each store/location."""
-    return "\n".join([doc.page_content for doc in max_pcs_docs])
+    return max_pcs_text
 
 # --- 3. Initialize Agent with Tools ---
 tools = [get_stock, get_supply, get_max_limits]
@@ -104,11 +121,15 @@ try:
     for alloc in allocations:
         print(f"Store: {alloc.get('store')}, Article: {alloc.get('article')}, Quantity: {alloc.get('quantity')}")
     
-    # Save to CSV
-    df = pd.DataFrame(allocations)
-    df.to_csv("final_allocations.csv", index=False)
+    # Validate against stock, 2024 supply and store limits, then save to CSV (streamed in chunks)
+    df = plan_from_records(allocations, stores=plan_inputs[2]["store_location"])
+    export_plan(df, "final_allocations.csv", "csv", inputs=plan_inputs)
     print("\n✅ Allocations saved to final_allocations.csv")
 
+except PlanValidationError as e:
+    print(f"\n❌ {e}. Nothing was saved. Violations:")
+    print(e.violations.to_string(index=False))
+
 except Exception as e:
     print("\n❌ Failed to parse response as JSON. Here's the raw response:")
     print(response)
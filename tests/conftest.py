@@ -0,0 +1,70 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The app's modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from article_families import ArticleFamilies, FamilyConstraints, FamilyRule  # noqa: E402
+from demand_scoring import compute_demand_scores  # noqa: E402
+
+
+class Network:
+    """Random stock, 2024 supply and store capacity tables, as the PDFs parse into."""
+
+    def __init__(self, seed, n_stores=30, n_articles=300, n_godowns=1):
+        rng = np.random.default_rng(seed)
+        self.rng = rng
+        articles = np.array([f"{prefix}{number:03d}"
+                             for prefix, number in zip(rng.choice(list("JKL"), n_articles),
+                                                       range(n_articles))])
+        stores = [f"STORE {i}" for i in range(n_stores)]
+        self.articles, self.stores = articles, stores
+
+        # Shallow stock, so stores compete for the same pieces
+        self.godown_stocks = {
+            f"G{g}": pd.DataFrame({
+                "article_number": rng.choice(articles, n_articles * 2 // 3, replace=False),
+                "quantity_available": rng.integers(0, 4, n_articles * 2 // 3)})
+            for g in range(n_godowns)}
+        self.df_stock = self.godown_stocks["G0"]
+        self.df_supply = pd.DataFrame({
+            "store_location": rng.choice(stores, n_stores * 15),
+            "article_number": rng.choice(articles, n_stores * 15),
+            "quantity_supplied_2024": rng.integers(1, 10, n_stores * 15)})
+        self.df_max = pd.DataFrame({"store_location": stores,
+                                    "max_quantity": rng.integers(0, 40, n_stores)})
+
+    def demand_scores(self):
+        clusters = {store: f"C{i % 3}" for i, store in enumerate(self.stores) if i % 4}
+        return compute_demand_scores(self.df_supply, clusters)
+
+    def family_constraints(self):
+        rules = [FamilyRule("J", max_per_store=2),
+                 FamilyRule("K0", max_per_store=1, exclude_stores=(self.stores[1], self.stores[2])),
+                 FamilyRule("L1", exclude_stores=("*",))]
+        return FamilyConstraints(ArticleFamilies(self.articles), rules)
+
+    def family_violations(self, plan, family_constraints):
+        """Plan lines that break a family exclusion, and (store, cap group) counts over their cap."""
+        stores = plan["store_location"].astype(str)
+        articles = plan["article_number"].astype(str)
+        excluded = [article in family_constraints.excluded_for(store)
+                    for store, article in zip(stores, articles)]
+        group = articles.map(family_constraints.group_of)
+        counts = plan[group.notna()].groupby([stores[group.notna()], group[group.notna()]]).size()
+        limits = [family_constraints.limits[int(g)] for g in counts.index.get_level_values(1)]
+        return plan[excluded], counts[counts.to_numpy() > np.array(limits, dtype=np.int64)]
+
+
+@pytest.fixture
+def make_network():
+    return Network
+
+
+@pytest.fixture(params=range(8))
+def network(request):
+    return Network(request.param)
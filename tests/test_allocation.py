@@ -0,0 +1,40 @@
+import pytest
+
+import allocation
+from allocation import (allocation_from_picks, build_fair_share_plan, build_network_plan,
+                        create_allocation, get_available_articles, select_top_articles)
+from extraction import build_logic_inputs
+from plan_validation import validate_plan
+
+
+@pytest.mark.parametrize("with_demand", [False, True])
+@pytest.mark.parametrize("block_cells", [allocation.TOP_K_BLOCK_CELLS, 500])
+def test_picks_match_create_allocation(network, with_demand, block_cells, monkeypatch):
+    monkeypatch.setattr(allocation, "TOP_K_BLOCK_CELLS", block_cells)
+    store_capacities, godown_stock, articles_sent_in_2024 = build_logic_inputs(
+        network.df_stock, network.df_supply, network.df_max)
+    demand_scores = network.demand_scores() if with_demand else None
+
+    available_articles = get_available_articles(store_capacities, godown_stock, articles_sent_in_2024)
+    picks = select_top_articles(store_capacities, godown_stock, articles_sent_in_2024, demand_scores)
+    for store in store_capacities:
+        assert allocation_from_picks(store, store_capacities, godown_stock, picks[store]) == \
+            create_allocation(store, store_capacities, godown_stock, available_articles, demand_scores)
+
+
+@pytest.mark.parametrize("build_plan", [build_network_plan, build_fair_share_plan])
+@pytest.mark.parametrize("with_demand", [False, True])
+@pytest.mark.parametrize("with_families", [False, True])
+def test_plans_are_valid(network, build_plan, with_demand, with_families):
+    store_capacities, godown_stock, articles_sent_in_2024 = build_logic_inputs(
+        network.df_stock, network.df_supply, network.df_max)
+    family_constraints = network.family_constraints() if with_families else None
+
+    plan = build_plan(store_capacities, godown_stock, articles_sent_in_2024,
+                      demand_scores=network.demand_scores() if with_demand else None,
+                      family_constraints=family_constraints)
+    assert len(plan)
+    assert validate_plan(plan, network.df_stock, network.df_supply, network.df_max).empty
+    if family_constraints is not None:
+        excluded, over_cap = network.family_violations(plan, family_constraints)
+        assert excluded.empty and over_cap.empty
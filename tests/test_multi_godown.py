@@ -0,0 +1,149 @@
+import pandas as pd
+import pytest
+
+from allocation import NO_DEMAND
+from demand_scoring import NETWORK_CLUSTER
+from multi_godown import build_multi_godown_plan, combine_godown_stock
+from plan_validation import validate_plan
+
+
+def reference_plan(store_capacities, godown_stocks, articles_sent_in_2024,
+                   godown_preferences=None, demand_scores=None, family_constraints=None):
+    """build_multi_godown_plan written as plain loops over stores, articles and ledger lines."""
+    ledger = combine_godown_stock(godown_stocks)
+    ledger = ledger[ledger["quantity_available"] > 0].reset_index(drop=True)
+    lines = list(zip(ledger["godown"], ledger["article_number"], ledger["quantity_available"]))
+    remaining = [quantity for _, _, quantity in lines]
+    articles = list(dict.fromkeys(ledger["article_number"]))
+    article_total = {article: 0 for article in articles}
+    for _, article, quantity in lines:
+        article_total[article] += quantity
+
+    godowns = list(godown_stocks)
+    ranked = {}
+    if godown_preferences is not None and len(godown_preferences):
+        for store, godown, rank in godown_preferences.itertuples(index=False):
+            ranked[store, godown] = rank
+    unranked = max(ranked.values()) + 1 if ranked else 0
+
+    def preference(store, line):
+        godown = lines[line][0]
+        return ranked.get((store, godown), unranked + godowns.index(godown)), line
+
+    def offer_order(store):
+        keys = {}
+        if demand_scores is not None:
+            keys = demand_scores.rank_keys[demand_scores.store_cluster.get(store, NETWORK_CLUSTER)]
+        order = {article: position for position, article in enumerate(articles)}
+        return sorted(articles, key=lambda article: (
+            tuple(-key for key in keys.get(article, NO_DEMAND)), -article_total[article], order[article]))
+
+    group_of = family_constraints.group_of if family_constraints is not None else {}
+    capacity_left = dict(store_capacities)
+    taken = {store: set(articles_sent_in_2024.get(store, ())) for store in store_capacities}
+    family_left = {}
+    for store in store_capacities:
+        if family_constraints is not None:
+            taken[store] |= family_constraints.excluded_for(store)
+            family_left[store] = list(family_constraints.limits)
+    offers = {store: offer_order(store) for store in store_capacities}
+
+    store_order = {store: position for position, store in enumerate(store_capacities)}
+    plan = []
+    while True:
+        # Every store proposes its best takeable articles, each from its best godown
+        proposed = []
+        for store in store_capacities:
+            used, count = {}, 0
+            for article in offers[store]:
+                if count >= capacity_left[store]:
+                    break
+                group = group_of.get(article)
+                if article in taken[store] or (
+                        group is not None and used.get(group, 0) >= family_left[store][group]):
+                    continue
+                in_stock = [line for line, (_, line_article, _) in enumerate(lines)
+                            if line_article == article and remaining[line] > 0]
+                if not in_stock:
+                    continue
+                proposed.append((min(in_stock, key=lambda line: preference(store, line)), store))
+                used[group] = used.get(group, 0) + 1
+                count += 1
+        if not proposed:
+            break
+
+        # Each line serves the stores proposing it in store order
+        proposed.sort(key=lambda pair: (pair[0], store_order[pair[1]]))
+        for line, store in proposed:
+            if remaining[line] > 0:
+                article = lines[line][1]
+                remaining[line] -= 1
+                capacity_left[store] -= 1
+                taken[store].add(article)
+                group = group_of.get(article)
+                if group is not None:
+                    family_left[store][group] -= 1
+                plan.append((store, line))
+
+    # Grouped by store, deepest stock first, in commit order otherwise
+    plan.sort(key=lambda pair: (store_order[pair[0]], -article_total[lines[pair[1]][1]]))
+    return pd.DataFrame({
+        "store_location": pd.Categorical([store for store, _ in plan], categories=list(store_capacities)),
+        "article_number": pd.Categorical([lines[line][1] for _, line in plan], categories=articles),
+        "godown": pd.Categorical([lines[line][0] for _, line in plan], categories=godowns),
+        "quantity": pd.Series(1, index=range(len(plan)), dtype="int32"),
+        "available_in_godown": pd.Series([lines[line][2] for _, line in plan], dtype="int32"),
+    })
+
+
+def multi_godown_inputs(make_network, seed, with_preferences):
+    network = make_network(seed, n_stores=20, n_articles=150, n_godowns=3)
+    store_capacities = dict(zip(network.df_max["store_location"], network.df_max["max_quantity"]))
+    articles_sent_in_2024 = {
+        store: frozenset(articles)
+        for store, articles in network.df_supply.groupby("store_location")["article_number"]}
+    preferences = None
+    if with_preferences:
+        # Two ranked godowns per store; the third comes after them
+        preferences = pd.DataFrame(
+            [(store, godown, rank) for store in network.stores
+             for rank, godown in enumerate(network.rng.permutation(list(network.godown_stocks))[:2])],
+            columns=["store_location", "godown", "rank"])
+    return network, store_capacities, articles_sent_in_2024, preferences
+
+
+@pytest.mark.parametrize("seed", range(6))
+@pytest.mark.parametrize("with_preferences", [False, True])
+@pytest.mark.parametrize("with_demand", [False, True])
+@pytest.mark.parametrize("with_families", [False, True])
+def test_matches_reference(make_network, seed, with_preferences, with_demand, with_families):
+    network, store_capacities, articles_sent_in_2024, preferences = multi_godown_inputs(
+        make_network, seed, with_preferences)
+    options = dict(demand_scores=network.demand_scores() if with_demand else None,
+                   family_constraints=network.family_constraints() if with_families else None)
+
+    plan = build_multi_godown_plan(store_capacities, network.godown_stocks, articles_sent_in_2024,
+                                   preferences, **options)
+    expected = reference_plan(store_capacities, network.godown_stocks, articles_sent_in_2024,
+                              preferences, **options)
+    assert len(plan)
+    pd.testing.assert_frame_equal(plan, expected)
+
+
+@pytest.mark.parametrize("seed", range(6))
+@pytest.mark.parametrize("with_demand", [False, True])
+@pytest.mark.parametrize("with_families", [False, True])
+def test_plan_is_valid(make_network, seed, with_demand, with_families):
+    network, store_capacities, articles_sent_in_2024, preferences = multi_godown_inputs(
+        make_network, seed, True)
+    family_constraints = network.family_constraints() if with_families else None
+
+    plan = build_multi_godown_plan(
+        store_capacities, network.godown_stocks, articles_sent_in_2024, preferences,
+        demand_scores=network.demand_scores() if with_demand else None,
+        family_constraints=family_constraints)
+    df_stock = combine_godown_stock(network.godown_stocks)
+    assert validate_plan(plan, df_stock, network.df_supply, network.df_max).empty
+    if family_constraints is not None:
+        excluded, over_cap = network.family_violations(plan, family_constraints)
+        assert excluded.empty and over_cap.empty